@@ -0,0 +1,157 @@
+from fastapi import APIRouter, Depends, status
+
+from app.core.deps import verify_admin_key
+from app.core.scheduler import scheduler
+from app.core.utils import HTTPMessageException, Message
+from app.recommendation_systems.model_store import model_server, model_store
+
+router = APIRouter(prefix="/admin", dependencies=[Depends(verify_admin_key)])
+
+
+def model_versions_data(manifest: dict) -> dict:
+    return {
+        **manifest,
+        "serving": manifest["pinned"] or manifest["latest"],
+        # other workers pick up a change on their next watcher tick
+        "worker_version": model_server.version,
+    }
+
+
+async def serve_pinned_version(manifest: dict, previous_pinned: str | None) -> None:
+    """
+    Load the version `manifest` says should be served in this worker. A version that fails to load or validate is not
+    served, the previous pin is then restored and a 422 `HTTPMessageException` is raised.
+    """
+    target = manifest["pinned"] or manifest["latest"]
+    await model_server.refresh()
+    if target is None or model_server.version == target:
+        return
+
+    model_store.restore_pin(manifest["pinned"], previous_pinned)
+    reason = model_server.rejected_versions.get(target, "it could not be loaded")
+    raise HTTPMessageException(
+        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        message=f"Model version {target} was rejected ({reason}), still serving {model_server.version}",
+    )
+
+
+@router.get("/models", name="get_model_versions")
+async def get_model_versions():
+    return Message(
+        message="Model versions",
+        status_code=status.HTTP_200_OK,
+        success=True,
+        data=model_versions_data(model_store.read_manifest()),
+    )
+
+
+@router.post("/models/pin/{version}", name="pin_model_version")
+async def pin_model_version(version: str):
+    """Serve `version` until it is unpinned, regardless of newer versions being published"""
+    try:
+        manifest, previous_pinned = model_store.pin(version)
+    except ValueError as exc:
+        raise HTTPMessageException(
+            status_code=status.HTTP_404_NOT_FOUND, message=str(exc)
+        )
+
+    await serve_pinned_version(manifest, previous_pinned)
+
+    return Message(
+        message=f"Model version {version} pinned",
+        status_code=status.HTTP_200_OK,
+        success=True,
+        data=model_versions_data(manifest),
+    )
+
+
+@router.delete("/models/pin", name="unpin_model_version")
+async def unpin_model_version():
+    """Go back to serving the latest published version"""
+    manifest, previous_pinned = model_store.unpin()
+
+    await serve_pinned_version(manifest, previous_pinned)
+
+    return Message(
+        message="Model version unpinned, serving the latest version",
+        status_code=status.HTTP_200_OK,
+        success=True,
+        data=model_versions_data(manifest),
+    )
+
+
+@router.post("/models/rollback", name="rollback_model_version")
+async def rollback_model_version():
+    """Pin the version published before the one currently being served"""
+    try:
+        manifest, previous_pinned = model_store.rollback()
+    except ValueError as exc:
+        raise HTTPMessageException(
+            status_code=status.HTTP_400_BAD_REQUEST, message=str(exc)
+        )
+
+    await serve_pinned_version(manifest, previous_pinned)
+
+    return Message(
+        message=f"Model version rolled back to {manifest['pinned']}",
+        status_code=status.HTTP_200_OK,
+        success=True,
+        data=model_versions_data(manifest),
+    )
+
+
+@router.get("/jobs", name="get_jobs")
+async def get_jobs():
+    """Background jobs with their shared state (last run, durations, lease) and this worker's run metrics"""
+    return Message(
+        message="Background jobs",
+        status_code=status.HTTP_200_OK,
+        success=True,
+        data=await scheduler.status(),
+    )
+
+
+def ensure_job_exists(name: str) -> None:
+    if name not in scheduler.jobs:
+        raise HTTPMessageException(
+            status_code=status.HTTP_404_NOT_FOUND, message=f"Job {name} does not exist"
+        )
+
+
+@router.get("/jobs/{name}", name="get_job")
+async def get_job(name: str):
+    """The shared state of a job, poll it after starting a run until `state.last_finished_at` is past its start"""
+    ensure_job_exists(name)
+    return Message(
+        message=f"Job {name}",
+        status_code=status.HTTP_200_OK,
+        success=True,
+        data=(await scheduler.status([name]))[0],
+    )
+
+
+@router.post("/jobs/{name}/run", name="run_job", status_code=status.HTTP_202_ACCEPTED)
+async def run_job(name: str):
+    """
+    Start a run of a job in the background of this worker, unless another worker currently holds its lease.
+
+    The run is not awaited, the response has when it started and the job status to poll at `GET /admin/jobs/{name}`.
+    """
+    ensure_job_exists(name)
+
+    if (started_at := await scheduler.start_now(name)) is None:
+        raise HTTPMessageException(
+            status_code=status.HTTP_409_CONFLICT,
+            message=f"Job {name} is already running",
+        )
+
+    return Message(
+        message=f"Job {name} started",
+        status_code=status.HTTP_202_ACCEPTED,
+        success=True,
+        data={
+            "started_at": started_at,
+            "status_url": router.url_path_for("get_job", name=name),
+            "job": (await scheduler.status([name]))[0],
+        },
+    )
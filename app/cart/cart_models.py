@@ -1,14 +1,21 @@
-from pydantic import BaseModel, ConfigDict, Field
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 from typing import Optional, List, Literal
 from bson import ObjectId
+from bson.decimal128 import Decimal128
 from datetime import datetime
+from decimal import Decimal
 
 from app.core.types import PyObjectId
 
+# the largest quantity of a single product in a cart
+MAX_ITEM_QUANTITY = 100
+# `priced_version` of a cart whose totals have to be recomputed
+UNPRICED = -1
+
 
 class CartItemModel(BaseModel):
     product_id: str
-    quantity: int = Field(ge=1, le=100)
+    quantity: int = Field(ge=1, le=MAX_ITEM_QUANTITY)
 
 
 class AddToCartDto(CartItemModel):
@@ -19,6 +26,11 @@ class CartModel(BaseModel):
     id: Optional[PyObjectId] = Field(alias="_id", default=None)
     user_id: str
     cart_items: List[CartItemModel] = []
+    # maintained by every cart update, valid while `priced_version` is the current prices version
+    sub_total: Decimal = Decimal(0)
+    item_count: int = 0
+    priced_version: int = UNPRICED
+    revision: int = 0
 
     created_at: datetime = Field(default_factory=datetime.now)
     updated_at: datetime = Field(default_factory=datetime.now)
@@ -28,3 +40,10 @@ class CartModel(BaseModel):
         arbitrary_types_allowed=True,
         json_encoders={ObjectId: str},
     )
+
+    @field_validator("sub_total", mode="before")
+    @classmethod
+    def convert_sub_total_to_decimal128(cls, value):
+        if isinstance(value, Decimal128):
+            return value.to_decimal()  # Convert Decimal128 → Decimal
+        return value  # Return as is if already Decimal
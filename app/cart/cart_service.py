@@ -0,0 +1,389 @@
+from datetime import datetime
+from decimal import Decimal
+from typing import Any
+
+from bson import ObjectId
+from bson.decimal128 import Decimal128
+from fastapi import status
+from pydantic import TypeAdapter
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.cart.cart_models import MAX_ITEM_QUANTITY, UNPRICED
+from app.core.db import get_collection, MONGO_COLLECTIONS
+from app.core.utils import collection_error_msg, HTTPMessageException
+from app.products.catalog import catalog_cache
+from app.products.product_models import PRODUCT_PRICE_PROJECTION, ProductPriceModel
+
+# validate the prices read at checkout in a single call
+PRICE_LIST_ADAPTER = TypeAdapter(list[ProductPriceModel])
+
+
+async def cart_products(
+    product_ids: list[str], fresh: bool = False
+) -> dict[str, dict[str, Any]]:
+    """
+    Product cards of `product_ids` keyed by id, products that do not exist are left out.
+
+    Cards come from the catalog snapshot, with `fresh` the prices are read from mongodb in a single `$in` query
+    reading only `PRODUCT_PRICE_PROJECTION` (used at checkout, where the price must be the current one), the rest of
+    the card still comes from the snapshot.
+    """
+    if not fresh:
+        return await catalog_cache.get_products(product_ids)
+
+    products_coll = get_collection(MONGO_COLLECTIONS.PRODUCTS)
+    if products_coll is None:
+        raise Exception(
+            collection_error_msg("cart_products", MONGO_COLLECTIONS.PRODUCTS.name)
+        )
+    documents = [
+        doc
+        async for doc in products_coll.find(
+            {"_id": {"$in": [ObjectId(i) for i in product_ids]}},
+            PRODUCT_PRICE_PROJECTION,
+        )
+    ]
+    prices = PRICE_LIST_ADAPTER.validate_python(documents)
+    cards = await catalog_cache.get_products([i.id for i in prices])
+    return {
+        i.id: {**cards[i.id], **i.model_dump(), "selling_price": i.selling_price}
+        for i in prices
+        if i.id in cards
+    }
+
+
+async def hydrate_cart(cart: dict[str, Any], fresh: bool = False) -> dict[str, Any]:
+    """
+    Join the items of a cart with their products, with a dict lookup per item.
+
+    Returns the populated `cart_items` (`product_id` replaced by the product record), the `sub_total` of those items
+    and the `missing_product_ids` of items whose product no longer exists, those items are left out.
+    """
+    products = await cart_products(
+        list({i["product_id"] for i in cart["cart_items"]}), fresh=fresh
+    )
+
+    cart_items, missing_product_ids = [], []
+    sub_total = 0
+    for item in cart["cart_items"]:
+        if (product := products.get(item["product_id"])) is None:
+            missing_product_ids.append(item["product_id"])
+            continue
+        cart_items.append({**item, "product_id": product})
+        sub_total += product["selling_price"] * item["quantity"]
+
+    return {
+        "cart_items": cart_items,
+        "sub_total": sub_total,
+        "missing_product_ids": missing_product_ids,
+    }
+
+
+def item_count(cart: dict[str, Any]) -> int:
+    return sum(i["quantity"] for i in cart["cart_items"])
+
+
+async def price_cart(cart_coll, cart: dict[str, Any]) -> dict[str, Any]:
+    """
+    The cart with up to date `sub_total` and `item_count`.
+
+    The totals maintained by cart updates are used as they are, unless the cart was priced before the current prices
+    version (a price changed since) or they are not in step with the items (a cart from before totals were kept, or
+    an item removed whatever its quantity). They are then recomputed from the catalog snapshot and saved, if the cart
+    did not change meanwhile.
+    """
+    snapshot = await catalog_cache.get()
+    if cart.get("priced_version", UNPRICED) >= snapshot.prices_version and cart.get(
+        "item_count"
+    ) == item_count(cart):
+        return cart
+
+    totals = {
+        "sub_total": Decimal128(str((await hydrate_cart(cart))["sub_total"])),
+        "item_count": item_count(cart),
+        "priced_version": snapshot.prices_version,
+    }
+    await cart_coll.update_one(
+        {"_id": cart["_id"], "revision": cart.get("revision")}, {"$set": totals}
+    )
+    return {**cart, **totals}
+
+
+def totals_update(
+    price: Decimal | None, quantity: int, prices_version: int
+) -> dict[str, dict[str, Any]]:
+    """
+    Update operators keeping the totals of a cart in step with `quantity` (negative when removed) items of a product.
+
+    `priced_version` only moves down, so totals incremented with a stale snapshot are recomputed by `price_cart`.
+    """
+    if price is None:
+        # the product no longer exists, its price is unknown
+        return {
+            "$inc": {"item_count": quantity, "revision": 1},
+            "$set": {"priced_version": UNPRICED},
+        }
+    return {
+        "$inc": {
+            "sub_total": Decimal128(str(price * quantity)),
+            "item_count": quantity,
+            "revision": 1,
+        },
+        "$min": {"priced_version": prices_version},
+    }
+
+
+def merge_updates(*updates: dict[str, dict[str, Any]]) -> dict[str, dict[str, Any]]:
+    merged: dict[str, dict[str, Any]] = {}
+    for update in updates:
+        for operator, fields in update.items():
+            merged.setdefault(operator, {}).update(fields)
+    return merged
+
+
+async def get_or_create_cart(cart_coll, user_id: str) -> dict[str, Any]:
+    """The users cart, created empty in the same atomic upsert when the user has none"""
+    now = datetime.now()
+    return await cart_coll.find_one_and_update(
+        {"user_id": user_id},
+        {
+            "$setOnInsert": {
+                "cart_items": [],
+                "sub_total": Decimal128("0"),
+                "item_count": 0,
+                "priced_version": UNPRICED,
+                "revision": 0,
+                "created_at": now,
+                "updated_at": now,
+            }
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def add_cart_item(
+    cart_coll, user_id: str, product_id: str, quantity: int
+) -> dict[str, Any]:
+    """
+    Add `quantity` of a product to the users cart in a single atomic update, returns the updated cart.
+
+    The quantity of an item already in the cart is incremented in place, otherwise the item is pushed (creating the
+    cart when the user has none), the totals are incremented in the same update. Raises a 404 `HTTPMessageException`
+    for a product that does not exist and a 400 one when the item would exceed `MAX_ITEM_QUANTITY`.
+    """
+    snapshot = await catalog_cache.get()
+    if (
+        product := (await catalog_cache.get_products([product_id])).get(product_id)
+    ) is None:
+        raise HTTPMessageException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            message="This product does not exist",
+        )
+    totals = totals_update(product["selling_price"], quantity, snapshot.prices_version)
+
+    now = datetime.now()
+    # the item is in the cart and has room for `quantity` more
+    cart = await cart_coll.find_one_and_update(
+        {
+            "user_id": user_id,
+            "cart_items": {
+                "$elemMatch": {
+                    "product_id": product_id,
+                    "quantity": {"$lte": MAX_ITEM_QUANTITY - quantity},
+                }
+            },
+        },
+        merge_updates(
+            {"$inc": {"cart_items.$.quantity": quantity}, "$set": {"updated_at": now}},
+            totals,
+        ),
+        return_document=ReturnDocument.AFTER,
+    )
+    if cart is not None:
+        return cart
+
+    try:
+        # the item is not in the cart (or there is no cart yet)
+        return await cart_coll.find_one_and_update(
+            {"user_id": user_id, "cart_items.product_id": {"$ne": product_id}},
+            merge_updates(
+                {
+                    "$push": {
+                        "cart_items": {"product_id": product_id, "quantity": quantity}
+                    },
+                    "$set": {"updated_at": now},
+                    "$setOnInsert": {"created_at": now},
+                },
+                totals,
+            ),
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # neither update matched an existing cart, so it holds the item with too little room
+        # (or another request just pushed it, then adding again increments it)
+        cart = await cart_coll.find_one({"user_id": user_id})
+        item = next(
+            (i for i in cart["cart_items"] if i["product_id"] == product_id), None
+        )
+        if item is not None and item["quantity"] + quantity > MAX_ITEM_QUANTITY:
+            raise HTTPMessageException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                message=f"A cart can hold at most {MAX_ITEM_QUANTITY} of a product",
+            )
+        return await add_cart_item(cart_coll, user_id, product_id, quantity)
+
+
+async def remove_cart_item_quantity(
+    cart_coll, user_id: str, product_id: str, quantity: int
+) -> dict[str, Any]:
+    """
+    Remove `quantity` of a product from the users cart, the item is removed when its quantity reaches zero (or the
+    cart holds less than `quantity` of it).
+
+    A single pipeline update decrements the item, drops it at zero and adjusts the totals, so the cart is never seen
+    with a zero quantity item. Returns the updated cart, raises a 404 `HTTPMessageException` when the product is not
+    in the cart.
+    """
+    snapshot = await catalog_cache.get()
+    product = (await catalog_cache.get_products([product_id])).get(product_id)
+
+    removed = "$_removed_quantity"
+    if product is None:
+        # the product no longer exists, its price is unknown
+        totals = {"priced_version": UNPRICED}
+    else:
+        totals = {
+            "sub_total": {
+                "$subtract": [
+                    {"$ifNull": ["$sub_total", Decimal128("0")]},
+                    {
+                        "$multiply": [
+                            Decimal128(str(product["selling_price"])),
+                            removed,
+                        ]
+                    },
+                ]
+            },
+            "priced_version": {
+                "$min": [
+                    {"$ifNull": ["$priced_version", UNPRICED]},
+                    snapshot.prices_version,
+                ]
+            },
+        }
+
+    is_item = {"$eq": ["$$item.product_id", {"$literal": product_id}]}
+    cart = await cart_coll.find_one_and_update(
+        {"user_id": user_id, "cart_items.product_id": product_id},
+        [
+            {
+                "$set": {
+                    "_removed_quantity": {
+                        "$min": [
+                            quantity,
+                            {
+                                "$sum": {
+                                    "$map": {
+                                        "input": "$cart_items",
+                                        "as": "item",
+                                        "in": {
+                                            "$cond": [is_item, "$$item.quantity", 0]
+                                        },
+                                    }
+                                }
+                            },
+                        ]
+                    }
+                }
+            },
+            {
+                "$set": {
+                    "cart_items": {
+                        "$filter": {
+                            "input": {
+                                "$map": {
+                                    "input": "$cart_items",
+                                    "as": "item",
+                                    "in": {
+                                        "$cond": [
+                                            is_item,
+                                            {
+                                                "product_id": "$$item.product_id",
+                                                "quantity": {
+                                                    "$subtract": [
+                                                        "$$item.quantity",
+                                                        quantity,
+                                                    ]
+                                                },
+                                            },
+                                            "$$item",
+                                        ]
+                                    },
+                                }
+                            },
+                            "as": "item",
+                            "cond": {"$gt": ["$$item.quantity", 0]},
+                        }
+                    },
+                    "item_count": {
+                        "$subtract": [{"$ifNull": ["$item_count", 0]}, removed]
+                    },
+                    "revision": {"$add": [{"$ifNull": ["$revision", 0]}, 1]},
+                    "updated_at": datetime.now(),
+                    **totals,
+                }
+            },
+            {"$project": {"_removed_quantity": 0}},
+        ],
+        return_document=ReturnDocument.AFTER,
+    )
+    if cart is None:
+        raise HTTPMessageException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            message="This product is not in your cart",
+        )
+    return cart
+
+
+async def pull_cart_item(cart_coll, user_id: str, product_id: str) -> dict | None:
+    """
+    Remove a product from the users cart whatever its quantity, `None` when the user has no cart. The totals are
+    recomputed on the next `price_cart`.
+    """
+    return await cart_coll.find_one_and_update(
+        {"user_id": user_id},
+        {
+            "$pull": {"cart_items": {"product_id": product_id}},
+            "$set": {"updated_at": datetime.now(), "priced_version": UNPRICED},
+            "$inc": {"revision": 1},
+        },
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def clear_cart(
+    cart_coll, user_id: str, read_cart: dict[str, Any] | None = None
+) -> dict | None:
+    """
+    Remove every item of the users cart, `None` when the user has no cart. Given the cart as it was read, the cart is
+    only cleared if it did not change since (same `revision`), `None` otherwise.
+    """
+    cart_filter = {"user_id": user_id}
+    if read_cart is not None:
+        cart_filter["revision"] = read_cart.get("revision")
+    return await cart_coll.find_one_and_update(
+        cart_filter,
+        {
+            "$set": {
+                "cart_items": [],
+                "sub_total": Decimal128("0"),
+                "item_count": 0,
+                "updated_at": datetime.now(),
+            },
+            "$inc": {"revision": 1},
+        },
+        return_document=ReturnDocument.AFTER,
+    )
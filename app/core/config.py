@@ -50,6 +50,102 @@ class Settings(BaseSettings):
     SMTP_SSL: bool = False
     EMAILS_FROM_EMAIL: str | None = None
     EMAILS_FROM_NAME: str | None = None
+    # email templates are compiled once, their bytecode is cached in this directory (the system temp directory when
+    # unset), with `EMAIL_TEMPLATES_INLINE_CSS` their CSS is inlined with premailer once per template
+    EMAIL_TEMPLATES_BYTECODE_CACHE_DIR: str | None = None
+    EMAIL_TEMPLATES_INLINE_CSS: bool = False
+    # emails are stored in the `emailOutbox` collection by request handlers and sent by a background worker,
+    # which polls every interval (or right away on an email enqueued by the same process) over pooled SMTP connections
+    EMAIL_OUTBOX_WORKER_ENABLED: bool = True
+    EMAIL_OUTBOX_BATCH_SIZE: int = 50
+    EMAIL_OUTBOX_POLL_INTERVAL_SECONDS: float = 5
+    # a failed send is retried after `RETRY_BASE * 2 ** (attempts - 1)` seconds, capped at `RETRY_MAX`
+    EMAIL_OUTBOX_MAX_ATTEMPTS: int = 5
+    EMAIL_OUTBOX_RETRY_BASE_SECONDS: float = 30
+    EMAIL_OUTBOX_RETRY_MAX_SECONDS: float = 60 * 60
+    # an email claimed by a worker that did not finish sending it is claimed again after this long
+    EMAIL_OUTBOX_LOCK_SECONDS: float = 5 * 60
+    # sent emails are removed from the outbox after this long
+    EMAIL_OUTBOX_RETENTION_SECONDS: int = 7 * 24 * 60 * 60
+    SMTP_POOL_SIZE: int = 2
+    SMTP_TIMEOUT_SECONDS: float = 30
+    # pooled connections idle for longer are closed instead of reused
+    SMTP_IDLE_SECONDS: float = 60
+
+    # "tfidf" fits a `TfidfVectorizer` on the whole catalog in memory,
+    # "hashing" streams products from mongodb in batches into a hashed TF-IDF index (for very large catalogs), when no
+    # model version with a content index is served each worker builds one in the background per catalog version
+    CONTENT_FEATURIZER: Literal["tfidf", "hashing"] = "tfidf"
+    CONTENT_FEATURIZER_BATCH_SIZE: int = 1000
+    CONTENT_FEATURIZER_N_JOBS: int = 1
+    # storage format of recommender similarity matrices and embeddings ("float64", "float32" or "int8")
+    SIMILARITY_DTYPE: Literal["float64", "float32", "int8"] = "float32"
+
+    # default number of products read from mongodb per batch by the NDJSON catalog export
+    EXPORT_BATCH_SIZE: int = 500
+
+    # process-wide product catalog snapshot, the catalog version is checked at most every
+    # `CATALOG_REFRESH_INTERVAL_SECONDS` and the snapshot is reloaded at least every `CATALOG_MAX_AGE_SECONDS`
+    CATALOG_REFRESH_INTERVAL_SECONDS: float = 5
+    CATALOG_MAX_AGE_SECONDS: float = 5 * 60
+
+    # "memory" searches an inverted index built from the catalog snapshot, "mongo" uses a mongodb text index
+    SEARCH_BACKEND: Literal["memory", "mongo"] = "memory"
+
+    # autocomplete suggests product names and the most searched queries (searched at least
+    # `AUTOCOMPLETE_MIN_QUERY_COUNT` times), its index is rebuilt when the catalog changes or every interval
+    AUTOCOMPLETE_MAX_QUERIES: int = 1000
+    AUTOCOMPLETE_MIN_QUERY_COUNT: int = 3
+    AUTOCOMPLETE_REBUILD_INTERVAL_SECONDS: float = 5 * 60
+
+    # home listing sections are built concurrently, a section slower than its timeout returns its last result
+    HOME_SECTION_TIMEOUT_SECONDS: float = 1
+    # per-section overrides, the recommender sections may train a model when no model version is served
+    HOME_SECTION_TIMEOUTS_SECONDS: dict[str, float] = {
+        "similar_to_recent_view": 3,
+        "might_interest_you": 3,
+    }
+    # number of section results kept for the fallback, per section and user (or location, age, recent views)
+    HOME_SECTION_CACHE_SIZE: int = 10_000
+    # recommender sections train their model per request when no model version is served, at most this many such
+    # trainings run at a time per section and worker (a training keeps its thread after its section timed out), a
+    # section that finds every slot taken returns its last result
+    HOME_SECTION_FALLBACK_CONCURRENCY: int = 1
+
+    # the same_location and age_range sections show each user a window of the matching products, moved this often
+    HOME_SECTION_ROTATION_SECONDS: float = 60 * 60
+
+    # seed of the home listing explore section, unset for a different random selection on every request
+    EXPLORE_SEED: int | None = None
+
+    # cached catalog responses (categories, products, anonymous home listing), bodies are kept in an in-process LRU and
+    # their ETag changes with the catalog and ratings versions, which are read at most every version TTL
+    RESPONSE_CACHE_MAX_AGE_SECONDS: int = 60
+    RESPONSE_CACHE_MAX_ENTRIES: int = 1000
+    RESPONSE_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    RESPONSE_CACHE_VERSION_TTL_SECONDS: float = 1
+
+    # versioned recommender models, defaults to the `models` directory at the project root
+    MODEL_STORE_DIR: str | None = None
+    MODEL_STORE_KEEP_VERSIONS: int = 5
+    MODEL_WATCH_INTERVAL_SECONDS: float = 30
+
+    # background jobs, run in a single worker at a time using a lease document in mongodb
+    SCHEDULER_ENABLED: bool = True
+    # how often a worker checks whether a job is due (interval elapsed or data-change threshold reached)
+    SCHEDULER_TICK_SECONDS: float = 60
+    SCHEDULER_JITTER_SECONDS: float = 15
+    CF_RETRAIN_INTERVAL_SECONDS: float = 6 * 60 * 60
+    # retrain early once this many new ratings were added
+    CF_RETRAIN_RATING_THRESHOLD: int = 500
+    CONTENT_INDEX_REBUILD_INTERVAL_SECONDS: float = 24 * 60 * 60
+    # rebuild early once this many new products were added
+    CONTENT_INDEX_REBUILD_PRODUCT_THRESHOLD: int = 100
+    # product rating statistics are maintained on every rating, the reconcile job only repairs drift
+    RATING_STATS_RECONCILE_INTERVAL_SECONDS: float = 24 * 60 * 60
+
+    # required in the `x-admin-key` header of `/admin` endpoints, admin endpoints are disabled when unset
+    ADMIN_API_KEY: str | None = None
 
     # apply `parse_cors` before
     BACKEND_CORS_ORIGINS: Annotated[list[AnyUrl] | str, BeforeValidator(parse_cors)] = (
@@ -1,5 +1,6 @@
 from .config import settings
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+from pymongo import ASCENDING, DESCENDING, TEXT
 from typing import Union
 
 from enum import Enum
@@ -16,6 +17,9 @@ class MONGO_COLLECTIONS(Enum):
     PRODUCT_RATINGS = "productRatings"
     CARTS = "carts"
     ORDERS = "orders"
+    JOB_LEASES = "jobLeases"
+    COUNTERS = "counters"
+    EMAIL_OUTBOX = "emailOutbox"
 
 
 def get_collection(
@@ -34,3 +38,50 @@ def get_collection(
     except ArithmeticError as e:
         print(f"ArithmeticError: {e}")
         return None
+
+
+async def ensure_indexes():
+    """Create the indexes the read paths rely on, creating an index that already exists is a no-op"""
+    # ratings of a product, newest first
+    await db.get_collection(MONGO_COLLECTIONS.PRODUCT_RATINGS.value).create_index(
+        [("product_id", ASCENDING), ("created_at", DESCENDING)]
+    )
+    # trending products
+    await db.get_collection(MONGO_COLLECTIONS.PRODUCTS.value).create_index(
+        [("avg_rating", DESCENDING), ("rating_count", DESCENDING)]
+    )
+    # keyset pagination of a category, newest first
+    await db.get_collection(MONGO_COLLECTIONS.PRODUCTS.value).create_index(
+        [("category_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]
+    )
+    # keyset pagination of a users orders, newest first
+    await db.get_collection(MONGO_COLLECTIONS.ORDERS.value).create_index(
+        [("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]
+    )
+    # ratings given by a user
+    await db.get_collection(MONGO_COLLECTIONS.PRODUCT_RATINGS.value).create_index(
+        [("user_id", ASCENDING), ("product_id", ASCENDING)]
+    )
+    # one cart per user, cart updates upsert on `user_id`
+    await db.get_collection(MONGO_COLLECTIONS.CARTS.value).create_index(
+        [("user_id", ASCENDING)], unique=True
+    )
+    # due emails of the outbox, and emails whose claim expired
+    await db.get_collection(MONGO_COLLECTIONS.EMAIL_OUTBOX.value).create_index(
+        [("status", ASCENDING), ("next_attempt_at", ASCENDING)]
+    )
+    await db.get_collection(MONGO_COLLECTIONS.EMAIL_OUTBOX.value).create_index(
+        [("claim_id", ASCENDING)], sparse=True
+    )
+    # sent emails expire, failed ones are kept for inspection
+    await db.get_collection(MONGO_COLLECTIONS.EMAIL_OUTBOX.value).create_index(
+        [("sent_at", ASCENDING)],
+        expireAfterSeconds=settings.EMAIL_OUTBOX_RETENTION_SECONDS,
+    )
+    if settings.SEARCH_BACKEND == "mongo":
+        # product search, a collection can only have one text index
+        await db.get_collection(MONGO_COLLECTIONS.PRODUCTS.value).create_index(
+            [("product_name", TEXT), ("product_description", TEXT)],
+            weights={"product_name": 2, "product_description": 1},
+            name="product_text_search",
+        )
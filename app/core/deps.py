@@ -1,3 +1,4 @@
+import secrets
 from bson import ObjectId
 from fastapi.responses import RedirectResponse
 from fastapi import Depends, Header, status, Request, HTTPException
@@ -92,3 +93,23 @@ async def get_current_user(authorization: TokenFromHeaderDep = None) -> UserMode
 
 
 CurrentUserDep = Annotated[UserModel, Depends(get_current_user)]
+
+
+AdminKeyFromHeaderDep = Annotated[Union[str, None], Header()]
+
+
+async def verify_admin_key(x_admin_key: AdminKeyFromHeaderDep = None) -> None:
+    if settings.ADMIN_API_KEY is None:
+        raise HTTPMessageException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            message="Admin endpoints are disabled",
+            success=False,
+        )
+    if x_admin_key is None or not secrets.compare_digest(
+        x_admin_key, settings.ADMIN_API_KEY
+    ):
+        raise HTTPMessageException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            message="Invalid admin key",
+            success=False,
+        )
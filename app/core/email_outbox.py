@@ -0,0 +1,336 @@
+import asyncio
+import logging
+import random
+import smtplib
+import threading
+import time
+from contextlib import suppress
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from email.utils import formataddr
+from secrets import token_hex
+from typing import Any
+
+from bson import ObjectId
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.db import get_collection, MONGO_COLLECTIONS
+from app.core.utils import collection_error_msg
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class OUTBOX_STATUS:
+    PENDING = "pending"
+    SENDING = "sending"
+    SENT = "sent"
+    FAILED = "failed"
+
+
+async def enqueue_email(*, email_to: str, subject: str, html_content: str) -> str:
+    """
+    Store an email in the outbox and return its id, it is sent by the outbox worker.
+
+    Request handlers only enqueue, the SMTP exchange happens in the background and failed sends are retried.
+    """
+    assert settings.emails_enabled, "no provided configuration for email variables"
+    outbox_coll = get_collection(MONGO_COLLECTIONS.EMAIL_OUTBOX)
+    if outbox_coll is None:
+        raise Exception(
+            collection_error_msg("enqueue_email", MONGO_COLLECTIONS.EMAIL_OUTBOX.name)
+        )
+
+    now = datetime.now()
+    inserted = await outbox_coll.insert_one(
+        {
+            "email_to": email_to,
+            "subject": subject,
+            "html_content": html_content,
+            "status": OUTBOX_STATUS.PENDING,
+            "attempts": 0,
+            "next_attempt_at": now,
+            "last_error": None,
+            "created_at": now,
+            "sent_at": None,
+        }
+    )
+    # the worker of this process picks the email up right away instead of at its next poll
+    email_outbox_worker.wake_up()
+    return str(inserted.inserted_id)
+
+
+def build_message(email: dict[str, Any]) -> EmailMessage:
+    message = EmailMessage()
+    message["Subject"] = email["subject"]
+    message["From"] = formataddr(
+        (settings.EMAILS_FROM_NAME, settings.EMAILS_FROM_EMAIL)
+    )
+    message["To"] = email["email_to"]
+    message.set_content(email["html_content"], subtype="html")
+    return message
+
+
+def is_permanent_failure(exc: Exception) -> bool:
+    """5xx replies (e.g. every recipient refused) fail the same way on every attempt, they are not retried"""
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in exc.recipients.values())
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return exc.smtp_code >= 500
+    return False
+
+
+class SMTPConnectionPool:
+    """
+    Up to `size` open SMTP connections reused across batches, connections idle for more than `idle_seconds` are closed
+    (servers drop them anyway). Connections are used from threads, one thread at a time per connection.
+
+    Any SMTP server works, including a local stand-in for development and tests, e.g.
+    `python -m aiosmtpd -n -l localhost:1025` with `SMTP_HOST=localhost SMTP_PORT=1025 SMTP_TLS=false`.
+    """
+
+    def __init__(self, size: int, idle_seconds: float, timeout: float):
+        self.size = size
+        self.idle_seconds = idle_seconds
+        self.timeout = timeout
+        # idle connections with the time they were released
+        self._idle: list[tuple[smtplib.SMTP, float]] = []
+        self._lock = threading.Lock()
+
+    def _connect(self) -> smtplib.SMTP:
+        # STARTTLS takes precedence over implicit TLS when both are set
+        if not settings.SMTP_TLS and settings.SMTP_SSL:
+            connection = smtplib.SMTP_SSL(
+                settings.SMTP_HOST, settings.SMTP_PORT, timeout=self.timeout
+            )
+        else:
+            connection = smtplib.SMTP(
+                settings.SMTP_HOST, settings.SMTP_PORT, timeout=self.timeout
+            )
+            if settings.SMTP_TLS:
+                connection.starttls()
+        connection.ehlo_or_helo_if_needed()
+        # a local stand-in server does not advertise AUTH
+        if (
+            settings.SMTP_USER_EMAIL
+            and settings.SMTP_PASSWORD
+            and connection.has_extn("auth")
+        ):
+            connection.login(settings.SMTP_USER_EMAIL, settings.SMTP_PASSWORD)
+        return connection
+
+    @staticmethod
+    def _quit(connection: smtplib.SMTP) -> None:
+        with suppress(Exception):
+            connection.quit()
+
+    def acquire(self) -> smtplib.SMTP:
+        while True:
+            with self._lock:
+                if len(self._idle) <= 0:
+                    break
+                connection, released_at = self._idle.pop()
+            if time.monotonic() - released_at >= self.idle_seconds:
+                self._quit(connection)
+                continue
+            try:
+                if connection.noop()[0] == 250:
+                    return connection
+            except smtplib.SMTPException:
+                pass
+            self._quit(connection)
+        return self._connect()
+
+    def release(self, connection: smtplib.SMTP, broken: bool = False) -> None:
+        with self._lock:
+            if not broken and len(self._idle) < self.size:
+                self._idle.append((connection, time.monotonic()))
+                return
+        self._quit(connection)
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            self._quit(connection)
+
+
+class EmailOutboxWorker:
+    """
+    Sends the emails of the `emailOutbox` collection in the background, started from the app lifespan.
+
+    Every worker process runs one, a batch of due emails is claimed atomically (a claim expires after `lock_seconds`,
+    so emails claimed by a crashed process are sent by another one) and sent over pooled SMTP connections. A failed
+    send is retried with exponential backoff, up to `max_attempts` attempts.
+    """
+
+    def __init__(
+        self,
+        pool: SMTPConnectionPool,
+        batch_size: int,
+        poll_interval: float,
+        max_attempts: int,
+        retry_base: float,
+        retry_max: float,
+        lock_seconds: float,
+    ):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.lock_seconds = lock_seconds
+        self._wake_up: asyncio.Event | None = None
+
+    def wake_up(self) -> None:
+        if self._wake_up is not None:
+            self._wake_up.set()
+
+    def retry_delay(self, attempts: int) -> float:
+        delay = min(self.retry_base * 2 ** (attempts - 1), self.retry_max)
+        # jitter, so emails failing together are not retried together
+        return delay * random.uniform(0.5, 1)
+
+    async def claim_batch(self, outbox_coll) -> list[dict[str, Any]]:
+        """Due emails, and emails whose claim expired, claimed for this batch in a constant number of queries"""
+        now = datetime.now()
+        due = {
+            "$or": [
+                {"status": OUTBOX_STATUS.PENDING, "next_attempt_at": {"$lte": now}},
+                {"status": OUTBOX_STATUS.SENDING, "locked_until": {"$lt": now}},
+            ]
+        }
+        ids = [
+            doc["_id"]
+            async for doc in outbox_coll.find(due, {"_id": 1})
+            .sort("next_attempt_at", 1)
+            .limit(self.batch_size)
+        ]
+        if len(ids) <= 0:
+            return []
+
+        # a concurrent claim of the same email by another worker only matches one of the two updates
+        claim_id = token_hex(8)
+        await outbox_coll.update_many(
+            {"_id": {"$in": ids}, **due},
+            {
+                "$set": {
+                    "status": OUTBOX_STATUS.SENDING,
+                    "claim_id": claim_id,
+                    "locked_until": now + timedelta(seconds=self.lock_seconds),
+                }
+            },
+        )
+        return [doc async for doc in outbox_coll.find({"claim_id": claim_id})]
+
+    def send_chunk(
+        self, emails: list[dict[str, Any]]
+    ) -> list[tuple[ObjectId, Exception | None]]:
+        """Send `emails` over one pooled connection, a dropped connection is re-opened once per email"""
+        results = []
+        connection = self.pool.acquire()
+        try:
+            for email in emails:
+                message = build_message(email)
+                try:
+                    try:
+                        connection.send_message(message)
+                    except smtplib.SMTPServerDisconnected:
+                        self.pool.release(connection, broken=True)
+                        connection = self.pool.acquire()
+                        connection.send_message(message)
+                    results.append((email["_id"], None))
+                except Exception as exc:
+                    results.append((email["_id"], exc))
+        finally:
+            self.pool.release(connection)
+        return results
+
+    async def deliver(
+        self, emails: list[dict[str, Any]]
+    ) -> list[tuple[ObjectId, Exception | None]]:
+        """Send `emails` over the pool connections, returns each email id with the exception its send raised, if any"""
+        # the emails are split across the pool connections, each chunk is sent from a thread
+        chunks = [emails[i :: self.pool.size] for i in range(self.pool.size)]
+        chunks = [i for i in chunks if len(i) > 0]
+        chunk_results = await asyncio.gather(
+            *(run_in_threadpool(self.send_chunk, i) for i in chunks),
+            return_exceptions=True,
+        )
+
+        results: list[tuple[ObjectId, Exception | None]] = []
+        for chunk, chunk_result in zip(chunks, chunk_results):
+            if isinstance(chunk_result, Exception):
+                # no connection could be opened, every email of the chunk failed
+                results += [(email["_id"], chunk_result) for email in chunk]
+            else:
+                results += chunk_result
+        return results
+
+    async def send_batch(self, outbox_coll, emails: list[dict[str, Any]]) -> None:
+        results = await self.deliver(emails)
+        attempts = {email["_id"]: email["attempts"] + 1 for email in emails}
+
+        now = datetime.now()
+        for _id, exc in results:
+            if exc is None:
+                update = {"status": OUTBOX_STATUS.SENT, "sent_at": now}
+            elif attempts[_id] >= self.max_attempts or is_permanent_failure(exc):
+                logger.error(f"  email {_id} failed: {exc}")
+                update = {"status": OUTBOX_STATUS.FAILED, "last_error": str(exc)}
+            else:
+                update = {
+                    "status": OUTBOX_STATUS.PENDING,
+                    "last_error": str(exc),
+                    "next_attempt_at": now
+                    + timedelta(seconds=self.retry_delay(attempts[_id])),
+                }
+            await outbox_coll.update_one(
+                {"_id": _id},
+                {
+                    "$set": {**update, "attempts": attempts[_id]},
+                    "$unset": {"claim_id": "", "locked_until": ""},
+                },
+            )
+
+    async def run_once(self) -> int:
+        """Claim and send one batch, returns the number of emails in it"""
+        outbox_coll = get_collection(MONGO_COLLECTIONS.EMAIL_OUTBOX)
+        if outbox_coll is None:
+            raise Exception(
+                collection_error_msg("run_once", MONGO_COLLECTIONS.EMAIL_OUTBOX.name)
+            )
+        emails = await self.claim_batch(outbox_coll)
+        if len(emails) > 0:
+            await self.send_batch(outbox_coll, emails)
+        return len(emails)
+
+    async def run_forever(self) -> None:
+        self._wake_up = asyncio.Event()
+        while True:
+            try:
+                # a full batch means more emails are probably due
+                if await self.run_once() >= self.batch_size:
+                    continue
+            except Exception as exc:
+                logger.error(f"  email outbox batch failed: {exc}")
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wake_up.wait(), self.poll_interval)
+            self._wake_up.clear()
+
+
+email_outbox_worker = EmailOutboxWorker(
+    pool=SMTPConnectionPool(
+        size=settings.SMTP_POOL_SIZE,
+        idle_seconds=settings.SMTP_IDLE_SECONDS,
+        timeout=settings.SMTP_TIMEOUT_SECONDS,
+    ),
+    batch_size=settings.EMAIL_OUTBOX_BATCH_SIZE,
+    poll_interval=settings.EMAIL_OUTBOX_POLL_INTERVAL_SECONDS,
+    max_attempts=settings.EMAIL_OUTBOX_MAX_ATTEMPTS,
+    retry_base=settings.EMAIL_OUTBOX_RETRY_BASE_SECONDS,
+    retry_max=settings.EMAIL_OUTBOX_RETRY_MAX_SECONDS,
+    lock_seconds=settings.EMAIL_OUTBOX_LOCK_SECONDS,
+)
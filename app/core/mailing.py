@@ -1,11 +1,12 @@
 import logging
+import re
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from typing import Any
 
-import emails
-from jinja2 import Template
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+from premailer import Premailer
 
 from app.core.config import settings
 
@@ -19,37 +20,68 @@ class EmailData:
     subject: str
 
 
-def render_email_template(*, template_name: str, context: dict[str, Any]) -> str:
-    template_str = (
-        Path(__file__).parent.parent.parent / "templates" / template_name
-    ).read_text()
-    html_content = Template(template_str).render(context)
-    return html_content
-
-
-def send_email(
-    *,
-    email_to: str,
-    subject: str = "",
-    html_content: str = "",
-) -> None:
-    assert settings.emails_enabled, "no provided configuration for email variables"
-    message = emails.Message(
-        subject=subject,
-        html=html_content,
-        mail_from=(settings.EMAILS_FROM_NAME, settings.EMAILS_FROM_EMAIL),
+TEMPLATES_DIR = Path(__file__).parent.parent.parent / "templates"
+# compiled when the app starts, the first email of each kind does not pay for it
+EMAIL_TEMPLATES = ("auth_code.html", "code_reset.html", "review_reminder.html")
+
+JINJA_TAG = re.compile(r"\{%.*?%\}|\{\{.*?\}\}|\{#.*?#\}", re.S)
+JINJA_PLACEHOLDER = re.compile(r"<!--jinja-(\d+)-->|jinja-(\d+)-tag")
+
+
+def inline_css(source: str) -> str:
+    """
+    The template source with the CSS of its style tags inlined into `style` attributes (media queries are kept).
+
+    Jinja tags are swapped for placeholders while premailer parses the HTML, it would url-encode them in `href`
+    attributes. Statements become comments, so a `{% for %}` between table rows stays where it is.
+    """
+    tags = []
+
+    def protect(match: re.Match) -> str:
+        tags.append(match.group(0))
+        if match.group(0).startswith("{%"):
+            return f"<!--jinja-{len(tags) - 1}-->"
+        return f"jinja-{len(tags) - 1}-tag"
+
+    html = Premailer(
+        JINJA_TAG.sub(protect, source),
+        disable_validation=True,
+        allow_network=False,
+        cssutils_logging_level=logging.CRITICAL,
+    ).transform()
+    return JINJA_PLACEHOLDER.sub(
+        lambda match: tags[int(match.group(1) or match.group(2))], html
     )
-    smtp_options = {"host": settings.SMTP_HOST, "port": settings.SMTP_PORT}
-    if settings.SMTP_TLS:
-        smtp_options["tls"] = True
-    elif settings.SMTP_SSL:
-        smtp_options["ssl"] = True
-    if settings.SMTP_USER_EMAIL:
-        smtp_options["user"] = settings.SMTP_USER_EMAIL
-    if settings.SMTP_PASSWORD:
-        smtp_options["password"] = settings.SMTP_PASSWORD
-    response = message.send(to=email_to, smtp=smtp_options)
-    logger.info(f"send email result: {response}")
+
+
+class EmailTemplateLoader(FileSystemLoader):
+    """Loads templates from `TEMPLATES_DIR`, with their CSS inlined when `EMAIL_TEMPLATES_INLINE_CSS` is set"""
+
+    def get_source(self, environment: Environment, template: str):
+        source, filename, uptodate = super().get_source(environment, template)
+        if settings.EMAIL_TEMPLATES_INLINE_CSS:
+            source = inline_css(source)
+        return source, filename, uptodate
+
+
+# the environment keeps compiled templates in memory, so a template is read, inlined and compiled once per process
+# (again when its file changes, in debug mode), the bytecode cache lets other workers and restarts skip compiling
+if settings.EMAIL_TEMPLATES_BYTECODE_CACHE_DIR is not None:
+    Path(settings.EMAIL_TEMPLATES_BYTECODE_CACHE_DIR).mkdir(parents=True, exist_ok=True)
+email_env = Environment(
+    loader=EmailTemplateLoader(TEMPLATES_DIR),
+    bytecode_cache=FileSystemBytecodeCache(settings.EMAIL_TEMPLATES_BYTECODE_CACHE_DIR),
+    auto_reload=settings.DEBUG_MODE,
+)
+
+
+def precompile_email_templates() -> None:
+    for template_name in EMAIL_TEMPLATES:
+        email_env.get_template(template_name)
+
+
+def render_email_template(*, template_name: str, context: dict[str, Any]) -> str:
+    return email_env.get_template(template_name).render(context)
 
 
 def request_authcode_email(*, username: str, auth_code: str) -> EmailData:
@@ -0,0 +1,216 @@
+import functools
+import hashlib
+import inspect
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Awaitable, Callable
+
+from fastapi import Request, Response, status
+
+from app.core.config import settings
+from app.core.db import get_collection, MONGO_COLLECTIONS
+from app.core.utils import collection_error_msg, dump_json
+
+# counters whose versions make up the data version of cached responses, see `app.products.catalog`
+VERSION_COUNTER_IDS = ("catalog", "ratings")
+
+# cached endpoints may personalise their response for a signed in user
+VARY_HEADER = {"Vary": "Authorization"}
+
+
+class ResponseCache:
+    """
+    Rendered JSON bodies keyed by ETag, bounded by number of entries and total bytes (least recently used first out).
+
+    ETags are computed from the request URL and the data version (the catalog and ratings counters), so a body is
+    never served after the data it was rendered from changed, and a client holding the current ETag gets a 304
+    without the endpoint running. The time the counters were last bumped is the `Last-Modified` time.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, version_ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.version_ttl = version_ttl
+        self.n_bytes = 0
+        self._bodies: OrderedDict[str, bytes] = OrderedDict()
+        self._version: str | None = None
+        self._modified_at: datetime | None = None
+        self._version_read_at = 0.0
+
+    def get(self, etag: str) -> bytes | None:
+        if (body := self._bodies.get(etag)) is not None:
+            self._bodies.move_to_end(etag)
+        return body
+
+    def set(self, etag: str, body: bytes) -> None:
+        if len(body) > self.max_bytes:
+            return
+        if (previous := self._bodies.pop(etag, None)) is not None:
+            self.n_bytes -= len(previous)
+        self._bodies[etag] = body
+        self.n_bytes += len(body)
+        while len(self._bodies) > self.max_entries or self.n_bytes > self.max_bytes:
+            _, evicted = self._bodies.popitem(last=False)
+            self.n_bytes -= len(evicted)
+
+    async def data_version(self) -> tuple[str, datetime | None]:
+        """
+        The version counters and the time the last one was bumped (`None` for counters never bumped), read from
+        mongodb at most every `version_ttl` seconds
+        """
+        if (
+            self._version is not None
+            and time.monotonic() - self._version_read_at < self.version_ttl
+        ):
+            return self._version, self._modified_at
+
+        counters_coll = get_collection(MONGO_COLLECTIONS.COUNTERS)
+        if counters_coll is None:
+            raise Exception(
+                collection_error_msg("data_version", MONGO_COLLECTIONS.COUNTERS.name)
+            )
+        counters = {
+            doc["_id"]: doc
+            async for doc in counters_coll.find(
+                {"_id": {"$in": list(VERSION_COUNTER_IDS)}}
+            )
+        }
+        self._version = ":".join(
+            str(counters[i]["version"] if i in counters else 0)
+            for i in VERSION_COUNTER_IDS
+        )
+        # mongodb returns naive UTC datetimes
+        modified_at = [
+            i["updated_at"].replace(tzinfo=timezone.utc)
+            for i in counters.values()
+            if i.get("updated_at") is not None
+        ]
+        self._modified_at = max(modified_at) if len(modified_at) > 0 else None
+        self._version_read_at = time.monotonic()
+        return self._version, self._modified_at
+
+
+response_cache = ResponseCache(
+    max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES,
+    max_bytes=settings.RESPONSE_CACHE_MAX_BYTES,
+    version_ttl=settings.RESPONSE_CACHE_VERSION_TTL_SECONDS,
+)
+
+
+def etag_matches(if_none_match: str | None, etag: str, exists: bool) -> bool:
+    """Whether `If-None-Match` matches `etag`, `*` only matches when the representation is known to `exist`"""
+    if if_none_match is None:
+        return False
+    candidates = [i.strip() for i in if_none_match.split(",")]
+    if "*" in candidates:
+        return exists
+    # weak comparison, as required for `If-None-Match`
+    return etag in [i.removeprefix("W/") for i in candidates]
+
+
+def modified_since(if_modified_since: str | None, last_modified: datetime) -> bool:
+    """Whether the representation changed after the `If-Modified-Since` date, `True` without a (valid) date"""
+    if if_modified_since is None:
+        return True
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return True
+    if since.tzinfo is None:
+        return True
+    # HTTP dates have a one second resolution
+    return last_modified.replace(microsecond=0) > since
+
+
+def cache_response(
+    skip: Callable[[dict[str, Any]], bool] | None = None,
+    rotation_seconds: float | None = None,
+):
+    """
+    Cache the JSON response of a `GET` endpoint returning a `Message`, with `ETag`, `Last-Modified` and
+    `Cache-Control` headers. `If-Modified-Since` is only used when the request has no `If-None-Match`.
+
+    `skip` receives the endpoint's keyword arguments and returns `True` for requests that must not be cached (e.g. a
+    signed in user's personalised response), those are served with `Cache-Control: private, no-store`. Every response
+    carries `Vary: Authorization`, so a shared cache never serves a cached anonymous body to a signed in user.
+
+    An endpoint whose response also changes over time (e.g. a section rotating every `HOME_SECTION_ROTATION_SECONDS`)
+    passes `rotation_seconds`, its responses are cached per window of that many seconds, not only per data version.
+    """
+
+    def decorator(endpoint: Callable[..., Awaitable[Any]]):
+        signature = inspect.signature(endpoint)
+
+        @functools.wraps(endpoint)
+        async def wrapper(*args, request: Request, **kwargs):
+            if skip is not None and skip(kwargs):
+                return Response(
+                    content=dump_json(await endpoint(*args, **kwargs)),
+                    media_type="application/json",
+                    headers={"Cache-Control": "private, no-store", **VARY_HEADER},
+                )
+
+            version, last_modified = await response_cache.data_version()
+            max_age = settings.RESPONSE_CACHE_MAX_AGE_SECONDS
+            if rotation_seconds is not None:
+                window = int(time.time() // rotation_seconds)
+                version = f"{version}:{window}"
+                window_start = datetime.fromtimestamp(
+                    window * rotation_seconds, timezone.utc
+                )
+                last_modified = max(last_modified or window_start, window_start)
+                # a client does not keep the response past the end of its window
+                window_end = (window + 1) * rotation_seconds
+                max_age = max(0, min(max_age, int(window_end - time.time())))
+
+            key = f"{version}|{request.url.path}?{sorted(request.query_params.multi_items())}"
+            etag = f'"{hashlib.sha256(key.encode()).hexdigest()[:32]}"'
+            headers = {
+                "ETag": etag,
+                "Cache-Control": f"public, max-age={max_age}",
+                **VARY_HEADER,
+            }
+            if last_modified is not None:
+                headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+
+            if_none_match = request.headers.get("if-none-match")
+            body = response_cache.get(etag)
+            if etag_matches(if_none_match, etag, exists=body is not None) or (
+                if_none_match is None
+                and body is not None
+                and last_modified is not None
+                and not modified_since(
+                    request.headers.get("if-modified-since"), last_modified
+                )
+            ):
+                return Response(
+                    status_code=status.HTTP_304_NOT_MODIFIED, headers=headers
+                )
+
+            if body is None:
+                # raises for a resource that does not exist, so `*` is not matched for it
+                body = dump_json(await endpoint(*args, **kwargs))
+                response_cache.set(etag, body)
+                if etag_matches(if_none_match, etag, exists=True):
+                    return Response(
+                        status_code=status.HTTP_304_NOT_MODIFIED, headers=headers
+                    )
+
+            return Response(
+                content=body, media_type="application/json", headers=headers
+            )
+
+        # FastAPI reads the endpoint parameters from the signature, the wrapper also needs the request
+        wrapper.__signature__ = signature.replace(
+            parameters=[
+                *signature.parameters.values(),
+                inspect.Parameter(
+                    "request", inspect.Parameter.KEYWORD_ONLY, annotation=Request
+                ),
+            ]
+        )
+        return wrapper
+
+    return decorator
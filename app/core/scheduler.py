@@ -0,0 +1,287 @@
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+from contextlib import suppress
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta
+from secrets import token_hex
+from typing import Any, Awaitable, Callable
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.core.config import settings
+from app.core.db import get_collection, MONGO_COLLECTIONS
+from app.core.utils import collection_error_msg
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Job:
+    """
+    A background job run every `interval_seconds`, or earlier once `change_threshold` documents were added to
+    `change_collection` since its last run.
+    """
+
+    name: str
+    func: Callable[[], Awaitable[Any]]
+    interval_seconds: float
+    jitter_seconds: float = 0
+    change_collection: MONGO_COLLECTIONS | None = None
+    change_threshold: int | None = None
+    # a worker that crashes mid-run loses the lease after this long, the lease is renewed while the job runs
+    lease_seconds: float = 10 * 60
+
+
+@dataclass
+class JobMetrics:
+    """Run metrics of a job in this worker"""
+
+    runs: int = 0
+    failures: int = 0
+    last_started_at: datetime | None = None
+    last_status: str | None = None
+    last_duration_seconds: float | None = None
+    max_duration_seconds: float = 0
+    total_duration_seconds: float = 0
+
+
+def is_running(state: dict[str, Any], now: datetime) -> bool:
+    """A job is running while a worker holds its lease"""
+    return state.get("lease_expires_at") is not None and state["lease_expires_at"] > now
+
+
+class Scheduler:
+    """
+    A lightweight asyncio scheduler started from the app lifespan.
+
+    Every uvicorn worker runs the scheduler, but a job only runs in one of them at a time: its state is a document in
+    the `jobLeases` collection and a worker must atomically take the lease (and bump `last_started_at`) before running
+    it, so a due job is run once across all workers.
+    """
+
+    def __init__(self, tick_seconds: float = 60):
+        self.tick_seconds = tick_seconds
+        self.jobs: dict[str, Job] = {}
+        self.metrics: dict[str, JobMetrics] = {}
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{token_hex(4)}"
+        self._tasks: list[asyncio.Task] = []
+        # runs started on demand, referenced until they finish so they are not garbage collected mid-run
+        self._started_runs: set[asyncio.Task] = set()
+
+    def register(self, job: Job) -> None:
+        self.jobs[job.name] = job
+        self.metrics[job.name] = JobMetrics()
+
+    def start(self) -> None:
+        self._tasks = [
+            asyncio.create_task(self._run_forever(job)) for job in self.jobs.values()
+        ]
+
+    async def stop(self) -> None:
+        tasks = [*self._tasks, *self._started_runs]
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            with suppress(asyncio.CancelledError):
+                await task
+        self._tasks = []
+
+    async def _run_forever(self, job: Job) -> None:
+        while True:
+            # jitter spreads the workers (and jobs) so they do not all hit mongodb at the same instant
+            await asyncio.sleep(
+                min(self.tick_seconds, job.interval_seconds)
+                + random.uniform(0, job.jitter_seconds)
+            )
+            try:
+                await self.run_if_due(job.name)
+            except Exception as exc:
+                logger.error(f"  [{job.name}]: scheduler tick failed: {exc}")
+
+    async def _change_count(self, job: Job) -> int | None:
+        if job.change_collection is None:
+            return None
+        coll = get_collection(job.change_collection)
+        if coll is None:
+            raise Exception(
+                collection_error_msg("_change_count", job.change_collection.name)
+            )
+        return await coll.estimated_document_count()
+
+    async def run_if_due(self, name: str, force: bool = False) -> bool:
+        """Run the job if it is due and no other worker holds its lease, returns `True` if it was run here"""
+        lease_coll = get_collection(MONGO_COLLECTIONS.JOB_LEASES)
+        if lease_coll is None:
+            raise Exception(
+                collection_error_msg("run_if_due", MONGO_COLLECTIONS.JOB_LEASES.name)
+            )
+
+        if (started_at := await self._take_lease(name, lease_coll, force)) is None:
+            return False
+        await self._run(self.jobs[name], lease_coll, started_at)
+        return True
+
+    async def start_now(self, name: str) -> datetime | None:
+        """
+        Take the lease of the job and run it in the background of this worker, without waiting for it to finish.
+
+        Returns when the run started, the job state has a `last_finished_at` after it once the run is over, or `None`
+        if another worker currently holds the lease.
+        """
+        lease_coll = get_collection(MONGO_COLLECTIONS.JOB_LEASES)
+        if lease_coll is None:
+            raise Exception(
+                collection_error_msg("start_now", MONGO_COLLECTIONS.JOB_LEASES.name)
+            )
+
+        if (started_at := await self._take_lease(name, lease_coll, True)) is None:
+            return None
+        task = asyncio.create_task(self._run(self.jobs[name], lease_coll, started_at))
+        self._started_runs.add(task)
+        task.add_done_callback(self._started_runs.discard)
+        return started_at
+
+    async def _take_lease(self, name: str, lease_coll, force: bool) -> datetime | None:
+        """Take the lease of the job if it is due (or `force`), returns when the run started, `None` if not taken"""
+        job = self.jobs[name]
+
+        now = datetime.now()
+        state = await lease_coll.find_one({"_id": job.name}) or {}
+        change_count = await self._change_count(job)
+
+        last_started_at = state.get("last_started_at")
+        due = (
+            force
+            or last_started_at is None
+            or now - last_started_at >= timedelta(seconds=job.interval_seconds)
+            or (
+                job.change_threshold is not None
+                and change_count is not None
+                and change_count - state.get("change_count", 0) >= job.change_threshold
+            )
+        )
+        if not due:
+            return None
+
+        # compare-and-set on `last_started_at`: only one worker can move it forward for this run
+        try:
+            lease = await lease_coll.find_one_and_update(
+                {
+                    "_id": job.name,
+                    "last_started_at": last_started_at,
+                    "$or": [
+                        {"lease_expires_at": None},
+                        {"lease_expires_at": {"$lt": now}},
+                    ],
+                },
+                {
+                    "$set": {
+                        "owner": self.worker_id,
+                        "lease_expires_at": now + timedelta(seconds=job.lease_seconds),
+                        "last_started_at": now,
+                        "change_count": change_count or 0,
+                    }
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # the document exists but did not match, another worker holds the lease or already ran it
+            return None
+        if lease is None:
+            return None
+        return now
+
+    async def _renew_lease(self, job: Job, lease_coll) -> None:
+        while True:
+            await asyncio.sleep(job.lease_seconds / 3)
+            await lease_coll.update_one(
+                {"_id": job.name, "owner": self.worker_id},
+                {
+                    "$set": {
+                        "lease_expires_at": datetime.now()
+                        + timedelta(seconds=job.lease_seconds)
+                    }
+                },
+            )
+
+    async def _run(self, job: Job, lease_coll, started_at: datetime) -> None:
+        metrics = self.metrics[job.name]
+        metrics.last_started_at = started_at
+        heartbeat = asyncio.create_task(self._renew_lease(job, lease_coll))
+        start = time.perf_counter()
+        status, error = "success", None
+        try:
+            await job.func()
+        except Exception as exc:
+            status, error = "failed", str(exc)
+            logger.error(f"  [{job.name}]: job failed: {exc}")
+        finally:
+            heartbeat.cancel()
+            with suppress(asyncio.CancelledError):
+                await heartbeat
+
+        duration = time.perf_counter() - start
+        metrics.runs += 1
+        metrics.failures += 1 if status == "failed" else 0
+        metrics.last_status = status
+        metrics.last_duration_seconds = duration
+        metrics.max_duration_seconds = max(metrics.max_duration_seconds, duration)
+        metrics.total_duration_seconds += duration
+        logger.info(f"  [{job.name}]: {status} in {duration:.2f}s")
+
+        await lease_coll.update_one(
+            {"_id": job.name, "owner": self.worker_id},
+            {
+                "$set": {
+                    "lease_expires_at": None,
+                    "last_finished_at": datetime.now(),
+                    "last_status": status,
+                    "last_error": error,
+                    "last_duration_seconds": duration,
+                },
+                "$inc": {
+                    "runs": 1,
+                    "failures": 1 if status == "failed" else 0,
+                    "total_duration_seconds": duration,
+                },
+            },
+        )
+
+    async def status(self, names: list[str] | None = None) -> list[dict[str, Any]]:
+        """
+        Shared job state from mongodb together with the run metrics of this worker, of every job or only of `names`.
+        """
+        lease_coll = get_collection(MONGO_COLLECTIONS.JOB_LEASES)
+        if lease_coll is None:
+            raise Exception(
+                collection_error_msg("status", MONGO_COLLECTIONS.JOB_LEASES.name)
+            )
+        jobs = [self.jobs[i] for i in (names if names is not None else self.jobs)]
+        states = {
+            doc["_id"]: doc
+            async for doc in lease_coll.find({"_id": {"$in": [i.name for i in jobs]}})
+        }
+        now = datetime.now()
+        return [
+            {
+                "name": job.name,
+                "interval_seconds": job.interval_seconds,
+                "change_threshold": job.change_threshold,
+                "running": is_running(states.get(job.name, {}), now),
+                "state": {
+                    k: v for k, v in states.get(job.name, {}).items() if k != "_id"
+                },
+                "worker_metrics": asdict(self.metrics[job.name]),
+            }
+            for job in jobs
+        ]
+
+
+scheduler = Scheduler(tick_seconds=settings.SCHEDULER_TICK_SECONDS)
@@ -1,9 +1,15 @@
 from pydantic import BaseModel
 from fastapi.exceptions import HTTPException
+from fastapi.responses import JSONResponse
 from typing import Union, Dict, Any
 from secrets import randbelow
+from bson import ObjectId
 from bson.decimal128 import Decimal128
+from datetime import datetime
 from decimal import Decimal
+import base64
+import json
+import orjson
 
 
 class Message(BaseModel):
@@ -13,6 +19,12 @@ class Message(BaseModel):
     data: Union[Dict[str, Any], list, None] = None
 
 
+class PageMessage(Message):
+    """A `Message` whose `data` is one page of a list, `next_cursor` is passed as `after` for the next page"""
+
+    next_cursor: str | None = None
+
+
 class TokenPayload(BaseModel):
     exp: int
     sub: str
@@ -61,3 +73,75 @@ def convert_decimal(dict_item: dict):
             dict_item[k] = Decimal128(str(v))
 
     return dict_item
+
+
+def encode_keyset_cursor(doc: dict) -> str:
+    """Opaque `after` cursor pointing at a document of a list sorted by `created_at` then `_id`, newest first"""
+    payload = json.dumps(
+        {"created_at": doc["created_at"].isoformat(), "id": str(doc["_id"])}
+    )
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def keyset_filter(after: str | None) -> dict:
+    """
+    Filter selecting the documents after the `after` cursor, sort with `KEYSET_SORT` so the query is served by an
+    index ending with `created_at` and `_id`. Raises a 400 `HTTPMessageException` for an invalid cursor.
+    """
+    if after is None:
+        return {}
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(after.encode()))
+        created_at = datetime.fromisoformat(payload["created_at"])
+        _id = ObjectId(payload["id"])
+    except Exception:
+        raise HTTPMessageException(status_code=400, message="Invalid cursor")
+    return {
+        "$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": _id}},
+        ]
+    }
+
+
+# newest first, `_id` breaks ties between documents created at the same time
+KEYSET_SORT = [("created_at", -1), ("_id", -1)]
+
+
+def orjson_default(obj: Any) -> Any:
+    # types orjson does not serialize natively, encoded as `jsonable_encoder` encodes a `Message` (decimals are strings)
+    if isinstance(obj, Decimal):
+        return str(obj)
+    if isinstance(obj, Decimal128):
+        return str(obj.to_decimal())
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dump_json(content: Any) -> bytes:
+    """Encode `content` with orjson, `Message` and dumped models can be passed as is, without `jsonable_encoder`"""
+    return orjson.dumps(
+        content,
+        default=orjson_default,
+        option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+    )
+
+
+class ORJSONResponse(JSONResponse):
+    """The default response class of the application, see `dump_json`"""
+
+    def render(self, content: Any) -> bytes:
+        return dump_json(content)
+
+
+def json_message(message: Message) -> ORJSONResponse:
+    """
+    `message` rendered with `dump_json`, with its `status_code` as the response status.
+
+    FastAPI runs `jsonable_encoder` over a `Message` returned by an endpoint without a `response_model` before the
+    response class renders it, hot endpoints return this response instead to skip that pass.
+    """
+    return ORJSONResponse(content=message, status_code=message.status_code)
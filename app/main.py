@@ -1,18 +1,63 @@
+import asyncio
+from contextlib import asynccontextmanager, suppress
+
 from fastapi import FastAPI, Request
 from fastapi import status
 from bson.errors import BSONError
 
 from app.core.config import settings
-from app.core.utils import Message, HTTPMessageException
-from app.core.db import db
+from app.core.utils import Message, HTTPMessageException, ORJSONResponse
+from app.core.db import db, ensure_indexes
 from app.users import user_routes
 from app.products import product_routes
 from app.cart import cart_routes
 from app.order import order_routes
+from app.admin import admin_routes
+from app.recommendation_systems.model_store import model_server
+from app.recommendation_systems.content_index import content_index_service
+from app.products.catalog import get_catalog_version
+from app.recommendation_systems.jobs import register_jobs
+from app.core.scheduler import scheduler
+from app.core.email_outbox import email_outbox_worker
+from app.core.mailing import precompile_email_templates
 from starlette.middleware.cors import CORSMiddleware
 
 
-application: FastAPI = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await ensure_indexes()
+    precompile_email_templates()
+    # load the serving model version (if any) before accepting requests, then keep watching for new versions
+    await model_server.refresh()
+    model_watcher = asyncio.create_task(
+        model_server.watch(settings.MODEL_WATCH_INTERVAL_SECONDS)
+    )
+    if settings.CONTENT_FEATURIZER == "hashing" and (
+        model_server.bundle is None or model_server.bundle.content_index is None
+    ):
+        # start building this worker's content index, related products are empty until it is built
+        content_index_service.get(await get_catalog_version())
+    # heavy work (retraining, index rebuilds, popularity) runs in the background instead of the request path
+    if settings.SCHEDULER_ENABLED:
+        register_jobs(scheduler)
+        scheduler.start()
+    # emails enqueued by request handlers are sent in the background
+    outbox_worker = None
+    if settings.EMAIL_OUTBOX_WORKER_ENABLED and settings.emails_enabled:
+        outbox_worker = asyncio.create_task(email_outbox_worker.run_forever())
+    yield
+    if outbox_worker is not None:
+        outbox_worker.cancel()
+        with suppress(asyncio.CancelledError):
+            await outbox_worker
+        email_outbox_worker.pool.close()
+    await scheduler.stop()
+    model_watcher.cancel()
+    with suppress(asyncio.CancelledError):
+        await model_watcher
+
+
+application: FastAPI = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Set all CORS enabled origins
 if settings.all_cors_origins:
@@ -29,6 +74,7 @@ application.include_router(user_routes.router)
 application.include_router(product_routes.router)
 application.include_router(cart_routes.router)
 application.include_router(order_routes.router)
+application.include_router(admin_routes.router)
 
 
 @application.get(
@@ -1,18 +1,24 @@
-from fastapi import APIRouter, status
-from bson import ObjectId
+from fastapi import APIRouter, Query, status
 
-from app.products.product_models import ProductModel, ProductListModel
 from app.order.order_models import OrderModel, OrderItemModel, OrderListModel
 from app.cart.cart_models import CartModel
 from app.core.deps import CurrentUserDep
 from app.core.db import MONGO_COLLECTIONS, get_collection
-from app.core.mailing import send_order_receipt_email, send_email
+from app.core.mailing import send_order_receipt_email
+from app.core.email_outbox import enqueue_email
 from app.core.utils import (
     HTTPMessageException,
     collection_error_msg,
+    encode_keyset_cursor,
+    json_message,
+    keyset_filter,
+    KEYSET_SORT,
     Message,
+    PageMessage,
     convert_decimal,
 )
+from app.products.catalog import catalog_cache
+from app.cart.cart_service import clear_cart, hydrate_cart
 
 router = APIRouter(prefix="/order")
 
@@ -33,13 +39,6 @@ async def checkout(current_user: CurrentUserDep, receipt_email: str = None):
             message=collection_error_msg("checkout", MONGO_COLLECTIONS.CARTS.name),
         )
 
-    products_coll = get_collection(MONGO_COLLECTIONS.PRODUCTS)
-    if products_coll is None:
-        raise HTTPMessageException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            message=collection_error_msg("checkout", MONGO_COLLECTIONS.PRODUCTS.name),
-        )
-
     if (cart := await cart_coll.find_one({"user_id": current_user.id})) is None:
         raise HTTPMessageException(
             status_code=status.HTTP_404_NOT_FOUND, message="User does not have a cart"
@@ -51,22 +50,15 @@ async def checkout(current_user: CurrentUserDep, receipt_email: str = None):
             status_code=status.HTTP_400_BAD_REQUEST,
         )
 
-    product_ids = [ObjectId(i["product_id"]) for i in cart["cart_items"]]
-    cart_products = [i async for i in products_coll.find({"_id": {"$in": product_ids}})]
-
-    cart_items = [
-        {
-            **i.model_dump(),
-            "selling_price": i.selling_price,
-        }
-        for i in ProductListModel(products=cart_products).products
-    ]
-    for item in cart["cart_items"]:
-        item["product_id"] = [i for i in cart_items if i["id"] == item["product_id"]][0]
-
-    sub_total = 0
-    for i in cart["cart_items"]:
-        sub_total += i["product_id"]["selling_price"] * i["quantity"]
+    # current prices, products deleted since they were added to the cart are left out of the order
+    hydrated = await hydrate_cart(cart, fresh=True)
+    if len(hydrated["cart_items"]) <= 0:
+        raise HTTPMessageException(
+            message="The products in your cart are no longer available",
+            status_code=status.HTTP_400_BAD_REQUEST,
+        )
+    cart["cart_items"] = hydrated["cart_items"]
+    sub_total = hydrated["sub_total"]
 
     order_items = [
         {"product_id": i["product_id"]["id"], "quantity": i["quantity"]}
@@ -82,12 +74,16 @@ async def checkout(current_user: CurrentUserDep, receipt_email: str = None):
     order_dict = convert_decimal(order_dict)
 
     order_inserted = await order_coll.insert_one(order_dict)
-    order = await order_coll.find_one({"_id": order_inserted.inserted_id})
 
-    # empty users cart
-    await cart_coll.update_one(
-        {"user_id": current_user.id}, {"$set": {"cart_items": []}}
-    )
+    # empty users cart, unless it changed since it was read (an item added or changed meanwhile would be lost without
+    # being ordered, a concurrent checkout of the same cart already ordered it)
+    if await clear_cart(cart_coll, current_user.id, read_cart=cart) is None:
+        await order_coll.delete_one({"_id": order_inserted.inserted_id})
+        raise HTTPMessageException(
+            message="Your cart changed during checkout, review it and try again",
+            status_code=status.HTTP_409_CONFLICT,
+        )
+    order = await order_coll.find_one({"_id": order_inserted.inserted_id})
 
     products = [
         {
@@ -105,7 +101,7 @@ async def checkout(current_user: CurrentUserDep, receipt_email: str = None):
             email_data = send_order_receipt_email(
                 products=products, total_price=sub_total
             )
-            send_email(
+            await enqueue_email(
                 email_to=receipt_email,
                 subject=email_data.subject,
                 html_content=email_data.html_content,
@@ -129,7 +125,12 @@ async def checkout(current_user: CurrentUserDep, receipt_email: str = None):
 
 
 @router.get("/get-all-users-orders", name="get_all_users_orders")
-async def get_all_users_orders(current_user: CurrentUserDep):
+async def get_all_users_orders(
+    current_user: CurrentUserDep,
+    after: str = None,
+    limit: int = Query(default=20, ge=1, le=100),
+):
+    """A page of the users orders, newest first, pass the `next_cursor` of a page as `after` for the next one"""
     order_coll = get_collection(MONGO_COLLECTIONS.ORDERS)
     if order_coll is None:
         raise HTTPMessageException(
@@ -139,45 +140,58 @@ async def get_all_users_orders(current_user: CurrentUserDep):
             ),
         )
 
-    products_coll = get_collection(MONGO_COLLECTIONS.PRODUCTS)
-    if products_coll is None:
-        raise HTTPMessageException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            message=collection_error_msg(
-                "get_all_users_orders", MONGO_COLLECTIONS.PRODUCTS.name
-            ),
-        )
-
     product_rating_coll = get_collection(MONGO_COLLECTIONS.PRODUCT_RATINGS)
     if product_rating_coll is None:
         raise HTTPMessageException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             message=collection_error_msg(
-                "format_homelisting_product", MONGO_COLLECTIONS.PRODUCT_RATINGS.name
+                "get_all_users_orders", MONGO_COLLECTIONS.PRODUCT_RATINGS.name
             ),
         )
 
-    user_orders = [doc async for doc in order_coll.find({"user_id": current_user.id})]
-    user_orders = OrderListModel(orders=user_orders).model_dump()["orders"]
+    # served by the (user_id, created_at, _id) index, one more order is read to know if there is a next page
+    cursor = (
+        order_coll.find({"user_id": current_user.id, **keyset_filter(after)})
+        .sort(KEYSET_SORT)
+        .limit(limit + 1)
+    )
+    user_orders = await cursor.to_list(length=limit + 1)
+    next_cursor = (
+        encode_keyset_cursor(user_orders[limit - 1])
+        if len(user_orders) > limit
+        else None
+    )
+    user_orders = OrderListModel(orders=user_orders[:limit]).model_dump()["orders"]
+
+    # the products and the users ratings of the whole page are read at once
+    product_ids = list({j["product_id"] for i in user_orders for j in i["order_item"]})
+    products = await catalog_cache.get_products(product_ids)
+    ratings = {
+        doc["product_id"]: doc["rating"]
+        async for doc in product_rating_coll.find(
+            {"user_id": current_user.id, "product_id": {"$in": product_ids}},
+            {"product_id": 1, "rating": 1},
+        )
+    }
 
     for i in user_orders:
         for j in i["order_item"]:
-            product = ProductModel(
-                **await products_coll.find_one({"_id": ObjectId(j["product_id"])})
-            )
-            rating = await product_rating_coll.find_one(
-                {"user_id": current_user.id, "product_id": product.id}
-            )
+            if (product := products.get(j["product_id"])) is None:
+                # the product no longer exists, its id is kept
+                continue
             j["product_id"] = {
-                **product.model_dump(),
-                "selling_price": product.selling_price,
-                "is_rated": True if rating is not None else False,
-                "rating_given": rating["rating"] if rating is not None else None,
+                **product,
+                "is_rated": j["product_id"] in ratings,
+                "rating_given": ratings.get(j["product_id"]),
             }
 
-    return Message(
-        status_code=status.HTTP_200_OK,
-        message="All user orders",
-        success=True,
-        data=user_orders,
+    # `data` stays the list of orders it always was, the cursor is returned next to it
+    return json_message(
+        PageMessage(
+            status_code=status.HTTP_200_OK,
+            message="All user orders",
+            success=True,
+            data=user_orders,
+            next_cursor=next_cursor,
+        )
     )
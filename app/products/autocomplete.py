@@ -0,0 +1,218 @@
+import asyncio
+import heapq
+import logging
+import re
+import time
+from bisect import bisect_left
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Literal
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.products.catalog import CatalogSnapshot, catalog_cache
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+# the largest number of suggestions the endpoint returns
+MAX_SUGGESTIONS = 20
+
+
+def normalize(text: str) -> str:
+    return WHITESPACE_PATTERN.sub(" ", text.lower()).strip()
+
+
+@dataclass(frozen=True)
+class Suggestion:
+    text: str
+    type: Literal["product", "query"]
+    product_id: str | None
+    # products are ranked by their number of ratings then average rating, queries by how often they were searched
+    score: tuple[float, float]
+
+    def to_dict(self) -> dict[str, Any]:
+        return {"text": self.text, "type": self.type, "product_id": self.product_id}
+
+
+class AutocompleteIndex:
+    """
+    A sorted array of normalized keys searched with binary search.
+
+    Every product name is indexed from the start of each of its words ("fresh cabbage" is found with "fr" and "cab"),
+    popular search queries are indexed as a whole. The keys starting with a prefix are a contiguous range of the array,
+    a segment tree over the popularity rank of each key finds the best keys of any range in `O(limit * log(n))`, so a
+    one letter prefix is as fast as a long one.
+    """
+
+    def __init__(self, suggestions: list[Suggestion]):
+        entries = []
+        for i, suggestion in enumerate(suggestions):
+            words = normalize(suggestion.text).split(" ")
+            if suggestion.type == "query":
+                entries.append((" ".join(words), i))
+                continue
+            for start in range(len(words)):
+                entries.append((" ".join(words[start:]), i))
+        entries.sort()
+
+        self.suggestions = suggestions
+        self.keys = [key for key, _ in entries]
+        self.suggestion_ids = [i for _, i in entries]
+
+        # rank of every suggestion by popularity, higher is more popular
+        ranks = np.empty(len(suggestions), dtype=np.int64)
+        ranks[sorted(range(len(suggestions)), key=lambda i: suggestions[i].score)] = (
+            np.arange(len(suggestions))
+        )
+        entry_ranks = ranks[np.array(self.suggestion_ids, dtype=np.int64)]
+
+        # segment tree of the position of the most popular key of each node, leaves start at `size`
+        size = 1
+        while size < max(len(entries), 1):
+            size *= 2
+        tree = np.full(2 * size, -1, dtype=np.int64)
+        tree[size : size + len(entries)] = np.arange(len(entries))
+        padded_ranks = np.append(entry_ranks, -1)
+        for start in range(size.bit_length() - 1, 0, -1):
+            level = np.arange(2 ** (start - 1), 2**start)
+            left, right = tree[2 * level], tree[2 * level + 1]
+            tree[level] = np.where(
+                padded_ranks[left] >= padded_ranks[right], left, right
+            )
+
+        self.size = size
+        self.entry_ranks = entry_ranks.tolist()
+        self.tree = tree.tolist()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _best_in_range(self, lo: int, hi: int) -> int:
+        """Position of the most popular key in `[lo, hi)`"""
+        best = -1
+        lo, hi = lo + self.size, hi + self.size
+        while lo < hi:
+            if lo & 1:
+                if best < 0 or self.entry_ranks[self.tree[lo]] > self.entry_ranks[best]:
+                    best = self.tree[lo]
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                if best < 0 or self.entry_ranks[self.tree[hi]] > self.entry_ranks[best]:
+                    best = self.tree[hi]
+            lo, hi = lo // 2, hi // 2
+        return best
+
+    def suggest(self, prefix: str, limit: int = 10) -> list[Suggestion]:
+        prefix = normalize(prefix)
+        if len(prefix) <= 0:
+            return []
+
+        start = bisect_left(self.keys, prefix)
+        end = bisect_left(self.keys, prefix + "\uffff", lo=start)
+        if start >= end:
+            return []
+
+        # best first search over sub-ranges, each popped key splits its range in two
+        position = self._best_in_range(start, end)
+        candidates = [(-self.entry_ranks[position], position, start, end)]
+        ids: list[int] = []
+        while len(candidates) > 0 and len(ids) < limit:
+            _, position, lo, hi = heapq.heappop(candidates)
+            # a product matched by several of its words is suggested once
+            if (i := self.suggestion_ids[position]) not in ids:
+                ids.append(i)
+            for sub_lo, sub_hi in ((lo, position), (position + 1, hi)):
+                if sub_lo < sub_hi:
+                    best = self._best_in_range(sub_lo, sub_hi)
+                    heapq.heappush(
+                        candidates, (-self.entry_ranks[best], best, sub_lo, sub_hi)
+                    )
+        return [self.suggestions[i] for i in ids]
+
+
+def build_autocomplete_index(
+    snapshot: CatalogSnapshot, query_counts: Counter
+) -> AutocompleteIndex:
+    suggestions = [
+        Suggestion(
+            text=product["product_name"].strip(),
+            type="product",
+            product_id=product["id"],
+            score=(product["rating_count"], product["avg_rating"]),
+        )
+        for product in snapshot.products
+    ]
+    suggestions += [
+        Suggestion(text=query, type="query", product_id=None, score=(count, 0))
+        for query, count in query_counts.most_common(settings.AUTOCOMPLETE_MAX_QUERIES)
+        if count >= settings.AUTOCOMPLETE_MIN_QUERY_COUNT
+    ]
+    return AutocompleteIndex(suggestions)
+
+
+class AutocompleteService:
+    """
+    Holds the autocomplete index of this worker.
+
+    The index is rebuilt in the background when the catalog snapshot changes, or every `rebuild_interval` seconds to
+    pick up newly popular search queries, requests keep using the current index while a rebuild runs.
+    """
+
+    def __init__(self, rebuild_interval: float):
+        self.rebuild_interval = rebuild_interval
+        self.index: AutocompleteIndex | None = None
+        # search queries that returned results, counted in this worker
+        self.query_counts: Counter = Counter()
+        self._snapshot: CatalogSnapshot | None = None
+        self._built_at = 0.0
+        self._rebuild_task: asyncio.Task | None = None
+
+    def record_query(self, query: str) -> None:
+        if len(query := normalize(query)) <= 0:
+            return
+        self.query_counts[query] += 1
+        # long tail queries are dropped so the counter stays bounded
+        if len(self.query_counts) > 10 * settings.AUTOCOMPLETE_MAX_QUERIES:
+            self.query_counts = Counter(
+                dict(self.query_counts.most_common(settings.AUTOCOMPLETE_MAX_QUERIES))
+            )
+
+    async def _rebuild(self, snapshot: CatalogSnapshot) -> None:
+        start = time.perf_counter()
+        query_counts = self.query_counts.copy()
+        self.index = await run_in_threadpool(
+            build_autocomplete_index, snapshot, query_counts
+        )
+        self._snapshot, self._built_at = snapshot, time.monotonic()
+        logger.info(
+            f"  autocomplete index rebuilt, {len(self.index)} keys in {time.perf_counter() - start:.3f}s"
+        )
+
+    async def _rebuild_in_background(self, snapshot: CatalogSnapshot) -> None:
+        try:
+            await self._rebuild(snapshot)
+        except Exception as exc:
+            logger.error(f"  autocomplete index rebuild failed: {exc}")
+
+    async def get(self) -> AutocompleteIndex:
+        snapshot = await catalog_cache.get()
+        if self.index is None:
+            await self._rebuild(snapshot)
+        elif (
+            snapshot is not self._snapshot
+            or time.monotonic() - self._built_at >= self.rebuild_interval
+        ) and (self._rebuild_task is None or self._rebuild_task.done()):
+            self._rebuild_task = asyncio.create_task(
+                self._rebuild_in_background(snapshot)
+            )
+        return self.index
+
+
+autocomplete_service = AutocompleteService(
+    rebuild_interval=settings.AUTOCOMPLETE_REBUILD_INTERVAL_SECONDS
+)
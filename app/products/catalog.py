@@ -0,0 +1,266 @@
+import asyncio
+import logging
+import time
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from typing import Any
+
+from bson import ObjectId
+from pydantic import TypeAdapter
+from pymongo import ReturnDocument
+
+from app.core.config import settings
+from app.core.db import get_collection, MONGO_COLLECTIONS
+from app.core.utils import collection_error_msg
+from app.products.product_models import (
+    PRODUCT_CARD_PROJECTION,
+    ProductCardModel,
+    ProductModel,
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# `_id` of the catalog, ratings and prices version counters in the `counters` collection
+CATALOG_VERSION_ID = "catalog"
+RATINGS_VERSION_ID = "ratings"
+PRICES_VERSION_ID = "prices"
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    """
+    An immutable, process-wide copy of the product catalog.
+
+    `products` and `by_id` hold every product validated in the home listing format (`ProductModel` fields plus
+    `selling_price`, with `avg_rating` rounded), the recommenders and the search index read their descriptions.
+    Responses list products as cards (`product_card`, without the description), built once per snapshot in `cards`,
+    `by_location` and `by_max_age`. Records are shared by every request reading the snapshot and must not be mutated.
+    """
+
+    version: int
+    products: tuple[dict[str, Any], ...]
+    by_id: dict[str, dict[str, Any]] = field(repr=False)
+    cards: dict[str, dict[str, Any]] = field(repr=False)
+    by_location: dict[str, tuple[dict[str, Any], ...]] = field(repr=False)
+    # product cards sorted by `max_age_range`, highest first, and their negated `max_age_range` for `bisect`
+    by_max_age: tuple[dict[str, Any], ...] = field(repr=False)
+    max_age_keys: tuple[int, ...] = field(repr=False)
+    # version of the product prices the snapshot was loaded with, see `bump_prices_version`
+    prices_version: int = 0
+    loaded_at: float = field(default_factory=time.monotonic)
+
+    def for_age(self, age: int) -> tuple[dict[str, Any], ...]:
+        """Cards of the products whose `max_age_range` is at least `age`, found with a binary search"""
+        return self.by_max_age[: bisect_right(self.max_age_keys, -age)]
+
+    @classmethod
+    def from_documents(
+        cls, version: int, documents: list[dict[str, Any]], prices_version: int = 0
+    ) -> "CatalogSnapshot":
+        products = listing_records(documents)
+        cards = {product["id"]: product_card(product) for product in products}
+
+        by_location: dict[str, list[dict[str, Any]]] = {}
+        for card in cards.values():
+            by_location.setdefault(card["location"], []).append(card)
+
+        by_max_age = sorted(cards.values(), key=lambda card: -card["max_age_range"])
+
+        return cls(
+            version=version,
+            products=tuple(products),
+            by_id={product["id"]: product for product in products},
+            cards=cards,
+            by_location={k: tuple(v) for k, v in by_location.items()},
+            by_max_age=tuple(by_max_age),
+            max_age_keys=tuple(-product["max_age_range"] for product in by_max_age),
+            prices_version=prices_version,
+        )
+
+
+# validate a whole list of product documents in a single call
+PRODUCT_LIST_ADAPTERS = {
+    model: TypeAdapter(list[model]) for model in (ProductModel, ProductCardModel)
+}
+
+
+def listing_records(
+    documents: list[dict[str, Any]],
+    model: type[ProductCardModel] = ProductModel,
+) -> list[dict[str, Any]]:
+    """
+    Product documents in the home listing format, every document is validated once and dumped once.
+
+    `selling_price` is added and `avg_rating` rounded, the records serialize as they are with `dump_json`. Documents
+    read with `PRODUCT_CARD_PROJECTION` are validated with `model=ProductCardModel`.
+    """
+    return [
+        {
+            **product.model_dump(),
+            "selling_price": product.selling_price,
+            "avg_rating": round(product.avg_rating, 2),
+        }
+        for product in PRODUCT_LIST_ADAPTERS[model].validate_python(documents)
+    ]
+
+
+def product_card(product: dict[str, Any]) -> dict[str, Any]:
+    """
+    The `ProductCardModel` fields and `selling_price` of a catalog record, the format every product listing uses
+    (the same fields as `listing_records(documents, model=ProductCardModel)`)
+    """
+    return {
+        **{name: product[name] for name in ProductCardModel.model_fields},
+        "selling_price": product["selling_price"],
+    }
+
+
+async def get_catalog_version() -> int:
+    return await get_counter(CATALOG_VERSION_ID)
+
+
+async def get_counter(counter_id: str) -> int:
+    counters_coll = get_collection(MONGO_COLLECTIONS.COUNTERS)
+    if counters_coll is None:
+        raise Exception(
+            collection_error_msg("get_counter", MONGO_COLLECTIONS.COUNTERS.name)
+        )
+    counter = await counters_coll.find_one({"_id": counter_id})
+    return counter["version"] if counter is not None else 0
+
+
+async def bump_catalog_version() -> int:
+    """Signal every worker that the products collection changed, call it after writing products"""
+    return await bump_counter(CATALOG_VERSION_ID)
+
+
+async def bump_ratings_version() -> int:
+    """Signal every worker that product ratings changed, invalidates cached responses showing ratings"""
+    return await bump_counter(RATINGS_VERSION_ID)
+
+
+async def bump_prices_version() -> int:
+    """
+    Signal that product prices changed, call it after changing a price or discount, or deleting a product.
+
+    Cart totals priced with an older version are recomputed on their next read, the catalog version is bumped too so
+    every worker reloads the snapshot with the new prices.
+    """
+    version = await bump_counter(PRICES_VERSION_ID)
+    await bump_catalog_version()
+    return version
+
+
+async def bump_counter(counter_id: str) -> int:
+    counters_coll = get_collection(MONGO_COLLECTIONS.COUNTERS)
+    if counters_coll is None:
+        raise Exception(
+            collection_error_msg("bump_counter", MONGO_COLLECTIONS.COUNTERS.name)
+        )
+    counter = await counters_coll.find_one_and_update(
+        {"_id": counter_id},
+        # `updated_at` is the `Last-Modified` time of cached responses, see `app.core.response_cache`
+        {"$inc": {"version": 1}, "$currentDate": {"updated_at": True}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return counter["version"]
+
+
+class CatalogCache:
+    """
+    Holds the catalog snapshot of this worker.
+
+    The version counter is checked at most every `refresh_interval` seconds and the snapshot is reloaded when it
+    changed, or when the snapshot is older than `max_age` (rating statistics change without bumping the version).
+    A reload builds a new snapshot and swaps the reference, concurrent requests wait for a single reload.
+    """
+
+    def __init__(self, refresh_interval: float, max_age: float):
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self.snapshot: CatalogSnapshot | None = None
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _is_fresh(self) -> bool:
+        now = time.monotonic()
+        return (
+            self.snapshot is not None
+            and now - self._checked_at < self.refresh_interval
+            and now - self.snapshot.loaded_at < self.max_age
+        )
+
+    async def get(self) -> CatalogSnapshot:
+        if self._is_fresh():
+            return self.snapshot
+
+        async with self._lock:
+            # another request may have refreshed the snapshot while this one waited
+            if self._is_fresh():
+                return self.snapshot
+
+            version = await get_catalog_version()
+            self._checked_at = time.monotonic()
+            if (
+                self.snapshot is None
+                or self.snapshot.version != version
+                or time.monotonic() - self.snapshot.loaded_at >= self.max_age
+            ):
+                await self.reload(version)
+            return self.snapshot
+
+    async def reload(self, version: int | None = None) -> CatalogSnapshot:
+        products_coll = get_collection(MONGO_COLLECTIONS.PRODUCTS)
+        if products_coll is None:
+            raise Exception(
+                collection_error_msg("reload", MONGO_COLLECTIONS.PRODUCTS.name)
+            )
+        if version is None:
+            version = await get_catalog_version()
+
+        # read before the products, a price change during the load is then picked up by the next reload
+        prices_version = await get_counter(PRICES_VERSION_ID)
+        # a stable order, so positions in the snapshot are reproducible
+        documents = [doc async for doc in products_coll.find({}).sort("_id", 1)]
+        self.snapshot = CatalogSnapshot.from_documents(
+            version, documents, prices_version=prices_version
+        )
+        self._checked_at = time.monotonic()
+        logger.info(f"  catalog snapshot v{version} loaded, {len(documents)} products")
+        return self.snapshot
+
+    async def get_products(self, product_ids: list[str]) -> dict[str, dict[str, Any]]:
+        """
+        Product cards of `product_ids` keyed by id, products added after the snapshot was loaded are read from
+        mongodb. Ids of products that do not exist are left out.
+        """
+        snapshot = await self.get()
+        found = {i: snapshot.cards[i] for i in product_ids if i in snapshot.cards}
+
+        missing = [ObjectId(i) for i in product_ids if i not in found]
+        if len(missing) > 0:
+            products_coll = get_collection(MONGO_COLLECTIONS.PRODUCTS)
+            if products_coll is None:
+                raise Exception(
+                    collection_error_msg(
+                        "get_products", MONGO_COLLECTIONS.PRODUCTS.name
+                    )
+                )
+            documents = [
+                doc
+                async for doc in products_coll.find(
+                    {"_id": {"$in": missing}}, PRODUCT_CARD_PROJECTION
+                )
+            ]
+            found.update(
+                {i["id"]: i for i in listing_records(documents, model=ProductCardModel)}
+            )
+        return found
+
+
+catalog_cache = CatalogCache(
+    refresh_interval=settings.CATALOG_REFRESH_INTERVAL_SECONDS,
+    max_age=settings.CATALOG_MAX_AGE_SECONDS,
+)
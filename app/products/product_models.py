@@ -32,23 +32,13 @@ class CategoryListModel(BaseModel):
     categories: List[CategoryModel]
 
 
-class ProductModel(BaseModel):
+class ProductPriceModel(BaseModel):
+    """The fields needed to price a product, read with `PRODUCT_PRICE_PROJECTION`"""
+
     id: Union[PyObjectId, None] = Field(alias="_id", default=None)
-    category_id: str
-    product_name: str
-    product_description: str
     product_price: Decimal
     product_discount: Decimal
     product_discount_type: DiscountTypeEnum
-    product_quantity: int = Field(default=1000)
-    slug: str
-    image_url: str
-    location: str = Field(default_factory=Constants.random_country_generator)
-    # represents the highest age of a expected customers
-    max_age_range: int = Field(default_factory=Constants.random_age_generator)
-
-    created_at: datetime = Field(default_factory=datetime.now)
-    updated_at: datetime = Field(default_factory=datetime.now)
 
     model_config = ConfigDict(
         populate_by_name=True,
@@ -81,6 +71,40 @@ class ProductModel(BaseModel):
         return self.product_price
 
 
+class ProductCardModel(ProductPriceModel):
+    """A product as shown in listings and carts, without its description, read with `PRODUCT_CARD_PROJECTION`"""
+
+    category_id: str
+    product_name: str
+    product_quantity: int = Field(default=1000)
+    slug: str
+    image_url: str
+    location: str = Field(default_factory=Constants.random_country_generator)
+    # represents the highest age of a expected customers
+    max_age_range: int = Field(default_factory=Constants.random_age_generator)
+    # denormalized rating statistics, maintained when a product is rated
+    rating_count: int = 0
+    avg_rating: float = 0
+
+    created_at: datetime = Field(default_factory=datetime.now)
+
+
+class ProductModel(ProductCardModel):
+    product_description: str
+    rating_sum: int = 0
+
+    updated_at: datetime = Field(default_factory=datetime.now)
+
+
+def projection(model: type[BaseModel]) -> dict[str, int]:
+    """Mongodb projection reading only the fields of `model`"""
+    return {field.alias or name: 1 for name, field in model.model_fields.items()}
+
+
+PRODUCT_PRICE_PROJECTION = projection(ProductPriceModel)
+PRODUCT_CARD_PROJECTION = projection(ProductCardModel)
+
+
 class ProductListModel(BaseModel):
     products: List[ProductModel]
 
@@ -107,3 +131,13 @@ class ProductRatingListModel(BaseModel):
 class ProductRatingReviewDto(BaseModel):
     product_id: str
     rating: int = Field(ge=1, le=5)
+
+
+class ProductBulkDto(BaseModel):
+    product_ids: List[str] = Field(min_length=1, max_length=500)
+
+
+class RecommendationBatchDto(BaseModel):
+    user_ids: List[str] = Field(default=[], max_length=5000)
+    product_ids: List[str] = Field(default=[], max_length=5000)
+    top_n: int = Field(default=10, ge=1, le=50)
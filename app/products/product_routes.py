@@ -1,67 +1,161 @@
 from bson import ObjectId
-from fastapi import APIRouter, status
-from typing import Any
+from fastapi import APIRouter, Query, status
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from typing import Any, AsyncIterator, Awaitable, Iterator, Sequence
+from collections import OrderedDict
 from pprint import pprint
+import asyncio
+import logging
 import random
+import time
+import zlib
 
+from app.core.config import settings
 from app.core.db import get_collection, MONGO_COLLECTIONS
-from app.core.utils import collection_error_msg, HTTPMessageException, Message
+from app.core.utils import (
+    collection_error_msg,
+    dump_json,
+    encode_keyset_cursor,
+    json_message,
+    keyset_filter,
+    HTTPMessageException,
+    KEYSET_SORT,
+    Message,
+)
 from app.core.deps import CurrentUserDep
 from app.products.product_models import (
+    PRODUCT_CARD_PROJECTION,
+    ProductBulkDto,
+    ProductCardModel,
     ProductModel,
     CategoryListModel,
     CategoryModel,
     ProductRatingListModel,
-    ProductListModel,
     ProductRatingModel,
     ProductRatingReviewDto,
+    RecommendationBatchDto,
+    projection,
 )
 from app.users.user_models import PublicUserModel
 from app.core.deps import IsUserAuthenticatedDeps
 
-from app.recommendation_systems.collaborative_filtering import cf
-from app.recommendation_systems.content_based import cbf
+from app.recommendation_systems.collaborative_filtering import cf, cf_batch
+from app.recommendation_systems.content_based import cbf, cbf_batch
 from app.recommendation_systems.hybrid_content_based import hcbf
+from app.recommendation_systems.hashing_content_based import (
+    hashing_cbf,
+    HashedTfidfIndex,
+)
+from app.recommendation_systems.content_index import content_index_service
+from app.recommendation_systems.model_store import ModelBundle, model_server
+from app.core.response_cache import cache_response
+from app.products.catalog import (
+    CatalogSnapshot,
+    bump_ratings_version,
+    catalog_cache,
+    listing_records,
+)
+from app.products.search import search_products
+from app.products.autocomplete import MAX_SUGGESTIONS, autocomplete_service
+from app.products.rating_stats import rating_stats_update
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/product")
 
+# number of ratings returned with a product
+REVIEWS_PAGE_SIZE = 20
+# only the fields of `PublicUserModel` are read for the users of a review page
+PUBLIC_USER_PROJECTION = projection(PublicUserModel)
+# the fields of a rating the recommenders are trained on
+RATING_DATA_PROJECTION = {"_id": 0, "user_id": 1, "product_id": 1, "rating": 1}
+
 
 @router.get("/search/", name="search_product_by_name")
-async def search_product_by_name(name: str = None):
-    """Find product by its name"""
+async def search_product_by_name(
+    name: str = None,
+    page: int = Query(default=1, ge=1),
+    page_size: int = Query(default=10, ge=1, le=50),
+):
+    """Find product by its name (or description), best match first"""
+    if name is None or len(name.strip()) <= 0:
+        return json_message(
+            Message(
+                message="Product search result",
+                status_code=status.HTTP_200_OK,
+                success=True,
+                data=[],
+            )
+        )
+
+    offset = (page - 1) * page_size
+    if settings.SEARCH_BACKEND == "mongo":
+        product_list = await search_products_text_index(
+            name, offset=offset, limit=page_size
+        )
+    else:
+        product_list = await search_products(name, offset=offset, limit=page_size)
+
+    if len(product_list) > 0:
+        # popular queries are suggested by the autocomplete
+        autocomplete_service.record_query(name)
+
+    return json_message(
+        Message(
+            message="Product search result",
+            status_code=status.HTTP_200_OK,
+            success=True,
+            data=product_list,
+        )
+    )
+
+
+@router.get("/autocomplete", name="autocomplete_product_search")
+async def autocomplete_product_search(
+    q: str = "", limit: int = Query(default=10, ge=1, le=MAX_SUGGESTIONS)
+):
+    """Suggestions for a partially typed search, product names and popular queries ranked by popularity"""
+    index = await autocomplete_service.get()
+
+    return json_message(
+        Message(
+            message="Autocomplete suggestions",
+            status_code=status.HTTP_200_OK,
+            success=True,
+            data=[suggestion.to_dict() for suggestion in index.suggest(q, limit=limit)],
+        )
+    )
+
+
+async def search_products_text_index(
+    query: str, offset: int = 0, limit: int = 10
+) -> list[dict[str, Any]]:
+    """Search backed by the mongodb text index on the product name and description, ranked by text score"""
     products_coll = get_collection(MONGO_COLLECTIONS.PRODUCTS)
     if products_coll is None:
         raise HTTPMessageException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             message=collection_error_msg(
-                "search_product_by_name", MONGO_COLLECTIONS.PRODUCTS.name
+                "search_products_text_index", MONGO_COLLECTIONS.PRODUCTS.name
             ),
         )
 
-    products = [
-        doc
-        async for doc in products_coll.find(
-            {"product_name": {"$regex": name, "$options": "i"}}
-        ).limit(10)
-    ]
-
-    product_list = await format_homelisting_product(products)
-
-    # product_list = ProductListModel(products=products)
-    # product_list = [
-    #     {**model.model_dump(), "selling_price": model.selling_price}
-    #     for model in product_list.products
-    # ]
-
-    return Message(
-        message="Product search result",
-        status_code=status.HTTP_200_OK,
-        success=True,
-        data=product_list,
+    cursor = (
+        products_coll.find(
+            {"$text": {"$search": query}},
+            {**PRODUCT_CARD_PROJECTION, "score": {"$meta": "textScore"}},
+        )
+        .sort([("score", {"$meta": "textScore"})])
+        .skip(offset)
+        .limit(limit)
     )
+    return await format_homelisting_product(await cursor.to_list(length=limit))
 
 
 @router.get("/all-categories", name="get_all_categories")
+@cache_response()
 async def get_all_categories():
     categories_coll = get_collection(MONGO_COLLECTIONS.CATEGORIES)
     if categories_coll is None:
@@ -84,7 +178,13 @@ async def get_all_categories():
 
 
 @router.get("/get-product-by-category/{category_id}", name="get_product_by_category")
-async def get_product_by_category(category_id: str):
+@cache_response()
+async def get_product_by_category(
+    category_id: str,
+    after: str = None,
+    limit: int = Query(default=20, ge=1, le=100),
+):
+    """A page of the products of a category, newest first, pass the `next_cursor` of a page as `after` for the next one"""
     products_coll = get_collection(MONGO_COLLECTIONS.PRODUCTS)
     if products_coll is None:
         raise HTTPMessageException(
@@ -113,16 +213,27 @@ async def get_product_by_category(category_id: str):
 
     category = CategoryModel(**catgory).model_dump()
 
-    by_category = ProductListModel(
-        products=[doc async for doc in products_coll.find({"category_id": category_id})]
+    # served by the (category_id, created_at, _id) index, one more product is read to know if there is a next page
+    cursor = (
+        products_coll.find(
+            {"category_id": category_id, **keyset_filter(after)},
+            PRODUCT_CARD_PROJECTION,
+        )
+        .sort(KEYSET_SORT)
+        .limit(limit + 1)
     )
-    by_category = await format_homelisting_product(by_category.model_dump()["products"])
+    products = await cursor.to_list(length=limit + 1)
+    next_cursor = (
+        encode_keyset_cursor(products[limit - 1]) if len(products) > limit else None
+    )
+
+    by_category = await format_homelisting_product(products[:limit])
 
     return Message(
         status_code=status.HTTP_200_OK,
         success=True,
         message="All product filtered by category",
-        data={**category, "products": by_category},
+        data={**category, "products": by_category, "next_cursor": next_cursor},
     )
 
 
@@ -150,7 +261,7 @@ async def add_product_rating(
 
     if (
         product := await products_coll.find_one(
-            {"_id": ObjectId(product_rating_dto.product_id)}
+            {"_id": ObjectId(product_rating_dto.product_id)}, {"_id": 1}
         )
     ) is None:
         raise HTTPMessageException(
@@ -159,7 +270,8 @@ async def add_product_rating(
 
     if (
         rating_exist := await product_rating_coll.find_one(
-            {"user_id": current_user.id, "product_id": product_rating_dto.product_id}
+            {"user_id": current_user.id, "product_id": product_rating_dto.product_id},
+            {"_id": 1},
         )
     ) is not None:
         raise HTTPMessageException(
@@ -175,6 +287,13 @@ async def add_product_rating(
         ).model_dump(by_alias=True, exclude=["id"])
     )
 
+    # keep the denormalized rating statistics of the product up to date, in a single atomic update
+    await products_coll.update_one(
+        {"_id": product["_id"]},
+        rating_stats_update(product_rating_dto.rating),
+    )
+    await bump_ratings_version()
+
     product_rating = await product_rating_coll.find_one(
         {"_id": product_inserted.inserted_id}
     )
@@ -188,31 +307,67 @@ async def add_product_rating(
 
 
 @router.get("/home-product-listing")
+# only the anonymous listing is cached, a signed in user gets personalised sections, its explore section changes with
+# the rotation window
+@cache_response(
+    skip=lambda kwargs: kwargs["current_user"] is not None,
+    rotation_seconds=settings.HOME_SECTION_ROTATION_SECONDS,
+)
 async def home_product_listing(
     current_user: IsUserAuthenticatedDeps, recent_view: str = None
 ):
-
-    products_coll = get_collection(MONGO_COLLECTIONS.PRODUCTS)
-    if products_coll is None:
-        raise HTTPMessageException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            message=collection_error_msg(
-                "home_product_listing", MONGO_COLLECTIONS.PRODUCTS.name
+    # shared, already validated catalog, instead of loading and validating every product on each request
+    catalog = await catalog_cache.get()
+    # read the served model bundle once, so the whole response uses the same model version
+    bundle = model_server.bundle
+
+    # every section is built concurrently, a section that fails or times out degrades to its last result
+    sections = {
+        # NEWLY ADDED PRODUCTS
+        "new_added": (home_section_new_added(), None),
+        # TRENDING PRODUCTS (HIGHEST RATED)
+        "trending": (home_section_trending(), None),
+        # EXPLORE (A RANDOM SELECTION FOR PRODUCTS), the same for every anonymous request of a rotation window, so
+        # every worker renders the same cached listing
+        "explore": (
+            home_section_explore(
+                catalog, seed=rotation_window() if current_user is None else None
             ),
+            None,
+        ),
+    }
+
+    if recent_view:
+        # GET PRODUCTS TO USERS MOST RECENTLY VIEWED PRODUCTS
+        sections["similar_to_recent_view"] = (
+            home_section_similar_to_recent_view(catalog, bundle, recent_view),
+            recent_view,
         )
 
-    product_rating_coll = get_collection(MONGO_COLLECTIONS.PRODUCT_RATINGS)
-    if product_rating_coll is None:
-        raise HTTPMessageException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            message=collection_error_msg(
-                "home_product_listing", MONGO_COLLECTIONS.PRODUCT_RATINGS.name
-            ),
+    if current_user is not None:
+        # GET PRODUCT IN USERS COUNTRY (LOCATION)
+        sections["same_location"] = (
+            home_section_same_location(catalog, current_user.location, current_user.id),
+            current_user.location,
+        )
+        # GET PRODUCTS IN USERS AGE RANGE
+        sections["age_range"] = (
+            home_section_age_range(catalog, current_user.age, current_user.id),
+            str(current_user.age),
+        )
+        # USERS PERSONAL RECOMMENDATION (USING COLLABORATIVE FILTERING)
+        sections["might_interest_you"] = (
+            home_section_might_interest_you(catalog, bundle, current_user.id),
+            current_user.id,
         )
 
-    all_products = tuple(
-        [ProductModel(**i).model_dump() async for i in products_coll.find({})]
+    results = await asyncio.gather(
+        *(
+            run_home_section(name, coro, cache_key=cache_key)
+            for name, (coro, cache_key) in sections.items()
+        )
     )
+
     response_data = {
         "new_added": [],
         "trending": [],
@@ -221,36 +376,215 @@ async def home_product_listing(
         "same_location": [],
         "age_range": [],
         "might_interest_you": [],
+        **dict(zip(sections, results)),
     }
 
-    # NEWLY ADDED PRODUCTS
-    new_added_cursor = products_coll.find().sort("created_at", -1).limit(15)
-    new_added = await new_added_cursor.to_list(length=15)
-    new_added = await format_homelisting_product(
-        ProductListModel(products=new_added).model_dump()["products"]
+    return Message(
+        status_code=status.HTTP_200_OK,
+        success=True,
+        message="Product Listings",
+        data=response_data,
+    )
+
+
+class HomeSectionCache:
+    """Last successful result of each home listing section, keyed by section name and cache key (e.g. the user id)"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._results: OrderedDict[tuple[str, str | None], list] = OrderedDict()
+
+    def get(self, name: str, cache_key: str | None) -> list | None:
+        if (result := self._results.get((name, cache_key))) is not None:
+            self._results.move_to_end((name, cache_key))
+        return result
+
+    def set(self, name: str, cache_key: str | None, result: list) -> None:
+        self._results[(name, cache_key)] = result
+        self._results.move_to_end((name, cache_key))
+        while len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+
+
+home_section_cache = HomeSectionCache(maxsize=settings.HOME_SECTION_CACHE_SIZE)
+
+
+class FallbackLimiter:
+    """
+    Bounds the recommender trainings run by home listing sections when no model version is served.
+
+    `asyncio.wait_for` stops waiting for a section on timeout but its thread keeps training, so a slot is only freed
+    when the thread finishes. Trainings are not queued, `run` raises when every slot is taken.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.running = 0
+
+    def available(self) -> bool:
+        return self.running < self.limit
+
+    def _release(self, task: asyncio.Future) -> None:
+        self.running -= 1
+        if not task.cancelled():
+            # the exception was already raised to the section, unless it timed out
+            task.exception()
+
+    async def run(self, func, *args, **kwargs):
+        if not self.available():
+            raise Exception("every fallback training slot is taken")
+        self.running += 1
+        task = asyncio.ensure_future(run_in_threadpool(func, *args, **kwargs))
+        task.add_done_callback(self._release)
+        # the section may time out, the training task still releases its slot when done
+        return await asyncio.shield(task)
+
+
+# one limiter per section, so a section does not take every slot of another
+similar_fallback_limiter = FallbackLimiter(
+    limit=settings.HOME_SECTION_FALLBACK_CONCURRENCY
+)
+interest_fallback_limiter = FallbackLimiter(
+    limit=settings.HOME_SECTION_FALLBACK_CONCURRENCY
+)
+
+
+async def run_home_section(
+    name: str, coro: Awaitable[list], cache_key: str | None = None
+) -> list:
+    """
+    Run a home listing section with its timeout.
+
+    A section that times out or fails returns its last result for the same `cache_key`, or an empty list. A section
+    that times out keeps running (a thread cannot be stopped) and its result is kept for the next request.
+    """
+    timeout = settings.HOME_SECTION_TIMEOUTS_SECONDS.get(
+        name, settings.HOME_SECTION_TIMEOUT_SECONDS
     )
-    response_data["new_added"] = new_added
 
-    # TRENDING PRODUCTS (HIGHEST RATED)
-    product_rating_list = await get_top_rated_products()
-    prod_list = [
-        doc
-        async for doc in products_coll.find(
-            {"_id": {"$in": [ObjectId(i["_id"]) for i in product_rating_list]}}
+    def keep_late_result(task: asyncio.Future) -> None:
+        if not task.cancelled() and task.exception() is None:
+            home_section_cache.set(name, cache_key, task.result())
+
+    task = asyncio.ensure_future(coro)
+    try:
+        result = await asyncio.wait_for(asyncio.shield(task), timeout=timeout)
+    except Exception as exc:
+        if isinstance(exc, asyncio.TimeoutError):
+            task.add_done_callback(keep_late_result)
+        reason = "timed out" if isinstance(exc, asyncio.TimeoutError) else str(exc)
+        logger.warning(f"  [home_product_listing]: section {name} {reason}")
+        cached = home_section_cache.get(name, cache_key)
+        return cached if cached is not None else []
+
+    home_section_cache.set(name, cache_key, result)
+    return result
+
+
+async def home_section_new_added() -> list[dict[str, Any]]:
+    products_coll = get_collection(MONGO_COLLECTIONS.PRODUCTS)
+    if products_coll is None:
+        raise HTTPMessageException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            message=collection_error_msg(
+                "home_section_new_added", MONGO_COLLECTIONS.PRODUCTS.name
+            ),
         )
-    ]
-    trending = await format_homelisting_product(
-        ProductListModel(products=prod_list).model_dump()["products"]
+
+    new_added_cursor = (
+        products_coll.find({}, PRODUCT_CARD_PROJECTION).sort("created_at", -1).limit(15)
     )
-    response_data["trending"] = trending
+    new_added = await new_added_cursor.to_list(length=15)
+    return await format_homelisting_product(new_added)
 
-    # GET PRODUCTS TO USERS MOST RECENTLY VIEWED PRODUCTS
-    if len(recent_view) > 0 and recent_view is not None:
+
+async def home_section_trending() -> list[dict[str, Any]]:
+    prod_list = await get_top_rated_products()
+    return await format_homelisting_product(prod_list)
+
+
+async def home_section_explore(
+    catalog: CatalogSnapshot, seed: int | None = None
+) -> list[dict[str, Any]]:
+    # sample positions instead of products, sampling from a range never copies the catalog
+    rng = explore_rng(seed)
+    positions = rng.sample(range(len(catalog.products)), min(15, len(catalog.products)))
+    return [catalog.cards[catalog.products[i]["id"]] for i in positions]
+
+
+def explore_rng(seed: int | None = None) -> random.Random:
+    """
+    Random generator of the explore section, seeded with `seed` when given. With `EXPLORE_SEED` set every request gets
+    the same products (for reproducible load tests) as long as the catalog does not change.
+    """
+    if settings.EXPLORE_SEED is not None:
+        return random.Random(settings.EXPLORE_SEED)
+    return random.Random(seed)
+
+
+async def home_section_same_location(
+    catalog: CatalogSnapshot, location: str, user_id: str
+) -> list[dict[str, Any]]:
+    return rotate(catalog.by_location.get(location, ()), user_id)
+
+
+async def home_section_age_range(
+    catalog: CatalogSnapshot, age: int, user_id: str
+) -> list[dict[str, Any]]:
+    return rotate(catalog.for_age(age), user_id)
+
+
+def rotation_window() -> int:
+    """The current window of `HOME_SECTION_ROTATION_SECONDS`, as numbered by `cache_response`"""
+    return int(time.time() // settings.HOME_SECTION_ROTATION_SECONDS)
+
+
+def rotate(
+    products: Sequence[dict[str, Any]], user_id: str, n=15
+) -> list[dict[str, Any]]:
+    """
+    `n` consecutive products starting at an offset derived from the user and the current rotation period, so each
+    user sees a different window of a long list and the window moves every `HOME_SECTION_ROTATION_SECONDS`.
+    """
+    if len(products) <= n:
+        return list(products)
+    start = zlib.crc32(f"{user_id}:{rotation_window()}".encode()) % len(products)
+    return list(products[start : start + n]) + list(
+        products[: max(0, start + n - len(products))]
+    )
+
+
+async def home_section_similar_to_recent_view(
+    catalog: CatalogSnapshot, bundle: ModelBundle | None, recent_view: str
+) -> list[dict[str, Any]]:
+    index = content_index(catalog, bundle)
+    if index is None and settings.CONTENT_FEATURIZER == "hashing":
+        # the content index of this worker is still being built
+        return []
+    if index is None and not similar_fallback_limiter.available():
+        raise Exception("every fallback training slot is taken")
+
+    def recommend() -> list[dict[str, Any]]:
         content_recommended_prods = []
         for i in recent_view.split(",")[:3]:
-            for j in cbf(product_id=i, top_n=5, product_data=list(all_products))[
-                "recommended_products"
-            ]:
+            if index is not None:
+                # use a prebuilt content index instead of fitting TF-IDF on every request
+                recommended_products = [
+                    catalog.by_id[j]
+                    for j, _ in index.similar(i, top_n=5)
+                    if j in catalog.by_id
+                ]
+            else:
+                results = cbf(
+                    product_id=i,
+                    top_n=5,
+                    product_data=list(catalog.products),
+                    similarity_dtype=settings.SIMILARITY_DTYPE,
+                )
+                recommended_products = (
+                    results["recommended_products"] if isinstance(results, dict) else []
+                )
+            for j in recommended_products:
                 item_already_exists = list(
                     filter(
                         lambda product: product["id"] == j["id"],
@@ -263,66 +597,74 @@ async def home_product_listing(
         # shuffle items
         random.shuffle(content_recommended_prods)
 
-        response_data["similar_to_recent_view"] = await format_homelisting_product(
-            content_recommended_prods
-        )
-
-    # EXPLORE (A RANDOM SELECTION FOR PRODUCTS)
-    response_data["explore"] = await format_homelisting_product(
-        random.sample(all_products, 15)
-    )
-
-    if current_user is not None:
-        # GET PRODUCT IN USERS COUNTRY (LOCATION)
-        response_data["same_location"] = await format_homelisting_product(
-            list(
-                filter(
-                    lambda product: product["location"] == current_user.location,
-                    all_products,
-                )
-            )[:15]
-        )
+        return [
+            catalog.cards[i["id"]]
+            for i in content_recommended_prods
+            if i["id"] in catalog.cards
+        ]
 
-        # GET PRODUCTS IN USERS AGE RANGE
-        response_data["age_range"] = await format_homelisting_product(
-            list(
-                filter(
-                    lambda product: product["max_age_range"] >= current_user.age,
-                    all_products,
-                )
-            )[:15]
-        )
+    # recommenders are CPU bound, run them in a thread so the timeout can fire and other sections keep running
+    if index is not None:
+        return await run_in_threadpool(recommend)
+    # TF-IDF is fitted on the whole catalog, the number of concurrent fits is bounded
+    return await similar_fallback_limiter.run(recommend)
 
-        # USERS PERSONAL RECOMMENDATION (USING COLLABORATIVE FILTERING)
-        all_ratings = ProductRatingListModel(
-            product_ratings=[doc async for doc in product_rating_coll.find({})]
-        )
 
-        # COLLABORATIVE FILTERING
-        collaborative_recommendations = cf(
-            current_user.id, all_ratings.model_dump()["product_ratings"], top_n=15
+async def home_section_might_interest_you(
+    catalog: CatalogSnapshot, bundle: ModelBundle | None, user_id: str
+) -> list[dict[str, Any]]:
+    if bundle is not None and bundle.cf_model is not None:
+        # use the pre-trained model instead of training on every request
+        collaborative_recommendations = await run_in_threadpool(
+            bundle.cf_model.recommend, user_id, n=15
         )
-        prod_list = [
-            doc
-            async for doc in products_coll.find(
-                {
-                    "_id": {
-                        "$in": [ObjectId(i[0]) for i in collaborative_recommendations]
-                    }
-                }
+    else:
+        # checked before reading every rating, a section without a free slot returns its last result
+        if not interest_fallback_limiter.available():
+            raise Exception("every fallback training slot is taken")
+
+        product_rating_coll = get_collection(MONGO_COLLECTIONS.PRODUCT_RATINGS)
+        if product_rating_coll is None:
+            raise HTTPMessageException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                message=collection_error_msg(
+                    "home_section_might_interest_you",
+                    MONGO_COLLECTIONS.PRODUCT_RATINGS.name,
+                ),
             )
+
+        all_ratings = [
+            doc async for doc in product_rating_coll.find({}, RATING_DATA_PROJECTION)
         ]
-        prod_list = ProductListModel(products=prod_list)
-        response_data["might_interest_you"] = await format_homelisting_product(
-            prod_list.model_dump()["products"]
+
+        # COLLABORATIVE FILTERING, trained for this request
+        collaborative_recommendations = await interest_fallback_limiter.run(
+            cf,
+            user_id,
+            all_ratings,
+            top_n=15,
+            similarity_dtype=settings.SIMILARITY_DTYPE,
         )
 
-    return Message(
-        status_code=status.HTTP_200_OK,
-        success=True,
-        message="Product Listings",
-        data=response_data,
-    )
+    return [
+        catalog.cards[i[0]]
+        for i in collaborative_recommendations
+        if i[0] in catalog.cards
+    ]
+
+
+def content_index(
+    catalog: CatalogSnapshot, bundle: ModelBundle | None
+) -> HashedTfidfIndex | None:
+    """
+    The content index of the served model version, or with `CONTENT_FEATURIZER=hashing` the index this worker builds
+    in the background (`None` until its first build finished). `None` otherwise, TF-IDF is then fitted on the snapshot.
+    """
+    if bundle is not None and bundle.content_index is not None:
+        return bundle.content_index
+    if settings.CONTENT_FEATURIZER == "hashing":
+        return content_index_service.get(catalog.version)
+    return None
 
 
 @router.get("/get-related-products/{product_id}")
@@ -332,89 +674,264 @@ async def get_related_products(
     max_price: float = None,
     category_id: str = None,
 ):
-    products_coll = get_collection(MONGO_COLLECTIONS.PRODUCTS)
-    if products_coll is None:
-        raise HTTPMessageException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            message=collection_error_msg(
-                "get_related_products", MONGO_COLLECTIONS.PRODUCTS.name
-            ),
+    catalog = await catalog_cache.get()
+
+    if (index := content_index(catalog, model_server.bundle)) is not None:
+        results = hashing_cbf(product_id=product_id, index=index, top_n=10)
+        recommended_ids = (
+            [i["id"] for i in results["recommended_products"]]
+            if isinstance(results, dict)
+            else []
+        )
+        related_products = [
+            catalog.cards[i] for i in recommended_ids if i in catalog.cards
+        ]
+        return json_message(
+            Message(
+                status_code=status.HTTP_200_OK,
+                message="Related products",
+                success=True,
+                data=related_products,
+            )
         )
 
-    # get related products using content-based filtering
-    products = ProductListModel(products=[doc async for doc in products_coll.find({})])
-    products = [
-        {**prod.model_dump(), "selling_price": prod.selling_price}
-        for prod in products.products
-    ]
+    if settings.CONTENT_FEATURIZER == "hashing":
+        # the content index of this worker is still being built, the catalog is not featurized on the request path
+        return json_message(
+            Message(
+                status_code=status.HTTP_200_OK,
+                message="Related products",
+                success=True,
+                data=[],
+            )
+        )
 
+    # get related products using content-based filtering
     # results_hcbf = hcbf(
     results_hcbf = cbf(
         product_id=product_id,
-        product_data=products,
+        product_data=list(catalog.products),
         top_n=10,
+        similarity_dtype=settings.SIMILARITY_DTYPE,
         # user_location=location,
         # max_price=max_price,
         # preferred_category=category_id,
     )
 
-    products_list = ProductListModel(
-        products=[
-            product
-            for product in results_hcbf["recommended_products"]
-            if product["id"] != product_id
-        ]
-    ).model_dump()
-
-    related_products = await format_homelisting_product(products_list["products"])
+    related_products = [
+        catalog.cards[product["id"]]
+        for product in results_hcbf["recommended_products"]
+        if product["id"] != product_id and product["id"] in catalog.cards
+    ]
 
-    return Message(
-        status_code=status.HTTP_200_OK,
-        message="Related products",
-        success=True,
-        data=related_products,
+    return json_message(
+        Message(
+            status_code=status.HTTP_200_OK,
+            message="Related products",
+            success=True,
+            data=related_products,
+        )
     )
 
 
-@router.get("/{product_id}", name="get_product_by_id")
-async def get_product_by_id(product_id: str):
-    """Get a product by its id"""
+@router.post("/recommendations/batch", name="get_batch_recommendations")
+async def get_batch_recommendations(batch_dto: RecommendationBatchDto):
+    """
+    Compute recommendations for many users (collaborative filtering) and/or many products (content-based filtering)
+    in a single call, each model is built once and shared by the whole batch.
+
+    Results are streamed back as NDJSON, one line per requested user or product.
+    """
+    if len(batch_dto.user_ids) <= 0 and len(batch_dto.product_ids) <= 0:
+        raise HTTPMessageException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            message="Provide at least one user id or product id",
+        )
+
     products_coll = get_collection(MONGO_COLLECTIONS.PRODUCTS)
     if products_coll is None:
         raise HTTPMessageException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             message=collection_error_msg(
-                "get_product_by_id", MONGO_COLLECTIONS.PRODUCTS.name
+                "get_batch_recommendations", MONGO_COLLECTIONS.PRODUCTS.name
             ),
-            success=False,
         )
-    categories_coll = get_collection(MONGO_COLLECTIONS.CATEGORIES)
-    if categories_coll is None:
+
+    product_rating_coll = get_collection(MONGO_COLLECTIONS.PRODUCT_RATINGS)
+    if product_rating_coll is None:
         raise HTTPMessageException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             message=collection_error_msg(
-                "get_product_by_id", MONGO_COLLECTIONS.CATEGORIES.name
+                "get_batch_recommendations", MONGO_COLLECTIONS.PRODUCT_RATINGS.name
             ),
-            success=False,
         )
-    user_coll = get_collection(MONGO_COLLECTIONS.USERS)
-    if user_coll is None:
+
+    # a served model version is shared by the whole batch, otherwise the models are built for this batch
+    bundle = model_server.bundle
+    content_index = bundle.content_index if bundle is not None else None
+    cf_model = bundle.cf_model if bundle is not None else None
+
+    product_data = []
+    if len(batch_dto.product_ids) > 0 and content_index is None:
+        product_data = [
+            {**doc, "id": str(doc["_id"])}
+            async for doc in products_coll.find(
+                {}, {"_id": 1, "product_name": 1, "product_description": 1}
+            )
+        ]
+
+    rating_data = []
+    if len(batch_dto.user_ids) > 0 and cf_model is None:
+        rating_data = [
+            doc async for doc in product_rating_coll.find({}, RATING_DATA_PROJECTION)
+        ]
+
+    def ndjson_line(*, recommendations, **key) -> bytes:
+        if isinstance(recommendations, list):
+            recommendations = [
+                {"id": i, "score": score} for i, score in recommendations
+            ]
+        return dump_json({**key, "recommendations": recommendations}) + b"\n"
+
+    def ndjson_lines() -> Iterator[bytes]:
+        # a sync generator is iterated in a threadpool by `StreamingResponse`, so model training does not block the event loop
+        if len(batch_dto.product_ids) > 0 and content_index is not None:
+            for product_id in batch_dto.product_ids:
+                yield ndjson_line(
+                    product_id=product_id,
+                    recommendations=(
+                        [
+                            (i, round(score, 2))
+                            for i, score in content_index.similar(
+                                product_id, top_n=batch_dto.top_n
+                            )
+                        ]
+                        if product_id in content_index
+                        else "Product not found."
+                    ),
+                )
+        elif len(batch_dto.product_ids) > 0:
+            for product_id, recommendations in cbf_batch(
+                product_ids=batch_dto.product_ids,
+                top_n=batch_dto.top_n,
+                product_data=product_data,
+                similarity_dtype=settings.SIMILARITY_DTYPE,
+            ):
+                yield ndjson_line(
+                    product_id=product_id, recommendations=recommendations
+                )
+
+        if len(batch_dto.user_ids) > 0:
+            for user_id, recommendations in cf_batch(
+                batch_dto.user_ids,
+                rating_data,
+                top_n=batch_dto.top_n,
+                similarity_dtype=settings.SIMILARITY_DTYPE,
+                cf_model=cf_model,
+            ):
+                yield ndjson_line(user_id=user_id, recommendations=recommendations)
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+
+@router.post("/bulk", name="get_products_bulk")
+async def get_products_bulk(bulk_dto: ProductBulkDto):
+    """
+    Product cards (with their rating statistics) of a list of ids, in the order requested.
+
+    Products are read from the catalog snapshot, ids missing from it are looked up with a single `$in` query, ids of
+    products that do not exist are returned in `missing`.
+    """
+    product_ids = list(dict.fromkeys(bulk_dto.product_ids))
+    valid_ids = [i for i in product_ids if ObjectId.is_valid(i)]
+    products = await catalog_cache.get_products(valid_ids)
+
+    return json_message(
+        Message(
+            message="Products",
+            status_code=status.HTTP_200_OK,
+            success=True,
+            data={
+                "products": [products[i] for i in product_ids if i in products],
+                "missing": [i for i in product_ids if i not in products],
+            },
+        )
+    )
+
+
+@router.get("/export", name="export_products")
+async def export_products(
+    batch_size: int = Query(default=settings.EXPORT_BATCH_SIZE, ge=1, le=10_000),
+    gzip: bool = False,
+):
+    """
+    Stream the whole catalog as NDJSON, one product (with `selling_price` and `avg_rating`) per line.
+
+    Products are read from a cursor `batch_size` at a time and each batch is written out before the next one is read,
+    so memory use does not grow with the catalog. With `gzip` the stream is compressed as it is written.
+    """
+    products_coll = get_collection(MONGO_COLLECTIONS.PRODUCTS)
+    if products_coll is None:
         raise HTTPMessageException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             message=collection_error_msg(
-                "get_product_by_id", MONGO_COLLECTIONS.USERS.name
+                "export_products", MONGO_COLLECTIONS.PRODUCTS.name
             ),
         )
-    product_rating_coll = get_collection(MONGO_COLLECTIONS.PRODUCT_RATINGS)
-    if product_rating_coll is None:
+
+    def ndjson_chunk(documents: list[dict[str, Any]]) -> bytes:
+        return b"".join(dump_json(i) + b"\n" for i in listing_records(documents))
+
+    async def ndjson_chunks() -> AsyncIterator[bytes]:
+        cursor = products_coll.find({}).sort("_id", 1).batch_size(batch_size)
+        documents = []
+        async for doc in cursor:
+            documents.append(doc)
+            if len(documents) >= batch_size:
+                yield ndjson_chunk(documents)
+                documents = []
+        if len(documents) > 0:
+            yield ndjson_chunk(documents)
+
+    async def gzip_chunks() -> AsyncIterator[bytes]:
+        # a gzip container (wbits=31) compressed incrementally, only what the compressor emits is sent
+        compressor = zlib.compressobj(wbits=31)
+        async for chunk in ndjson_chunks():
+            if len(compressed := compressor.compress(chunk)) > 0:
+                yield compressed
+        yield compressor.flush()
+
+    if gzip:
+        return StreamingResponse(
+            gzip_chunks(),
+            media_type="application/x-ndjson",
+            headers={"Content-Encoding": "gzip"},
+        )
+    return StreamingResponse(ndjson_chunks(), media_type="application/x-ndjson")
+
+
+@router.get("/{product_id}", name="get_product_by_id")
+@cache_response()
+async def get_product_by_id(product_id: str):
+    """Get a product by its id"""
+    products_coll = get_collection(MONGO_COLLECTIONS.PRODUCTS)
+    if products_coll is None:
         raise HTTPMessageException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             message=collection_error_msg(
-                "get_product_by_id", MONGO_COLLECTIONS.PRODUCT_RATINGS.name
+                "get_product_by_id", MONGO_COLLECTIONS.PRODUCTS.name
+            ),
+            success=False,
+        )
+    categories_coll = get_collection(MONGO_COLLECTIONS.CATEGORIES)
+    if categories_coll is None:
+        raise HTTPMessageException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            message=collection_error_msg(
+                "get_product_by_id", MONGO_COLLECTIONS.CATEGORIES.name
             ),
             success=False,
         )
-
     if (product := await products_coll.find_one({"_id": ObjectId(product_id)})) is None:
         raise HTTPMessageException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -435,26 +952,12 @@ async def get_product_by_id(product_id: str):
 
     category = CategoryModel(**category)
 
-    product_ratings = [
-        doc async for doc in product_rating_coll.find({"product_id": product_id})
-    ]
-
-    avg_rating = sum(r["rating"] for r in product_ratings) / len(product_ratings)
-    avg_rating = round(avg_rating, 2)
+    avg_rating = round(product.avg_rating, 2)
 
-    product_ratings = ProductRatingListModel(
-        product_ratings=product_ratings
-    ).model_dump()
-
-    product_ratings = [
-        {
-            **rating,
-            "user_id": PublicUserModel(
-                **(await user_coll.find_one({"_id": ObjectId(rating["user_id"])})),
-            ).model_dump(),
-        }
-        for rating in product_ratings["product_ratings"]
-    ]
+    # only the newest ratings are returned with the product, the rest are paginated with `/{product_id}/reviews`
+    product_ratings = await get_product_reviews_page(
+        product_id, page=1, page_size=REVIEWS_PAGE_SIZE
+    )
 
     return Message(
         message="All categories",
@@ -466,77 +969,129 @@ async def get_product_by_id(product_id: str):
             "category_id": category.model_dump(),
             "selling_price": product.selling_price,
             "product_ratings": product_ratings,
+            "product_ratings_total": product.rating_count,
         },
     )
 
 
-async def format_homelisting_product(
-    products_to_format: list[dict[str, Any]],
-) -> list[dict[str, Any]]:
-    """utility function adding the average rating and selling price to a list of products"""
+@router.get("/{product_id}/reviews", name="get_product_reviews")
+async def get_product_reviews(
+    product_id: str,
+    page: int = Query(default=1, ge=1),
+    page_size: int = Query(default=REVIEWS_PAGE_SIZE, ge=1, le=100),
+):
+    """Get a page of the ratings of a product, newest first"""
     products_coll = get_collection(MONGO_COLLECTIONS.PRODUCTS)
     if products_coll is None:
         raise HTTPMessageException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             message=collection_error_msg(
-                "format_homelisting_product", MONGO_COLLECTIONS.PRODUCTS.name
+                "get_product_reviews", MONGO_COLLECTIONS.PRODUCTS.name
             ),
         )
 
-    product_rating_coll = get_collection(MONGO_COLLECTIONS.PRODUCT_RATINGS)
-    if product_rating_coll is None:
+    if (
+        product := await products_coll.find_one(
+            {"_id": ObjectId(product_id)}, {"rating_count": 1}
+        )
+    ) is None:
         raise HTTPMessageException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            message=collection_error_msg(
-                "format_homelisting_product", MONGO_COLLECTIONS.PRODUCT_RATINGS.name
-            ),
+            status_code=status.HTTP_404_NOT_FOUND,
+            message=f"Product with id: {product_id} does not exist",
         )
 
-    all_products = []
-    for doc in products_to_format:
-        product = ProductModel(**doc)
-        product_ratings = [
-            doc async for doc in product_rating_coll.find({"product_id": product.id})
-        ]
-        avg_rating = sum(r["rating"] for r in product_ratings) / len(product_ratings)
+    product_ratings = await get_product_reviews_page(
+        product_id, page=page, page_size=page_size
+    )
 
-        all_products.append(
-            {
-                **product.model_dump(),
-                "selling_price": product.selling_price,
-                "avg_rating": round(avg_rating, 2),
-            }
+    return json_message(
+        Message(
+            message="Product reviews",
+            status_code=status.HTTP_200_OK,
+            success=True,
+            data={
+                "product_ratings": product_ratings,
+                "page": page,
+                "page_size": page_size,
+                "total": product.get("rating_count", 0),
+            },
         )
+    )
 
-    return all_products
 
+async def get_product_reviews_page(
+    product_id: str, page: int, page_size: int
+) -> list[dict[str, Any]]:
+    """
+    A page of the ratings of a product, newest first, each with the public fields of its user.
 
-async def get_top_rated_products(limit=15):
-    """Get product with the highest average rating"""
+    The users of the whole page are fetched with a single `$in` query, so the cost does not grow with the number of
+    reviews. The rating of a user that no longer exists has `user_id` set to `None`.
+    """
     product_rating_coll = get_collection(MONGO_COLLECTIONS.PRODUCT_RATINGS)
     if product_rating_coll is None:
         raise HTTPMessageException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             message=collection_error_msg(
-                "get_top_rated_products", MONGO_COLLECTIONS.PRODUCT_RATINGS.name
+                "get_product_reviews_page", MONGO_COLLECTIONS.PRODUCT_RATINGS.name
+            ),
+        )
+    user_coll = get_collection(MONGO_COLLECTIONS.USERS)
+    if user_coll is None:
+        raise HTTPMessageException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            message=collection_error_msg(
+                "get_product_reviews_page", MONGO_COLLECTIONS.USERS.name
             ),
         )
 
-    pipeline = [
-        {
-            "$group": {
-                "_id": "$product_id",
-                "average_rating": {"$avg": "$rating"},
-                "rating_count": {"$sum": 1},
-            }
-        },
-        {"$sort": {"average_rating": -1}},
-        {"$limit": limit},
+    # served by the (product_id, created_at) index
+    cursor = (
+        product_rating_coll.find({"product_id": product_id})
+        .sort("created_at", -1)
+        .skip((page - 1) * page_size)
+        .limit(page_size)
+    )
+    product_ratings = ProductRatingListModel(
+        product_ratings=await cursor.to_list(length=page_size)
+    ).model_dump()["product_ratings"]
+
+    user_ids = list({ObjectId(rating["user_id"]) for rating in product_ratings})
+    users = {
+        str(doc["_id"]): PublicUserModel(**doc).model_dump()
+        async for doc in user_coll.find(
+            {"_id": {"$in": user_ids}}, PUBLIC_USER_PROJECTION
+        )
+    }
+
+    return [
+        {**rating, "user_id": users.get(rating["user_id"])}
+        for rating in product_ratings
     ]
 
-    cursor = product_rating_coll.aggregate(pipeline)
-    top_products = []
-    async for doc in cursor:
-        top_products.append(doc)
 
-    return top_products
+async def format_homelisting_product(
+    products_to_format: list[dict[str, Any]],
+) -> list[dict[str, Any]]:
+    """utility function adding the average rating and selling price to a list of products read with `PRODUCT_CARD_PROJECTION`"""
+    return listing_records(products_to_format, model=ProductCardModel)
+
+
+async def get_top_rated_products(limit=15):
+    """Get product with the highest average rating, an indexed sort on the denormalized `avg_rating`"""
+    products_coll = get_collection(MONGO_COLLECTIONS.PRODUCTS)
+    if products_coll is None:
+        raise HTTPMessageException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            message=collection_error_msg(
+                "get_top_rated_products", MONGO_COLLECTIONS.PRODUCTS.name
+            ),
+        )
+
+    # ties are broken by the number of ratings, a product rated 5 once is not ahead of one rated 5 a hundred times
+    cursor = (
+        products_coll.find({}, PRODUCT_CARD_PROJECTION)
+        .sort([("avg_rating", -1), ("rating_count", -1)])
+        .limit(limit)
+    )
+    return await cursor.to_list(length=limit)
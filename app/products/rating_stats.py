@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta
+from typing import Any
+
+from pymongo import UpdateOne
+
+from app.core.db import get_collection, MONGO_COLLECTIONS
+from app.core.utils import collection_error_msg
+from app.products.catalog import bump_catalog_version
+
+# a rating is inserted before the statistics of its product are incremented, products rated more recently than this
+# are not reconciled
+RECENT_RATING_SECONDS = 60
+
+
+def rating_stats_update(rating: int) -> list[dict[str, Any]]:
+    """
+    Update pipeline adding a rating to the denormalized `rating_sum`, `rating_count` and `avg_rating` of a product.
+
+    `rating_sum` and `rating_count` are incremented and `avg_rating` recomputed from them in the same atomic update.
+    """
+    return [
+        {
+            "$set": {
+                "rating_sum": {"$add": [{"$ifNull": ["$rating_sum", 0]}, rating]},
+                "rating_count": {"$add": [{"$ifNull": ["$rating_count", 0]}, 1]},
+            }
+        },
+        {"$set": {"avg_rating": {"$divide": ["$rating_sum", "$rating_count"]}}},
+    ]
+
+
+async def reconcile_product_rating_stats(batch_size=1000) -> int:
+    """
+    Recompute the denormalized rating statistics of every product from the `productRatings` collection.
+
+    Used to backfill existing products and to repair drift, returns the number of rated products. A product without
+    ratings (never rated, or every rating deleted) is reset to zero.
+
+    Ratings keep being added while this runs, so the counters of every product are read before the ratings are
+    aggregated, and a product is only written if its counters are still the ones read (an `add_product_rating`
+    increment is never overwritten). Products rated in the last `RECENT_RATING_SECONDS` are left for the next run,
+    their rating may be counted by the aggregation before its increment is applied.
+    """
+    products_coll = get_collection(MONGO_COLLECTIONS.PRODUCTS)
+    if products_coll is None:
+        raise Exception(
+            collection_error_msg(
+                "reconcile_product_rating_stats", MONGO_COLLECTIONS.PRODUCTS.name
+            )
+        )
+    product_rating_coll = get_collection(MONGO_COLLECTIONS.PRODUCT_RATINGS)
+    if product_rating_coll is None:
+        raise Exception(
+            collection_error_msg(
+                "reconcile_product_rating_stats", MONGO_COLLECTIONS.PRODUCT_RATINGS.name
+            )
+        )
+
+    counters = {
+        str(doc["_id"]): doc
+        async for doc in products_coll.find(
+            {}, {"rating_sum": 1, "rating_count": 1, "avg_rating": 1}
+        )
+    }
+
+    recent = datetime.now() - timedelta(seconds=RECENT_RATING_SECONDS)
+    pipeline = [
+        {
+            "$group": {
+                "_id": "$product_id",
+                "rating_sum": {"$sum": "$rating"},
+                "rating_count": {"$sum": 1},
+                "last_rated_at": {"$max": "$created_at"},
+            }
+        },
+    ]
+    stats = {doc["_id"]: doc async for doc in product_rating_coll.aggregate(pipeline)}
+
+    updates = []
+    for product_id, current in counters.items():
+        rated = stats.get(product_id)
+        if rated is not None and rated["last_rated_at"] > recent:
+            continue
+
+        expected = {"rating_sum": 0, "rating_count": 0, "avg_rating": 0}
+        if rated is not None:
+            expected = {
+                "rating_sum": rated["rating_sum"],
+                "rating_count": rated["rating_count"],
+                "avg_rating": rated["rating_sum"] / rated["rating_count"],
+            }
+        if all(current.get(field) == value for field, value in expected.items()):
+            continue
+
+        updates.append(
+            UpdateOne(
+                {
+                    "_id": current["_id"],
+                    # a missing counter matches `None`
+                    "rating_sum": current.get("rating_sum"),
+                    "rating_count": current.get("rating_count"),
+                },
+                {"$set": expected},
+            )
+        )
+        if len(updates) >= batch_size:
+            await products_coll.bulk_write(updates, ordered=False)
+            updates = []
+    if updates:
+        await products_coll.bulk_write(updates, ordered=False)
+
+    await bump_catalog_version()
+
+    return sum(1 for product_id in stats if product_id in counters)
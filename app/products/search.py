@@ -0,0 +1,259 @@
+import asyncio
+import heapq
+import logging
+import math
+import re
+import time
+from bisect import bisect_left, insort
+from collections import Counter
+from typing import Any
+
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+from starlette.concurrency import run_in_threadpool
+
+from app.products.catalog import CatalogSnapshot, catalog_cache
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+# a product name says more about the product than its description, name tokens are counted this many times
+NAME_WEIGHT = 2
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+# a query token also matches indexed terms it is a prefix of ("cabb" -> "cabbage"), with a lower weight than an
+# exact match, at most `MAX_PREFIX_EXPANSIONS` terms are expanded per query token
+PREFIX_MATCH_WEIGHT = 0.5
+MAX_PREFIX_EXPANSIONS = 50
+
+
+def tokenize(text: str) -> list[str]:
+    return [
+        token
+        for token in TOKEN_PATTERN.findall(text.lower())
+        if token not in ENGLISH_STOP_WORDS
+    ]
+
+
+def searchable_text(product: dict[str, Any]) -> tuple[str, str]:
+    return product["product_name"], product["product_description"]
+
+
+class ProductSearchIndex:
+    """
+    An inverted index over the tokenized name and description of every product, ranked with BM25.
+
+    `postings[term]` maps a product id to the term's frequency in that product, the vocabulary is also kept sorted so
+    prefix matches are a binary search. An index is not changed once it is searched, `synced` returns a new index
+    matching a newer catalog snapshot, only re-indexing the products whose text changed and sharing every postings
+    list they do not touch with the previous index.
+    """
+
+    def __init__(self):
+        # the catalog snapshot the index was synced with
+        self.snapshot: CatalogSnapshot | None = None
+        self.postings: dict[str, dict[str, int]] = {}
+        self.vocabulary: list[str] = []
+        self.doc_lengths: dict[str, int] = {}
+        self.texts: dict[str, tuple[str, str]] = {}
+        self.total_length = 0
+        # terms whose postings list belongs to this index, the others are shared with the index it was synced from
+        # and copied before they are changed (`None` when nothing is shared)
+        self._owned_terms: set[str] | None = None
+        self._owns_vocabulary = True
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def _term_postings(self, term: str) -> dict[str, int]:
+        """The postings list of `term`, to be changed"""
+        if self._owned_terms is not None and term not in self._owned_terms:
+            self.postings[term] = dict(self.postings[term])
+            self._owned_terms.add(term)
+        return self.postings[term]
+
+    def _changed_vocabulary(self) -> list[str]:
+        if not self._owns_vocabulary:
+            self.vocabulary = list(self.vocabulary)
+            self._owns_vocabulary = True
+        return self.vocabulary
+
+    def add(self, product: dict[str, Any]) -> None:
+        product_id = product["id"]
+        if product_id in self.doc_lengths:
+            self.remove(product_id)
+
+        name, description = searchable_text(product)
+        frequencies = Counter(tokenize(description))
+        for token in tokenize(name):
+            frequencies[token] += NAME_WEIGHT
+
+        for term, frequency in frequencies.items():
+            if term not in self.postings:
+                self.postings[term] = {}
+                if self._owned_terms is not None:
+                    self._owned_terms.add(term)
+                insort(self._changed_vocabulary(), term)
+            self._term_postings(term)[product_id] = frequency
+
+        doc_length = sum(frequencies.values())
+        self.doc_lengths[product_id] = doc_length
+        self.texts[product_id] = (name, description)
+        self.total_length += doc_length
+
+    def remove(self, product_id: str) -> None:
+        if product_id not in self.doc_lengths:
+            return
+
+        name, description = self.texts.pop(product_id)
+        for term in set(tokenize(name)) | set(tokenize(description)):
+            if term not in self.postings:
+                continue
+            postings = self._term_postings(term)
+            postings.pop(product_id, None)
+            if len(postings) <= 0:
+                del self.postings[term]
+                vocabulary = self._changed_vocabulary()
+                del vocabulary[bisect_left(vocabulary, term)]
+
+        self.total_length -= self.doc_lengths.pop(product_id)
+
+    def synced(self, snapshot: CatalogSnapshot) -> "ProductSearchIndex":
+        """
+        An index matching `snapshot`, this index is left unchanged. Only products added, removed or with a changed
+        text are re-indexed, the postings lists of their terms are copied and every other one is shared.
+        """
+        removed = [i for i in self.doc_lengths if i not in snapshot.by_id]
+        changed = [
+            product
+            for product in snapshot.products
+            if self.texts.get(product["id"]) != searchable_text(product)
+        ]
+
+        index = ProductSearchIndex()
+        index.snapshot = snapshot
+        index.postings, index.vocabulary = self.postings, self.vocabulary
+        index.doc_lengths, index.texts = self.doc_lengths, self.texts
+        index.total_length = self.total_length
+        if len(removed) <= 0 and len(changed) <= 0:
+            # e.g. a snapshot reloaded for its rating statistics, everything is shared
+            return index
+
+        # the top level tables are copied (references only), the postings lists are copied when they change
+        index.postings = dict(self.postings)
+        index.doc_lengths, index.texts = dict(self.doc_lengths), dict(self.texts)
+        index._owned_terms, index._owns_vocabulary = set(), False
+        for product_id in removed:
+            index.remove(product_id)
+        for product in changed:
+            index.add(product)
+        return index
+
+    def _expand(self, token: str) -> dict[str, float]:
+        """Indexed terms matched by a query token with the weight of each match"""
+        matches = {}
+        start = bisect_left(self.vocabulary, token)
+        for term in self.vocabulary[start : start + MAX_PREFIX_EXPANSIONS]:
+            if not term.startswith(token):
+                break
+            matches[term] = 1.0 if term == token else PREFIX_MATCH_WEIGHT
+        return matches
+
+    def search(self, query: str, limit: int | None = None) -> list[tuple[str, float]]:
+        """
+        Ids of the products matching every token of `query` with their BM25 score, best match first.
+
+        Only the best `limit` matches are sorted when a limit is given.
+        """
+        tokens = tokenize(query)
+        if len(tokens) <= 0 or len(self) <= 0:
+            return []
+
+        n_docs = len(self)
+        avg_length = self.total_length / n_docs
+        scores: dict[str, float] | None = None
+        for token in tokens:
+            token_scores: dict[str, float] = {}
+            for term, weight in self._expand(token).items():
+                postings = self.postings[term]
+                idf = math.log(
+                    1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5)
+                )
+                for product_id, frequency in postings.items():
+                    norm = K1 * (1 - B + B * self.doc_lengths[product_id] / avg_length)
+                    score = weight * idf * frequency * (K1 + 1) / (frequency + norm)
+                    # a token matching several terms of a product counts its best match
+                    token_scores[product_id] = max(
+                        token_scores.get(product_id, 0), score
+                    )
+
+            # every query token has to match
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {
+                    product_id: score + token_scores[product_id]
+                    for product_id, score in scores.items()
+                    if product_id in token_scores
+                }
+            if len(scores) <= 0:
+                return []
+
+        if limit is not None:
+            return heapq.nsmallest(limit, scores.items(), key=lambda x: (-x[1], x[0]))
+        return sorted(scores.items(), key=lambda x: (-x[1], x[0]))
+
+
+class ProductSearchService:
+    """
+    Holds the search index of this worker.
+
+    The index is synced with a new catalog snapshot in the background and swapped in once synced, requests keep
+    searching the current index meanwhile.
+    """
+
+    def __init__(self):
+        self.index: ProductSearchIndex | None = None
+        self._sync_task: asyncio.Task | None = None
+
+    async def _sync(self, snapshot: CatalogSnapshot) -> None:
+        start = time.perf_counter()
+        index = self.index if self.index is not None else ProductSearchIndex()
+        self.index = await run_in_threadpool(index.synced, snapshot)
+        logger.info(
+            f"  search index synced, {len(self.index)} products in {time.perf_counter() - start:.3f}s"
+        )
+
+    async def _sync_in_background(self, snapshot: CatalogSnapshot) -> None:
+        try:
+            await self._sync(snapshot)
+        except Exception as exc:
+            logger.error(f"  search index sync failed: {exc}")
+
+    async def get(self) -> ProductSearchIndex:
+        snapshot = await catalog_cache.get()
+        if self.index is None:
+            # concurrent first requests wait for the same build
+            if self._sync_task is None or self._sync_task.done():
+                self._sync_task = asyncio.create_task(self._sync(snapshot))
+            await asyncio.shield(self._sync_task)
+        elif snapshot is not self.index.snapshot and (
+            self._sync_task is None or self._sync_task.done()
+        ):
+            self._sync_task = asyncio.create_task(self._sync_in_background(snapshot))
+        return self.index
+
+
+product_search_service = ProductSearchService()
+
+
+async def search_products(
+    query: str, offset: int = 0, limit: int = 10
+) -> list[dict[str, Any]]:
+    """A page of the product cards matching `query`, from the catalog snapshot the search index was synced with"""
+    index = await product_search_service.get()
+    cards = index.snapshot.cards
+
+    results = index.search(query, limit=offset + limit)[offset:]
+    return [cards[i] for i, _ in results if i in cards]
@@ -1,4 +1,7 @@
+import numpy as np
 import pandas as pd
+from dataclasses import dataclass, field
+from scipy import sparse
 from surprise import (
     Dataset,
     Reader,
@@ -8,9 +11,11 @@ from surprise.model_selection import (
     train_test_split,
 )  # Splitting dataset for training/testing
 from surprise import accuracy  # Accuracy metrics for evaluation
-from typing import List, Any
+from typing import List, Any, Iterator
 from surprise.dataset import DatasetAutoFolds
 
+from app.recommendation_systems.quantization import SimilarityDtype, store_matrix
+
 
 def load_data(data_dict: List[dict[str, Any]]):
     """Loads sample dataset and prepares it for Surprise library."""
@@ -26,7 +31,11 @@ def load_data(data_dict: List[dict[str, Any]]):
     return data, df
 
 
-def train_model(data: DatasetAutoFolds, sim_type="user"):
+def train_model(
+    data: DatasetAutoFolds,
+    sim_type="user",
+    similarity_dtype: SimilarityDtype = "float32",
+):
     """Trains a collaborative filtering model based on user or item similarity."""
     # Splitting dataset into training (80%) and testing (20%)
     trainset, testset = train_test_split(data, test_size=0.2)
@@ -45,6 +54,9 @@ def train_model(data: DatasetAutoFolds, sim_type="user"):
     # Training the model on the training set
     model.fit(trainset)
 
+    # surprise computes the user/item similarity matrix as float64, store it in the configured (smaller) format
+    model.sim = store_matrix(model.sim, similarity_dtype)
+
     # Making predictions on the test set
     predictions = model.test(testset)
 
@@ -76,14 +88,21 @@ def get_recommendations(model: KNNBasic, df: pd.DataFrame, user_id, n=5):
     return recommendations
 
 
-def cf(user_id: str, rating_data: List[dict[str, Any]], top_n=5) -> list[tuple]:
+def cf(
+    user_id: str,
+    rating_data: List[dict[str, Any]],
+    top_n=5,
+    similarity_dtype: SimilarityDtype = "float32",
+) -> list[tuple]:
     """A Collaborative Filtering based recommendation system"""
 
     data, df = load_data(rating_data)
 
     print("Training User-Based CF...")
     # Train user-based collaborative filtering model
-    user_cf_model, user_predictions, user_rmse, _ = train_model(data, sim_type="user")
+    user_cf_model, user_predictions, user_rmse, _ = train_model(
+        data, sim_type="user", similarity_dtype=similarity_dtype
+    )
 
     # print("\nTraining Item-Based CF...")
     # Train item-based collaborative filtering model
@@ -93,3 +112,186 @@ def cf(user_id: str, rating_data: List[dict[str, Any]], top_n=5) -> list[tuple]:
     recommendations = get_recommendations(user_cf_model, df, user_id, n=top_n)
 
     return recommendations
+
+
+@dataclass
+class CFModel:
+    """A trained user-based collaborative filtering model together with the rating lookups needed to recommend"""
+
+    model: KNNBasic
+    all_products: List[str]
+    rated_by_user: dict[str, set[str]]
+    rmse: float
+    # lookups built from the training set on first use, stored models predate them
+    _ratings: sparse.csr_matrix | None = field(default=None, init=False, repr=False)
+    _rated: sparse.csr_matrix | None = field(default=None, init=False, repr=False)
+    _columns: dict[str, int] | None = field(default=None, init=False, repr=False)
+    _raters: dict[int, tuple[np.ndarray, np.ndarray]] | None = field(
+        default=None, init=False, repr=False
+    )
+
+    def _build_lookups(self) -> None:
+        """
+        The training ratings as a users x `all_products` matrix (and the matching matrix of ones), and for every
+        product with more than `k` raters its raters and their ratings, in the order `KNNBasic` considers them.
+        """
+        trainset = self.model.trainset
+        columns = {prod: j for j, prod in enumerate(self.all_products)}
+        users, items, ratings = zip(*trainset.all_ratings())
+        coordinates = (
+            np.asarray(users),
+            np.asarray([columns[trainset.to_raw_iid(i)] for i in items]),
+        )
+        shape = (trainset.n_users, len(self.all_products))
+        # a product rated twice by a user counts as two neighbours, as in `KNNBasic`, duplicates are summed in both
+        self._ratings = sparse.csr_matrix(
+            (np.asarray(ratings, dtype=np.float64), coordinates), shape=shape
+        )
+        self._rated = sparse.csr_matrix(
+            (np.ones(len(ratings)), coordinates), shape=shape
+        )
+        self._columns = columns
+        self._raters = {
+            columns[trainset.to_raw_iid(i)]: (
+                np.asarray([u for u, _ in item_ratings]),
+                np.asarray([r for _, r in item_ratings], dtype=np.float64),
+            )
+            for i, item_ratings in trainset.ir.items()
+            if len(item_ratings) > self.model.k
+        }
+
+    def predict(self, user_ids: List[str]) -> np.ndarray:
+        """
+        Estimated ratings of every product (columns in `all_products` order) for each of `user_ids`, computed at once.
+
+        Same estimate as `KNNBasic.predict`: the similarity weighted mean rating of the `k` users most similar to the
+        user among those who rated the product, counting positive similarities only. A user or product unknown to the
+        training set, or a product without a positively similar rater, gets the global mean rating.
+        """
+        if self._ratings is None:
+            self._build_lookups()
+        trainset = self.model.trainset
+        estimates = np.full(
+            (len(user_ids), len(self.all_products)), trainset.global_mean
+        )
+
+        rows, inner_ids = [], []
+        for row, user_id in enumerate(user_ids):
+            try:
+                inner_ids.append(trainset.to_inner_uid(user_id))
+                rows.append(row)
+            except ValueError:
+                continue
+        if len(rows) <= 0:
+            return estimates
+        similarities = np.asarray(self.model.sim[inner_ids], dtype=np.float64)
+        positive = np.maximum(similarities, 0)
+
+        # products with at most `k` raters use every rater, a single matrix product for all of them
+        weighted = np.asarray(positive @ self._ratings)
+        weights = np.asarray(positive @ self._rated)
+
+        # products with more than `k` raters only use the `k` most similar ones, on equal similarities the raters
+        # considered first, as `KNNBasic` does
+        k = self.model.k
+        for j, (raters, rater_ratings) in self._raters.items():
+            rater_similarities = similarities[:, raters]
+            kth = -np.partition(-rater_similarities, k - 1, axis=1)[:, [k - 1]]
+            ties = rater_similarities == kth
+            n_ties = k - (rater_similarities > kth).sum(axis=1, keepdims=True)
+            nearest = (rater_similarities > kth) | (
+                ties & (np.cumsum(ties, axis=1) <= n_ties)
+            )
+            nearest_similarities = np.where(
+                nearest, np.maximum(rater_similarities, 0), 0
+            )
+            weighted[:, j] = nearest_similarities @ rater_ratings
+            weights[:, j] = nearest_similarities.sum(axis=1)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            estimates[rows] = np.where(
+                weights > 0, weighted / weights, trainset.global_mean
+            )
+        return estimates
+
+    def recommend_batch(
+        self, user_ids: List[str], n=5, chunk_size: int = 1024
+    ) -> Iterator[list[tuple]]:
+        """
+        Top-N product recommendations for each of `user_ids`, in the order requested, products a user already rated
+        are excluded. Estimates are computed for `chunk_size` users at a time, so memory stays bounded.
+        """
+        if self._ratings is None:
+            self._build_lookups()
+        columns = self._columns
+        n = min(n, len(self.all_products))
+
+        for start in range(0, len(user_ids), chunk_size):
+            chunk = user_ids[start : start + chunk_size]
+            estimates = self.predict(chunk)
+            for row, user_id in enumerate(chunk):
+                rated = [columns[i] for i in self.rated_by_user.get(user_id, ())]
+                estimates[row, rated] = -np.inf
+
+            if n <= 0:
+                yield from ([] for _ in chunk)
+                continue
+            # the n-th best estimate of each user, found without sorting the whole row
+            thresholds = -np.partition(-estimates, n - 1, axis=1)[:, n - 1]
+            for row, threshold in enumerate(thresholds):
+                indices = np.flatnonzero(estimates[row] >= threshold)
+                scores = estimates[row, indices]
+                # best first, ties in `all_products` order
+                order = np.lexsort((indices, -scores))[:n]
+                yield [
+                    (self.all_products[indices[i]], float(scores[i]))
+                    for i in order
+                    if np.isfinite(scores[i])
+                ]
+
+    def recommend(self, user_id: str, n=5) -> list[tuple]:
+        """Generates top-N product recommendations for a given user."""
+        return next(self.recommend_batch([user_id], n=n))
+
+
+def train_cf_model(
+    rating_data: List[dict[str, Any]],
+    similarity_dtype: SimilarityDtype = "float32",
+) -> CFModel:
+    """Trains a user-based collaborative filtering model that can be shared by many recommendation calls"""
+
+    data, df = load_data(rating_data)
+
+    user_cf_model, _, user_rmse, _ = train_model(
+        data, sim_type="user", similarity_dtype=similarity_dtype
+    )
+
+    return CFModel(
+        model=user_cf_model,
+        all_products=df["product_id"].unique().tolist(),
+        # products rated by each user, looked up once instead of filtering the DataFrame per user
+        rated_by_user=df.groupby("user_id")["product_id"].agg(set).to_dict(),
+        rmse=user_rmse,
+    )
+
+
+def cf_batch(
+    user_ids: List[str],
+    rating_data: List[dict[str, Any]] | None = None,
+    top_n=5,
+    similarity_dtype: SimilarityDtype = "float32",
+    cf_model: CFModel | None = None,
+) -> Iterator[tuple[str, list[tuple]]]:
+    """
+    Batch version of `cf`, the user-based model is trained once (or an already trained `cf_model` is used)
+    and shared by every requested user.
+
+    Yields `(user_id, recommendations)` in the order the users were requested.
+    """
+
+    if cf_model is None:
+        # Train user-based collaborative filtering model once for the whole batch
+        cf_model = train_cf_model(rating_data, similarity_dtype=similarity_dtype)
+
+    # the estimates of the whole batch are computed with matrix products, not one prediction per user and product
+    yield from zip(user_ids, cf_model.recommend_batch(user_ids, n=top_n))
@@ -2,16 +2,29 @@ import pandas as pd
 import numpy as np
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
-from typing import Any, List, Literal
+from typing import Any, Iterator, List, Literal
+
+from app.recommendation_systems.quantization import (
+    SimilarityDtype,
+    float_dtype,
+    store_matrix,
+)
 
 
 def cbf(
-    *, product_id: str, top_n: int = 3, product_data: List[dict[str, Any]]
+    *,
+    product_id: str,
+    top_n: int = 3,
+    product_data: List[dict[str, Any]],
+    similarity_dtype: SimilarityDtype = "float32",
 ) -> dict[str, Any] | Literal["Product not found."]:
     """
     A content-based filtering recommendation system utilizing TF-IDF(Term Frequency-Inverse Document Frequency) and cosine similarity to measure similarities in products using the product name and product description.
 
     **IMPORTANT:** This is the patient-zero(initial implementation) of the content-based filtering system, recommendations are purely based on TF-IDF.
+
+    Only the similarity row of `product_id` is computed, not the N x N similarity matrix, it is stored as
+    `similarity_dtype`, see `app.recommendation_systems.quantization`.
     """
 
     # Convert to DataFrame
@@ -23,42 +36,46 @@ def cbf(
     df["text_features"] = df["product_name"] + " " + df["product_description"]
 
     # Convert text into numerical vectors using TF-IDF
-    vectorizer = TfidfVectorizer(stop_words="english")
+    vectorizer = TfidfVectorizer(
+        stop_words="english", dtype=float_dtype(similarity_dtype)
+    )
     tfidf_matrix = vectorizer.fit_transform(df["text_features"])
 
-    # Use cosine similarity to measure product similarity
+    if product_id not in df["id"].values:
+        return "Product not found."
 
-    # Compute cosine similarity matrix
-    similarity_matrix = cosine_similarity(tfidf_matrix, tfidf_matrix)
+    # Get index of the product
+    # This checks the dataframe for an entry with the `product_id` then gets the index property and finally the index no.
+    product_index = df[df["id"] == product_id].index[0]
 
-    # Convert similarity matrix to DataFrame
-    # similarity_df = pd.DataFrame(similarity_matrix, index=df["id"], columns=df["id"])
+    # Use cosine similarity to measure product similarity
 
-    # Display similarity matrix
-    # print(similarity_df)
+    # Compute the cosine similarity of the product to every product, a 1 x N matrix, quantized rows are scaled per
+    # row so it is the same as that row of the full matrix
+    similarity_row = store_matrix(
+        cosine_similarity(tfidf_matrix[product_index], tfidf_matrix), similarity_dtype
+    )[0]
 
     result = recommend_products(
         product_id=product_id,
         top_n=top_n,
         df=df,
-        similarity_matrix=similarity_matrix,
+        similarity_row=similarity_row,
     )
 
     return result
 
 
 def recommend_products(
-    *, product_id: str, df: pd.DataFrame, similarity_matrix: np.ndarray, top_n=3
+    *,
+    product_id: str,
+    df: pd.DataFrame,
+    similarity_row: np.ndarray,
+    top_n=3,
 ):
-    if product_id not in df["id"].values:
-        return "Product not found."
-
-    # Get index of the product
-    # This checks the dataframe for an entry with the `product_id` then gets the index property and finally the index no.
-    product_index = df[df["id"] == product_id].index[0]
-
+    """`top_n` products most similar to `product_id`, given its similarity to every product of `df`"""
     # Get similarity scores for the product
-    similarity_scores = list(enumerate(similarity_matrix[product_index]))
+    similarity_scores = list(enumerate(similarity_row))
 
     # Sort products by similarity score (excluding itself)
     similarity_scores = sorted(similarity_scores, key=lambda x: x[1], reverse=True)[
@@ -70,3 +87,61 @@ def recommend_products(
     recommended_products = [{**df.iloc[i[0]]} for i in similarity_scores]
 
     return {"product_id": product_id, "recommended_products": recommended_products}
+
+
+def cbf_batch(
+    *,
+    product_ids: List[str],
+    top_n: int = 3,
+    product_data: List[dict[str, Any]],
+    chunk_size: int = 256,
+    similarity_dtype: SimilarityDtype = "float32",
+) -> Iterator[tuple[str, List[tuple[str, float]] | Literal["Product not found."]]]:
+    """
+    Batch version of `cbf`, the TF-IDF matrix is fitted once and shared by every requested product.
+
+    Instead of building the full N x N similarity matrix, the similarity rows of `chunk_size` requested products are
+    computed at a time with a single sparse matrix product, so memory stays bounded for large batches.
+    Yields `(product_id, [(recommended_product_id, similarity_score), ...])` in the order the products were requested.
+    """
+    df = pd.DataFrame(product_data)
+
+    # Combine product name and description for better feature extraction
+    df["text_features"] = df["product_name"] + " " + df["product_description"]
+
+    # Convert text into numerical vectors using TF-IDF
+    vectorizer = TfidfVectorizer(
+        stop_words="english", dtype=float_dtype(similarity_dtype)
+    )
+    tfidf_matrix = vectorizer.fit_transform(df["text_features"])
+
+    all_ids = df["id"].values
+    positions = {product_id: i for i, product_id in enumerate(all_ids)}
+    top_n = min(top_n, len(all_ids) - 1)
+
+    for start in range(0, len(product_ids), chunk_size):
+        chunk = product_ids[start : start + chunk_size]
+        rows = [positions[i] for i in chunk if i in positions]
+
+        recommendations = {}
+        if rows and top_n > 0:
+            # TF-IDF rows are l2-normalized, so the dot product is the cosine similarity
+            similarity_scores = (tfidf_matrix[rows] @ tfidf_matrix.T).toarray()
+            # exclude the product itself
+            similarity_scores[np.arange(len(rows)), rows] = -np.inf
+
+            top_indices = np.argpartition(-similarity_scores, top_n - 1, axis=1)[
+                :, :top_n
+            ]
+            for row, indices in enumerate(top_indices):
+                scores = similarity_scores[row, indices]
+                order = np.argsort(-scores)
+                recommendations[all_ids[rows[row]]] = [
+                    (all_ids[indices[i]], round(float(scores[i]), 2)) for i in order
+                ]
+
+        for product_id in chunk:
+            if product_id not in positions:
+                yield product_id, "Product not found."
+            else:
+                yield product_id, recommendations.get(product_id, [])
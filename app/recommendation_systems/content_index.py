@@ -0,0 +1,68 @@
+import asyncio
+import logging
+import time
+
+from app.core.config import settings
+from app.core.db import get_collection, MONGO_COLLECTIONS
+from app.core.utils import collection_error_msg
+from app.recommendation_systems.hashing_content_based import (
+    build_hashed_tfidf_index,
+    HashedTfidfIndex,
+    TEXT_FEATURE_PROJECTION,
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ContentIndexService:
+    """
+    Hashed TF-IDF content index of this worker, used when `CONTENT_FEATURIZER` is "hashing" and no model version with
+    a content index is served.
+
+    The index is built in the background, once per catalog version, requests never build it. They keep using the
+    index of the previous catalog version while a build runs, and get no index until the first build finished.
+    """
+
+    def __init__(self):
+        self.index: HashedTfidfIndex | None = None
+        self.catalog_version: int | None = None
+        self._build_task: asyncio.Task | None = None
+
+    async def _build(self, catalog_version: int) -> None:
+        products_coll = get_collection(MONGO_COLLECTIONS.PRODUCTS)
+        if products_coll is None:
+            raise Exception(
+                collection_error_msg("_build", MONGO_COLLECTIONS.PRODUCTS.name)
+            )
+
+        start = time.perf_counter()
+        self.index = await build_hashed_tfidf_index(
+            products_coll.find({}, TEXT_FEATURE_PROJECTION),
+            batch_size=settings.CONTENT_FEATURIZER_BATCH_SIZE,
+            n_jobs=settings.CONTENT_FEATURIZER_N_JOBS,
+            similarity_dtype=settings.SIMILARITY_DTYPE,
+        )
+        self.catalog_version = catalog_version
+        logger.info(
+            f"  content index of catalog v{catalog_version} built, {len(self.index.product_ids)} products in {time.perf_counter() - start:.3f}s"
+        )
+
+    async def _build_in_background(self, catalog_version: int) -> None:
+        try:
+            await self._build(catalog_version)
+        except Exception as exc:
+            logger.error(f"  content index build failed: {exc}")
+
+    def get(self, catalog_version: int) -> HashedTfidfIndex | None:
+        """The current index, a build is started when it was not built from `catalog_version`"""
+        if self.catalog_version != catalog_version and (
+            self._build_task is None or self._build_task.done()
+        ):
+            self._build_task = asyncio.create_task(
+                self._build_in_background(catalog_version)
+            )
+        return self.index
+
+
+content_index_service = ContentIndexService()
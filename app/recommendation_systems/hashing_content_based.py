@@ -0,0 +1,170 @@
+import asyncio
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+from motor.motor_asyncio import AsyncIOMotorCursor
+from typing import Any, List, Literal
+
+from app.recommendation_systems.quantization import SimilarityDtype, float_dtype
+
+# 2**18 buckets keeps hash collisions rare for product text while each row stays a small sparse vector
+N_FEATURES = 2**18
+
+# only the fields needed to build the text features are pulled out of mongodb
+TEXT_FEATURE_PROJECTION = {"_id": 1, "product_name": 1, "product_description": 1}
+
+
+def _featurize_chunk(
+    texts: List[str], n_features: int = N_FEATURES
+) -> sparse.csr_matrix:
+    """
+    Convert a chunk of product texts into raw term counts.
+
+    The `HashingVectorizer` is stateless (no vocabulary is learned), so every chunk can be featurized independently,
+    even in a different process, and the resulting rows will line up column for column.
+    """
+    vectorizer = HashingVectorizer(
+        n_features=n_features,
+        stop_words="english",
+        alternate_sign=False,
+        norm=None,
+    )
+    return vectorizer.transform(texts)
+
+
+@dataclass
+class HashedTfidfIndex:
+    """A l2-normalized TF-IDF matrix built from hashed term counts, one row per product"""
+
+    product_ids: List[str]
+    matrix: sparse.csr_matrix
+    positions: dict[str, int] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.positions = {
+            product_id: i for i, product_id in enumerate(self.product_ids)
+        }
+
+    def __contains__(self, product_id: str) -> bool:
+        return product_id in self.positions
+
+    def similar(self, product_id: str, top_n: int = 3) -> List[tuple[str, float]]:
+        """Returns the `top_n` most similar products (excluding itself) as `(product_id, similarity_score)` tuples"""
+        if (product_index := self.positions.get(product_id)) is None:
+            return []
+
+        # rows are l2-normalized so the dot product is the cosine similarity,
+        # only a single row of the similarity matrix is computed instead of the full N x N matrix
+        similarity_scores = (
+            (self.matrix @ self.matrix[product_index].T).toarray().ravel()
+        )
+        similarity_scores[product_index] = -np.inf
+
+        top_n = min(top_n, len(self.product_ids) - 1)
+        if top_n <= 0:
+            return []
+        top_indices = np.argpartition(-similarity_scores, top_n - 1)[:top_n]
+        top_indices = top_indices[np.argsort(-similarity_scores[top_indices])]
+
+        return [(self.product_ids[i], float(similarity_scores[i])) for i in top_indices]
+
+
+async def build_hashed_tfidf_index(
+    cursor: AsyncIOMotorCursor,
+    *,
+    batch_size: int = 1000,
+    n_jobs: int = 1,
+    similarity_dtype: SimilarityDtype = "float32",
+) -> HashedTfidfIndex:
+    """
+    Build a TF-IDF index by streaming products from a mongodb cursor in batches.
+
+    Only one batch of raw product text per worker is held in memory at any time, the document frequency used for the IDF
+    weights is accumulated as each batch is featurized. When `n_jobs > 1` batches are featurized in parallel across processes,
+    otherwise in a thread, so the event loop is not blocked while the index is built.
+
+    The cursor should be created with `TEXT_FEATURE_PROJECTION` so product documents are not fully loaded.
+    The index is a sparse matrix, so the "int8" `similarity_dtype` is stored as float32.
+    """
+    loop = asyncio.get_running_loop()
+    executor = ProcessPoolExecutor(max_workers=n_jobs) if n_jobs > 1 else None
+
+    product_ids: List[str] = []
+    chunks: List[sparse.csr_matrix] = []
+    document_frequency = np.zeros(N_FEATURES, dtype=np.int64)
+    pending: List[asyncio.Future] = []
+
+    def collect(term_counts: sparse.csr_matrix):
+        nonlocal document_frequency
+        chunks.append(term_counts)
+        # number of products each hashed term appears in
+        document_frequency += np.bincount(term_counts.indices, minlength=N_FEATURES)
+
+    async def submit(texts: List[str]):
+        if executor is None:
+            collect(await loop.run_in_executor(None, _featurize_chunk, texts))
+            return
+        pending.append(loop.run_in_executor(executor, _featurize_chunk, texts))
+        # keep at most `n_jobs` batches in flight, collecting results in submission order
+        if len(pending) >= n_jobs:
+            collect(await pending.pop(0))
+
+    try:
+        texts: List[str] = []
+        async for doc in cursor.batch_size(batch_size):
+            product_ids.append(str(doc["_id"]))
+            # Combine product name and description for better feature extraction
+            texts.append(f"{doc['product_name']} {doc['product_description']}")
+            if len(texts) >= batch_size:
+                await submit(texts)
+                texts = []
+        if texts:
+            await submit(texts)
+        while pending:
+            collect(await pending.pop(0))
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    if not chunks:
+        return HashedTfidfIndex(
+            product_ids=[], matrix=sparse.csr_matrix((0, N_FEATURES))
+        )
+
+    def tfidf() -> sparse.csr_matrix:
+        # smoothed IDF, identical to the default `TfidfVectorizer(smooth_idf=True)` weighting
+        n_documents = len(product_ids)
+        idf = np.log((1 + n_documents) / (1 + document_frequency)) + 1
+
+        dtype = float_dtype(similarity_dtype)
+        tfidf_matrix = sparse.vstack(chunks, format="csr").astype(dtype) @ sparse.diags(
+            idf.astype(dtype)
+        )
+        return normalize(tfidf_matrix, norm="l2", copy=False).tocsr()
+
+    return HashedTfidfIndex(
+        product_ids=product_ids, matrix=await loop.run_in_executor(None, tfidf)
+    )
+
+
+def hashing_cbf(
+    *, product_id: str, top_n: int = 3, index: HashedTfidfIndex
+) -> dict[str, Any] | Literal["Product not found."]:
+    """
+    A content-based filtering recommendation system using a hashed TF-IDF index, suited for very large catalogs.
+
+    Unlike `cbf`, only product ids and similarity scores are returned since raw product data is never held in memory,
+    callers are expected to fetch the recommended products by id.
+    """
+    if product_id not in index:
+        return "Product not found."
+
+    recommended_products = [
+        {"id": i, "similarity_score": round(score, 2)}
+        for i, score in index.similar(product_id, top_n=top_n)
+    ]
+
+    return {"product_id": product_id, "recommended_products": recommended_products}
@@ -6,6 +6,12 @@ from sklearn.preprocessing import MinMaxScaler
 from typing import Any, List, Literal
 from decimal import Decimal
 
+from app.recommendation_systems.quantization import (
+    SimilarityDtype,
+    float_dtype,
+    store_matrix,
+)
+
 
 def hcbf(
     *,
@@ -15,6 +21,7 @@ def hcbf(
     user_location: str = None,
     max_price: Decimal = None,
     preferred_category: str = None,
+    similarity_dtype: SimilarityDtype = "float32",
 ) -> dict[str, Any] | Literal["Product not found."]:
     """
     A Hybrid content-based filtering recommendation system utilizing TF-IDF(Term Frequency-Inverse Document Frequency) and cosine similarity together with demographic based filtering using users country and finally Knowledge based filtering using the specified maximum product price and category
@@ -26,6 +33,8 @@ def hcbf(
     - User Preferences: Allows filtering by maximum price and preferred category.
 
     The weighted combination for text, category and price similarity may vary depending on what the function parameters.
+    Only the combined similarity row of `product_id` is computed, not N x N similarity matrices, it is stored as
+    `similarity_dtype`, see `app.recommendation_systems.quantization`.
     """
 
     # Convert dataset to DataFrame
@@ -39,47 +48,52 @@ def hcbf(
     # Combine text features for better recommendations
     df["text_features"] = df["product_name"] + " " + df["product_description"]
 
+    dtype = float_dtype(similarity_dtype)
+
     # Convert text into numerical vectors using TF-IDF
-    vectorizer = TfidfVectorizer(stop_words="english")
+    vectorizer = TfidfVectorizer(stop_words="english", dtype=dtype)
     tfidf_matrix = vectorizer.fit_transform(df["text_features"])
 
-    # Compute text similarity
-    text_similarity = cosine_similarity(tfidf_matrix, tfidf_matrix)
+    # Validate product ID
+    if product_id not in df["id"].values:
+        return "Product not found."
+
+    # Get index of the product
+    # This checks the dataframe for an entry with the `product_id` then gets the index property and finally the index no.
+    product_index = df[df["id"] == product_id].index[0]
+
+    # Compute text similarity of the product to every product
+    text_similarity = cosine_similarity(tfidf_matrix[product_index], tfidf_matrix)[0]
 
     # Compute category similarity (1 if same category, 0 otherwise)
-    category_similarity = np.array(
-        [
-            [
-                1 if df.iloc[i]["category_id"] == df.iloc[j]["category_id"] else 0
-                for j in range(len(df))
-            ]
-            for i in range(len(df))
-        ]
+    category_array = df["category_id"].values
+    category_similarity = (category_array == category_array[product_index]).astype(
+        dtype
     )
 
     # Compute price similarity (inverted absolute difference)
-    price_array = df["normalized_price"].values.reshape(-1, 1)
-    price_similarity = 1 - np.abs(price_array - price_array.T)
+    price_array = df["normalized_price"].values.astype(dtype)
+    price_similarity = 1 - np.abs(price_array - price_array[product_index])
 
     # dynamically determine the weight for each similarity matrix
     category_weight = 0.3 if preferred_category is not None else 0.0
     price_weight = 0.2 if max_price is not None else 0.0
     text_weight = 1.0 - (category_weight + price_weight)
 
-    # Final similarity score (weighted combination)
-    similarity_matrix = (
-        (text_weight * text_similarity)
-        + (category_weight * category_similarity)
-        + (price_weight * price_similarity)
-    )
-
-    # Convert to DataFrame
-    # similarity_df = pd.DataFrame(similarity_matrix, index=df["id"], columns=df["id"])
-    # print(similarity_df)
+    # Final similarity score (weighted combination), a 1 x N matrix, quantized rows are scaled per row so it is the
+    # same as that row of the full matrix
+    similarity_row = store_matrix(
+        (
+            (text_weight * text_similarity)
+            + (category_weight * category_similarity)
+            + (price_weight * price_similarity)
+        )[np.newaxis, :],
+        similarity_dtype,
+    )[0]
 
     result = recommend_products_extra(
         df=df,
-        similarity_matrix=similarity_matrix,
+        similarity_row=similarity_row,
         product_id=product_id,
         top_n=top_n,
         user_location=user_location,
@@ -92,7 +106,7 @@ def hcbf(
 
 def recommend_products_extra(
     df: pd.DataFrame,
-    similarity_matrix: np.ndarray,
+    similarity_row: np.ndarray,
     product_id: str,
     top_n=3,
     user_location: str = None,
@@ -101,16 +115,8 @@ def recommend_products_extra(
 ):
     """Returns product recommendations based on enhanced similarity filtering."""
 
-    # Validate product ID
-    if product_id not in df["id"].values:
-        return "Product not found."
-
-    # Get index of the product
-    # This checks the dataframe for an entry with the `product_id` then gets the index property and finally the index no.
-    product_index = df[df["id"] == product_id].index[0]
-
     # Get similarity scores
-    similarity_scores = list(enumerate(similarity_matrix[product_index]))
+    similarity_scores = list(enumerate(similarity_row))
 
     # Sort by highest similarity (excluding itself)
     similarity_scores = sorted(similarity_scores, key=lambda x: x[1], reverse=True)[1:]
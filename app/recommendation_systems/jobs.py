@@ -0,0 +1,45 @@
+from app.core.config import settings
+from app.core.db import MONGO_COLLECTIONS
+from app.core.scheduler import Job, Scheduler
+from app.products.rating_stats import reconcile_product_rating_stats
+from app.recommendation_systems.training import train_and_publish_models
+
+
+async def retrain_cf():
+    await train_and_publish_models(retrain_cf=True, rebuild_content=False)
+
+
+async def rebuild_content_index():
+    await train_and_publish_models(retrain_cf=False, rebuild_content=True)
+
+
+def register_jobs(scheduler: Scheduler) -> None:
+    """Register the recommender background jobs, every worker's model watcher picks up the versions they publish"""
+    scheduler.register(
+        Job(
+            name="cf_retrain",
+            func=retrain_cf,
+            interval_seconds=settings.CF_RETRAIN_INTERVAL_SECONDS,
+            jitter_seconds=settings.SCHEDULER_JITTER_SECONDS,
+            change_collection=MONGO_COLLECTIONS.PRODUCT_RATINGS,
+            change_threshold=settings.CF_RETRAIN_RATING_THRESHOLD,
+        )
+    )
+    scheduler.register(
+        Job(
+            name="content_index_rebuild",
+            func=rebuild_content_index,
+            interval_seconds=settings.CONTENT_INDEX_REBUILD_INTERVAL_SECONDS,
+            jitter_seconds=settings.SCHEDULER_JITTER_SECONDS,
+            change_collection=MONGO_COLLECTIONS.PRODUCTS,
+            change_threshold=settings.CONTENT_INDEX_REBUILD_PRODUCT_THRESHOLD,
+        )
+    )
+    scheduler.register(
+        Job(
+            name="rating_stats_reconcile",
+            func=reconcile_product_rating_stats,
+            interval_seconds=settings.RATING_STATS_RECONCILE_INTERVAL_SECONDS,
+            jitter_seconds=settings.SCHEDULER_JITTER_SECONDS,
+        )
+    )
@@ -0,0 +1,287 @@
+import asyncio
+import fcntl
+import json
+import logging
+import math
+import os
+import shutil
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+import joblib
+
+from app.core.config import settings
+from app.recommendation_systems.collaborative_filtering import CFModel
+from app.recommendation_systems.hashing_content_based import HashedTfidfIndex
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+METADATA_FILE = "metadata.json"
+MODEL_FILE_SUFFIX = ".joblib"
+# every model of a version is stored in its own file, `<name>.joblib`
+MODEL_NAMES = ("cf_model", "content_index")
+
+
+@dataclass
+class ModelBundle:
+    """Every trained recommender model served together as one version"""
+
+    version: str
+    cf_model: CFModel | None
+    content_index: HashedTfidfIndex | None
+    metadata: dict[str, Any] = field(default_factory=dict)
+
+
+def validate_bundle(bundle: ModelBundle) -> None:
+    """Run a validation inference on each model of the bundle, raises `ValueError` if a model is unusable"""
+    if bundle.cf_model is not None:
+        if len(bundle.cf_model.rated_by_user) <= 0:
+            raise ValueError(f"[{bundle.version}]: CF model has no users")
+        user_id = next(iter(bundle.cf_model.rated_by_user))
+        for _, score in bundle.cf_model.recommend(user_id, n=5):
+            if not math.isfinite(score):
+                raise ValueError(f"[{bundle.version}]: CF model predicted {score}")
+
+    if bundle.content_index is not None:
+        if len(bundle.content_index.product_ids) <= 0:
+            raise ValueError(f"[{bundle.version}]: content index has no products")
+        product_id = bundle.content_index.product_ids[0]
+        for _, score in bundle.content_index.similar(product_id, top_n=5):
+            if not math.isfinite(score):
+                raise ValueError(f"[{bundle.version}]: content index returned {score}")
+
+
+class ModelStore:
+    """
+    Versioned recommender models on disk, one directory per version plus a `manifest.json`:
+
+    ```
+    {"latest": "<version>", "pinned": "<version>" | null, "versions": ["<oldest>", ..., "<newest>"]}
+    ```
+
+    Each model is stored in its own `<name>.joblib` file next to a `metadata.json`.
+    Version directories are written under a temporary name and renamed into place, and the manifest is replaced
+    atomically, so readers never see a half-written version. Workers serve the pinned version if there is one,
+    otherwise the latest.
+    """
+
+    def __init__(self, root: Path, keep_versions: int = 5):
+        self.root = root
+        self.keep_versions = keep_versions
+
+    @contextmanager
+    def _locked(self):
+        """Serialize manifest updates across uvicorn workers"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.root / ".manifest.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def read_manifest(self) -> dict[str, Any]:
+        try:
+            return json.loads((self.root / MANIFEST_FILE).read_text())
+        except FileNotFoundError:
+            return {"latest": None, "pinned": None, "versions": []}
+
+    def _write_manifest(self, manifest: dict[str, Any]) -> None:
+        tmp_path = self.root / f".{MANIFEST_FILE}.{os.getpid()}"
+        tmp_path.write_text(json.dumps(manifest, indent=2))
+        os.replace(tmp_path, self.root / MANIFEST_FILE)
+
+    def serving_version(self) -> str | None:
+        manifest = self.read_manifest()
+        return manifest["pinned"] or manifest["latest"]
+
+    def publish(
+        self,
+        *,
+        cf_model: CFModel | None = None,
+        content_index: HashedTfidfIndex | None = None,
+        metadata: dict[str, dict[str, Any]] | None = None,
+    ) -> str:
+        """
+        Write a new model version and make it the latest one.
+
+        A model that is not provided is carried over from the latest version, this is done while holding the manifest
+        lock so two jobs retraining different models at the same time do not drop each other's model.
+        `metadata` is keyed by model name (`cf_model`, `content_index`).
+        """
+        version = datetime.now().strftime("%Y%m%dT%H%M%S%f")
+        metadata = metadata or {}
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_dir = self.root / f".tmp-{version}"
+        tmp_dir.mkdir()
+        for name, model in (("cf_model", cf_model), ("content_index", content_index)):
+            if model is not None:
+                joblib.dump(model, tmp_dir / f"{name}{MODEL_FILE_SUFFIX}")
+                metadata[name] = {**metadata.get(name, {}), "version": version}
+
+        with self._locked():
+            manifest = self.read_manifest()
+
+            if (latest := manifest["latest"]) is not None:
+                latest_metadata = json.loads(
+                    (self.root / latest / METADATA_FILE).read_text()
+                )
+                for name in MODEL_NAMES:
+                    model_file = f"{name}{MODEL_FILE_SUFFIX}"
+                    if (tmp_dir / model_file).exists() or not (
+                        self.root / latest / model_file
+                    ).exists():
+                        continue
+                    # hard link instead of copying, versions are never modified once published
+                    os.link(self.root / latest / model_file, tmp_dir / model_file)
+                    metadata[name] = latest_metadata[name]
+
+            (tmp_dir / METADATA_FILE).write_text(
+                json.dumps({**metadata, "version": version}, indent=2)
+            )
+            os.rename(tmp_dir, self.root / version)
+
+            manifest["versions"].append(version)
+            manifest["latest"] = version
+            self._prune(manifest)
+            self._write_manifest(manifest)
+
+        logger.info(f"  model version {version} published")
+        return version
+
+    def _prune(self, manifest: dict[str, Any]) -> None:
+        """Delete the oldest versions, the pinned and latest versions are always kept"""
+        while len(manifest["versions"]) > self.keep_versions:
+            removable = [
+                i
+                for i in manifest["versions"]
+                if i not in (manifest["pinned"], manifest["latest"])
+            ]
+            if len(removable) <= 0:
+                break
+            manifest["versions"].remove(removable[0])
+            shutil.rmtree(self.root / removable[0], ignore_errors=True)
+
+    # pin, unpin and rollback return the new manifest and the version pinned before, to restore it with `restore_pin`
+
+    def pin(self, version: str) -> tuple[dict[str, Any], str | None]:
+        with self._locked():
+            manifest = self.read_manifest()
+            if version not in manifest["versions"]:
+                raise ValueError(f"Model version {version} does not exist")
+            previous, manifest["pinned"] = manifest["pinned"], version
+            self._write_manifest(manifest)
+        return manifest, previous
+
+    def unpin(self) -> tuple[dict[str, Any], str | None]:
+        with self._locked():
+            manifest = self.read_manifest()
+            previous, manifest["pinned"] = manifest["pinned"], None
+            self._write_manifest(manifest)
+        return manifest, previous
+
+    def rollback(self) -> tuple[dict[str, Any], str | None]:
+        """Pin the version published before the one currently being served"""
+        with self._locked():
+            manifest = self.read_manifest()
+            current = manifest["pinned"] or manifest["latest"]
+            if current not in manifest["versions"]:
+                raise ValueError("There is no model version to roll back from")
+            position = manifest["versions"].index(current)
+            if position <= 0:
+                raise ValueError(f"Model version {current} is the oldest version")
+            previous = manifest["pinned"]
+            manifest["pinned"] = manifest["versions"][position - 1]
+            self._write_manifest(manifest)
+        return manifest, previous
+
+    def restore_pin(self, pinned: str | None, previous: str | None) -> dict[str, Any]:
+        """Pin `previous` again, unless the pin was changed since `pinned` was pinned"""
+        with self._locked():
+            manifest = self.read_manifest()
+            if manifest["pinned"] == pinned:
+                manifest["pinned"] = previous
+                self._write_manifest(manifest)
+        return manifest
+
+    def load(self, version: str) -> ModelBundle:
+        version_dir = self.root / version
+        models = {
+            name: (
+                joblib.load(version_dir / f"{name}{MODEL_FILE_SUFFIX}")
+                if (version_dir / f"{name}{MODEL_FILE_SUFFIX}").exists()
+                else None
+            )
+            for name in MODEL_NAMES
+        }
+        metadata = json.loads((version_dir / METADATA_FILE).read_text())
+        return ModelBundle(version=version, metadata=metadata, **models)
+
+
+class ModelServer:
+    """
+    Holds the model bundle served by this worker.
+
+    A new version is loaded and validated in a background thread and only then swapped in with a single reference
+    assignment, requests read `model_server.bundle` once and keep using that bundle, so none of them ever sees a
+    half-loaded model.
+    """
+
+    def __init__(self, store: ModelStore):
+        self.store = store
+        self.bundle: ModelBundle | None = None
+        # versions that failed to load or validate, with the reason, are not retried on every tick
+        self.rejected_versions: dict[str, str] = {}
+
+    @property
+    def version(self) -> str | None:
+        return self.bundle.version if self.bundle is not None else None
+
+    def _load_and_validate(self, version: str) -> ModelBundle:
+        bundle = self.store.load(version)
+        validate_bundle(bundle)
+        return bundle
+
+    async def refresh(self) -> bool:
+        """Swap in the version the manifest says should be served, returns `True` if the served version changed"""
+        target = self.store.serving_version()
+        if target is None or target == self.version or target in self.rejected_versions:
+            return False
+
+        loop = asyncio.get_running_loop()
+        try:
+            bundle = await loop.run_in_executor(None, self._load_and_validate, target)
+        except Exception as exc:
+            self.rejected_versions[target] = str(exc)
+            logger.error(f"  model version {target} rejected: {exc}")
+            return False
+
+        previous, self.bundle = self.version, bundle
+        logger.info(f"  model version {previous} -> {target}")
+        return True
+
+    async def watch(self, interval: float) -> None:
+        """Poll the model store for a new serving version, runs for the lifetime of the worker"""
+        while True:
+            try:
+                await self.refresh()
+            except Exception as exc:
+                logger.error(f"  model watcher failed: {exc}")
+            await asyncio.sleep(interval)
+
+
+model_store = ModelStore(
+    (
+        Path(settings.MODEL_STORE_DIR)
+        if settings.MODEL_STORE_DIR
+        else Path(__file__).parent.parent.parent / "models"
+    ),
+    keep_versions=settings.MODEL_STORE_KEEP_VERSIONS,
+)
+model_server = ModelServer(model_store)
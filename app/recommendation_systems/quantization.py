@@ -0,0 +1,69 @@
+import numpy as np
+from dataclasses import dataclass
+from typing import Literal
+
+# "float64" keeps the previous behaviour, "float32" halves the memory used by similarity matrices and embeddings,
+# "int8" stores one byte per value plus one float32 scale factor per row
+SimilarityDtype = Literal["float64", "float32", "int8"]
+
+
+@dataclass
+class QuantizedMatrix:
+    """
+    A 2-D matrix stored as int8 values with a float32 scale factor per row (symmetric quantization).
+
+    Each value is recovered as `values[i, j] * scales[i]`. Indexing with a row number (or an array of row numbers) returns
+    the dequantized float32 row(s) and indexing with `[i, j]` returns a single dequantized value, so it can stand in for the dense numpy similarity
+    matrices used by the recommenders.
+    """
+
+    values: np.ndarray
+    scales: np.ndarray
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.values.shape
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes + self.scales.nbytes
+
+    def __len__(self) -> int:
+        return self.values.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            row, col = key
+            return np.float32(self.values[row, col]) * self.scales[row]
+        scales = self.scales[key]
+        if np.ndim(scales) > 0:
+            # several rows, each scaled by its own factor
+            scales = scales[:, np.newaxis]
+        return self.values[key].astype(np.float32) * scales
+
+    def dequantize(self) -> np.ndarray:
+        return self.values.astype(np.float32) * self.scales[:, np.newaxis]
+
+
+def quantize_rows(matrix: np.ndarray) -> QuantizedMatrix:
+    """Quantize every row of `matrix` to int8 using the row's largest absolute value as its scale"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    max_abs = np.abs(matrix).max(axis=1, initial=0)
+    # rows of zeros keep a scale of 1 so nothing is divided by zero
+    scales = np.where(max_abs > 0, max_abs / 127, 1).astype(np.float32)
+    values = np.rint(matrix / scales[:, np.newaxis]).astype(np.int8)
+    return QuantizedMatrix(values=values, scales=scales)
+
+
+def store_matrix(
+    matrix: np.ndarray, dtype: SimilarityDtype = "float32"
+) -> np.ndarray | QuantizedMatrix:
+    """Convert a dense similarity matrix (or embedding matrix) into the configured storage format"""
+    if dtype == "int8":
+        return quantize_rows(matrix)
+    return np.asarray(matrix, dtype=float_dtype(dtype))
+
+
+def float_dtype(dtype: SimilarityDtype = "float32") -> type:
+    """The float type used while computing features and similarities, int8 matrices are quantized from float32"""
+    return np.float64 if dtype == "float64" else np.float32
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from datetime import datetime
+
+from app.core.config import settings
+from app.core.db import get_collection, MONGO_COLLECTIONS
+from app.core.utils import collection_error_msg
+from app.recommendation_systems.collaborative_filtering import train_cf_model
+from app.recommendation_systems.hashing_content_based import (
+    build_hashed_tfidf_index,
+    TEXT_FEATURE_PROJECTION,
+)
+from app.recommendation_systems.model_store import model_store
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def train_and_publish_models(
+    *, retrain_cf: bool = True, rebuild_content: bool = True
+) -> str:
+    """
+    Train the collaborative filtering model and/or rebuild the content index outside the request path and publish them
+    as a new version. A model that is not retrained is carried over from the latest published version by the model store.
+    """
+    products_coll = get_collection(MONGO_COLLECTIONS.PRODUCTS)
+    if products_coll is None:
+        raise Exception(
+            collection_error_msg(
+                "train_and_publish_models", MONGO_COLLECTIONS.PRODUCTS.name
+            )
+        )
+    product_rating_coll = get_collection(MONGO_COLLECTIONS.PRODUCT_RATINGS)
+    if product_rating_coll is None:
+        raise Exception(
+            collection_error_msg(
+                "train_and_publish_models", MONGO_COLLECTIONS.PRODUCT_RATINGS.name
+            )
+        )
+
+    loop = asyncio.get_running_loop()
+
+    cf_model, content_index, metadata = None, None, {}
+
+    if retrain_cf:
+        started_at = datetime.now()
+        rating_data = [
+            doc
+            async for doc in product_rating_coll.find(
+                {}, {"_id": 0, "user_id": 1, "product_id": 1, "rating": 1}
+            )
+        ]
+
+        # model training is CPU bound, run it on a separate thread so the event loop is not blocked
+        cf_model = await loop.run_in_executor(
+            None, train_cf_model, rating_data, settings.SIMILARITY_DTYPE
+        )
+        metadata["cf_model"] = {
+            "trained_at": started_at.isoformat(),
+            "training_seconds": (datetime.now() - started_at).total_seconds(),
+            "n_ratings": len(rating_data),
+            "rmse": cf_model.rmse,
+            "similarity_dtype": settings.SIMILARITY_DTYPE,
+        }
+
+    if rebuild_content:
+        started_at = datetime.now()
+        content_index = await build_hashed_tfidf_index(
+            products_coll.find({}, TEXT_FEATURE_PROJECTION),
+            batch_size=settings.CONTENT_FEATURIZER_BATCH_SIZE,
+            n_jobs=settings.CONTENT_FEATURIZER_N_JOBS,
+            similarity_dtype=settings.SIMILARITY_DTYPE,
+        )
+        metadata["content_index"] = {
+            "trained_at": started_at.isoformat(),
+            "training_seconds": (datetime.now() - started_at).total_seconds(),
+            "n_products": len(content_index.product_ids),
+            "similarity_dtype": settings.SIMILARITY_DTYPE,
+        }
+
+    version = await loop.run_in_executor(
+        None,
+        lambda: model_store.publish(
+            cf_model=cf_model, content_index=content_index, metadata=metadata
+        ),
+    )
+    return version
@@ -0,0 +1,99 @@
+import argparse
+import json
+import logging
+import random
+import time
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+from app.products.autocomplete import build_autocomplete_index
+from app.products.catalog import CatalogSnapshot
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def load_catalog(scale: int) -> CatalogSnapshot:
+    """
+    Catalog snapshot of `data/product.json`.
+
+    The catalog is only ~100 products, `scale` grows it with copies whose names get a numbered suffix.
+    """
+    data_file_path = Path(__file__).parent.parent.parent / "data" / "product.json"
+    with open(data_file_path, "r") as products:
+        products_obj = json.load(products)
+
+    rng = random.Random(0)
+    documents = []
+    for copy in range(scale):
+        for product in products_obj:
+            documents.append(
+                {
+                    **product,
+                    "category_id": "benchmark",
+                    "product_name": (
+                        product["product_name"]
+                        if copy == 0
+                        else f"{product['product_name']} {copy}"
+                    ),
+                    "rating_count": rng.randint(0, 500),
+                    "avg_rating": rng.uniform(1, 5),
+                }
+            )
+    return CatalogSnapshot.from_documents(0, documents)
+
+
+def benchmark(snapshot: CatalogSnapshot, n_queries: int, limit: int):
+    """Build time of the index and latency of `suggest` for prefixes typed from product names"""
+    names = [product["product_name"] for product in snapshot.products]
+    query_counts = Counter(
+        {name.lower()[: random.randint(3, 12)]: 5 for name in names[:1000]}
+    )
+
+    start = time.perf_counter()
+    index = build_autocomplete_index(snapshot, query_counts)
+    logger.info(
+        f"  {len(snapshot.products)} products, {len(index)} keys, built in {time.perf_counter() - start:.3f}s"
+    )
+
+    rng = random.Random(1)
+    prefixes = []
+    for _ in range(n_queries):
+        words = rng.choice(names).lower().split()
+        word = " ".join(words[rng.randrange(len(words)) :])
+        prefixes.append(word[: rng.randint(1, min(len(word), 8))])
+
+    for name, selected in (
+        ("1-2 characters", [p for p in prefixes if len(p) <= 2]),
+        ("3+ characters", [p for p in prefixes if len(p) > 2]),
+    ):
+        timings = []
+        for prefix in selected:
+            start = time.perf_counter()
+            index.suggest(prefix, limit=limit)
+            timings.append(time.perf_counter() - start)
+        timings = np.array(timings) * 1e6
+        logger.info(
+            f"  {name:<18} {len(timings):>6} prefixes, p50 {np.percentile(timings, 50):.1f}us, p99 {np.percentile(timings, 99):.1f}us, max {timings.max():.1f}us"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the autocomplete index build time and suggestion latency"
+    )
+    parser.add_argument("--scale", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=10_000)
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    benchmark(load_catalog(args.scale), args.queries, args.limit)
+
+
+if __name__ == "__main__":
+    main()
+
+# file execution command
+# python -m app.scripts.benchmark_autocomplete --scale 100
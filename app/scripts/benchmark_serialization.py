@@ -0,0 +1,142 @@
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable
+
+from bson import ObjectId
+from bson.decimal128 import Decimal128
+from fastapi.encoders import jsonable_encoder
+from fastapi.routing import serialize_response
+
+from app.core.utils import json_message, Message, ORJSONResponse
+from app.products.catalog import listing_records
+from app.products.product_models import ProductListModel, ProductModel
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def load_documents(scale: int) -> list[dict[str, Any]]:
+    """Product documents as read from mongodb, `data/product.json` repeated `scale` times"""
+    data_file_path = Path(__file__).parent.parent.parent / "data" / "product.json"
+    with open(data_file_path, "r") as products:
+        products_obj = json.load(products)
+
+    rng = random.Random(0)
+    documents = []
+    for _ in range(scale):
+        for product in products_obj:
+            rating_count = rng.randint(0, 500)
+            rating_sum = rating_count * rng.randint(1, 5)
+            documents.append(
+                {
+                    "_id": ObjectId(),
+                    "category_id": str(ObjectId()),
+                    "product_name": product["product_name"],
+                    "product_description": product["product_description"],
+                    "product_price": Decimal128(str(product["product_price"])),
+                    "product_discount": Decimal128(str(product["product_discount"])),
+                    "product_discount_type": rng.choice(["UNIT", "FIXED"]),
+                    "product_quantity": 1000,
+                    "slug": product["slug"],
+                    "image_url": product["image_url"],
+                    "location": "Nigeria",
+                    "max_age_range": rng.randint(18, 100),
+                    "rating_sum": rating_sum,
+                    "rating_count": rating_count,
+                    "avg_rating": rating_sum / rating_count if rating_count else 0,
+                    "created_at": datetime.now(),
+                    "updated_at": datetime.now(),
+                }
+            )
+    return documents
+
+
+def previous_path(documents: list[dict[str, Any]]) -> bytes:
+    """Each document validated twice, then `jsonable_encoder` and `json.dumps` as the default `JSONResponse` does"""
+    products = []
+    for doc in ProductListModel(products=documents).model_dump()["products"]:
+        product = ProductModel(**doc)
+        products.append(
+            {
+                **product.model_dump(),
+                "selling_price": product.selling_price,
+                "avg_rating": round(product.avg_rating, 2),
+            }
+        )
+    message = Message(message="", status_code=200, success=True, data=products)
+    return json.dumps(jsonable_encoder(message)).encode()
+
+
+def listing_message(documents: list[dict[str, Any]]) -> Message:
+    return Message(
+        message="", status_code=200, success=True, data=listing_records(documents)
+    )
+
+
+def message_path(documents: list[dict[str, Any]], loop) -> bytes:
+    """
+    Each document validated once, the `Message` returned from the endpoint, as FastAPI serializes it: `jsonable_encoder`
+    (endpoints have no `response_model`), then the orjson default response class
+    """
+    content = loop.run_until_complete(
+        serialize_response(response_content=listing_message(documents))
+    )
+    return ORJSONResponse(content).body
+
+
+def current_path(documents: list[dict[str, Any]]) -> bytes:
+    """Each document validated once, the endpoint returns `json_message`, encoded with orjson only"""
+    return json_message(listing_message(documents)).body
+
+
+def timed(func: Callable[[], Any], repeat: int) -> float:
+    """Best wall time of `repeat` runs"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark(documents: list[dict[str, Any]], repeat: int):
+    loop = asyncio.new_event_loop()
+    paths = (
+        ("previous", previous_path),
+        ("message", lambda i: message_path(i, loop)),
+        ("current", current_path),
+    )
+    expected = json.loads(previous_path(documents))
+    if any(json.loads(func(documents)) != expected for _, func in paths[1:]):
+        raise Exception("Every path should produce the same response")
+
+    n = len(documents)
+    for name, func in paths:
+        seconds = timed(lambda: func(documents), repeat)
+        logger.info(
+            f"  {name:<9} {n} products in {seconds * 1e3:.1f}ms, {seconds / n * 1e6:.1f}us per product"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the CPU cost of turning product documents into a JSON response"
+    )
+    parser.add_argument("--scale", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    benchmark(load_documents(args.scale), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
+
+# file execution command
+# python -m app.scripts.benchmark_serialization --scale 10
@@ -0,0 +1,95 @@
+import argparse
+import json
+import logging
+import time
+from pathlib import Path
+
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+
+from app.recommendation_systems.quantization import float_dtype, store_matrix
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def load_product_texts(scale: int) -> list[str]:
+    """
+    Product name + description for every product in `data/product.json`.
+
+    The catalog is only ~100 products, `scale` grows it by pairing product descriptions so the texts stay distinct.
+    """
+    data_file_path = Path(__file__).parent.parent.parent / "data" / "product.json"
+    with open(data_file_path, "r") as products:
+        products_obj = json.load(products)
+
+    texts = [f"{i['product_name']} {i['product_description']}" for i in products_obj]
+    if scale <= 1:
+        return texts
+
+    rng = np.random.default_rng(0)
+    n_extra = len(texts) * (scale - 1)
+    pairs = rng.integers(0, len(texts), size=(n_extra, 2))
+    return texts + [f"{texts[a]} {texts[b]}" for a, b in pairs]
+
+
+def top_n_indices(row: np.ndarray, index: int, top_n: int) -> set[int]:
+    row = np.array(row, dtype=np.float64)
+    row[index] = -np.inf
+    return set(np.argpartition(-row, top_n)[:top_n].tolist())
+
+
+def benchmark(texts: list[str], top_n: int):
+    """Compare memory and top-N ranking agreement of each storage format against float64"""
+    matrices = {}
+    for dtype in ("float64", "float32", "int8"):
+        start = time.perf_counter()
+        vectorizer = TfidfVectorizer(stop_words="english", dtype=float_dtype(dtype))
+        tfidf_matrix = vectorizer.fit_transform(texts)
+        matrices[dtype] = store_matrix(
+            cosine_similarity(tfidf_matrix, tfidf_matrix), dtype
+        )
+        logger.info(f"  {dtype}: built in {time.perf_counter() - start:.3f}s")
+
+    baseline = matrices["float64"]
+    n_products = baseline.shape[0]
+    logger.info(
+        f"  {n_products} products, agreement measured on the top {top_n} neighbours"
+    )
+    logger.info(
+        f"  {'dtype':<8} {'memory (MB)':>12} {'saved':>8} {'top-n agreement':>16} {'max abs error':>14}"
+    )
+    for dtype, matrix in matrices.items():
+        agreement = []
+        max_error = 0.0
+        for i in range(n_products):
+            expected_row = baseline[i]
+            row = matrix[i]
+            expected = top_n_indices(expected_row, i, top_n)
+            actual = top_n_indices(row, i, top_n)
+            agreement.append(len(expected & actual) / top_n)
+            max_error = max(max_error, float(np.max(np.abs(expected_row - row))))
+
+        saved = 1 - matrix.nbytes / baseline.nbytes
+        logger.info(
+            f"  {dtype:<8} {matrix.nbytes / 1e6:>12.2f} {saved:>8.1%} {np.mean(agreement):>16.4f} {max_error:>14.5f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark float64 vs float32 vs int8 similarity matrix storage"
+    )
+    parser.add_argument("--scale", type=int, default=10)
+    parser.add_argument("--top-n", type=int, default=10)
+    args = parser.parse_args()
+
+    benchmark(load_product_texts(args.scale), args.top_n)
+
+
+if __name__ == "__main__":
+    main()
+
+# file execution command
+# python -m app.scripts.benchmark_similarity_storage --scale 20
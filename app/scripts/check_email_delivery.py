@@ -0,0 +1,127 @@
+import argparse
+import asyncio
+import logging
+from email import message_from_bytes
+from email.policy import default as default_policy
+
+from aiosmtpd.controller import Controller
+from bson import ObjectId
+
+from app.core.config import settings
+from app.core.email_outbox import (
+    EmailOutboxWorker,
+    SMTPConnectionPool,
+    is_permanent_failure,
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# recipients refused by the stand-in server with a permanent 550 reply
+REFUSED_DOMAIN = "refused.example.com"
+
+
+class RecordingHandler:
+    """aiosmtpd handler keeping every received message with the client port it arrived on"""
+
+    def __init__(self):
+        self.messages = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.endswith(f"@{REFUSED_DOMAIN}"):
+            return "550 5.1.1 mailbox unavailable"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(
+            (
+                session.peer[1],
+                message_from_bytes(envelope.content, policy=default_policy),
+            )
+        )
+        return "250 Message accepted for delivery"
+
+
+def outbox_email(email_to: str, i: int) -> dict:
+    return {
+        "_id": ObjectId(),
+        "email_to": email_to,
+        "subject": f"check {i}",
+        "html_content": f"<p>email {i}</p>",
+        "attempts": 0,
+    }
+
+
+def check(handler: RecordingHandler, n: int, pool_size: int):
+    worker = EmailOutboxWorker(
+        pool=SMTPConnectionPool(size=pool_size, idle_seconds=60, timeout=10),
+        batch_size=n,
+        poll_interval=1,
+        max_attempts=1,
+        retry_base=1,
+        retry_max=1,
+        lock_seconds=60,
+    )
+    try:
+        first = [outbox_email(f"user{i}@example.com", i) for i in range(n)]
+        refused = outbox_email(f"user@{REFUSED_DOMAIN}", n)
+        results = dict(asyncio.run(worker.deliver([*first, refused])))
+
+        if any(results[i["_id"]] is not None for i in first):
+            raise Exception(f"Every email should be sent: {results}")
+        if not is_permanent_failure(results[refused["_id"]]):
+            raise Exception("A refused recipient should be a permanent failure")
+
+        received = {i["Subject"]: i for _, i in handler.messages}
+        for email in first:
+            message = received.get(email["subject"])
+            if message is None or message["To"] != email["email_to"]:
+                raise Exception(f"{email['subject']} was not received")
+            if message.get_content().strip() != email["html_content"]:
+                raise Exception(f"{email['subject']} has the wrong content")
+
+        # a second batch goes over the connections opened by the first one
+        ports = {port for port, _ in handler.messages}
+        second = [outbox_email(f"user{i}@example.com", n + 1 + i) for i in range(n)]
+        asyncio.run(worker.deliver(second))
+        if len(ports) > pool_size or {port for port, _ in handler.messages} != ports:
+            raise Exception("Connections should be reused across batches")
+    finally:
+        worker.pool.close()
+
+    logger.info(
+        f"  {len(handler.messages)} emails received over {len(ports)} connections, refused recipient not retried"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check the email outbox delivery against a local SMTP stand-in server"
+    )
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--emails", type=int, default=10)
+    parser.add_argument("--pool-size", type=int, default=2)
+    args = parser.parse_args()
+
+    # the pool connects with the app settings, pointed at the stand-in
+    settings.SMTP_HOST = "127.0.0.1"
+    settings.SMTP_PORT = args.port
+    settings.SMTP_TLS = False
+    settings.SMTP_SSL = False
+    settings.EMAILS_FROM_EMAIL = settings.EMAILS_FROM_EMAIL or "shop@example.com"
+
+    handler = RecordingHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=args.port)
+    controller.start()
+    try:
+        check(handler, args.emails, args.pool_size)
+    finally:
+        controller.stop()
+
+
+if __name__ == "__main__":
+    main()
+
+# file execution command
+# python -m app.scripts.check_email_delivery --emails 10
@@ -10,6 +10,8 @@ from app.core.utils import collection_error_msg, convert_decimal
 from app.core.security import get_code_hash
 from app.users.user_models import UserModel
 from app.core.constants import Constants
+from app.products.rating_stats import reconcile_product_rating_stats
+from app.products.catalog import bump_prices_version
 from app.products.product_models import (
     ProductModel,
     CategoryModel,
@@ -186,9 +188,12 @@ async def main():
     await load_categories()
     await load_users()
     await load_products()
+    await bump_prices_version()
     # yes, we will be executing `load_ratings()` twice ensuring there are enough ratings
     await load_ratings()
     await load_ratings()
+    # ratings are bulk inserted, backfill the rating statistics of the products
+    await reconcile_product_rating_stats()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,19 @@
+import asyncio
+import logging
+
+from app.products.rating_stats import reconcile_product_rating_stats
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def main():
+    n_rated = await reconcile_product_rating_stats()
+    logger.info(f"  rating statistics of {n_rated} rated products reconciled")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
+
+# file execution command
+# python -m app.scripts.reconcile_rating_stats
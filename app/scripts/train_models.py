@@ -0,0 +1,19 @@
+import asyncio
+import logging
+
+from app.recommendation_systems.training import train_and_publish_models
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def main():
+    version = await train_and_publish_models()
+    logger.info(f"  model version {version} is now the latest version")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
+
+# file execution command
+# python -m app.scripts.train_models
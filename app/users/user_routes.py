@@ -7,10 +7,10 @@ from datetime import datetime
 from pymongo import ReturnDocument
 
 from app.core.mailing import (
-    send_email,
     request_authcode_email,
     request_code_reset_token,
 )
+from app.core.email_outbox import enqueue_email
 from app.users.user_models import (
     UserModel,
     CreateUserDto,
@@ -31,7 +31,6 @@ from app.core.config import settings
 from app.core.security import get_code_hash, verify_code, create_access_token
 from app.core.deps import CurrentUserDep
 
-
 router = APIRouter(prefix="/user")
 
 
@@ -70,7 +69,7 @@ async def sign_up(user_dto: CreateUserDto):
         email_data = request_authcode_email(
             username=user_dto["username"], auth_code=gen_code
         )
-        send_email(
+        await enqueue_email(
             email_to=email,
             subject=email_data.subject,
             html_content=email_data.html_content,
@@ -158,7 +157,7 @@ async def code_reset_token(crtkn_dto: CodeResetTokenDto):
     try:
         # send code reset token to user via mail
         email_data = request_code_reset_token(token=tkn)
-        send_email(
+        await enqueue_email(
             email_to=crtkn_dto.email,
             subject=email_data.subject,
             html_content=email_data.html_content,